@@ -1,425 +1,396 @@
-from typing import Optional
+from typing import Optional, AsyncIterable, AsyncIterator
 from asyncua import Server, ua, uamethod
 from asyncua.common.node import Node
-from .CNC_machine import CNCMachine
-from .constants import OPC_UA_ENDPOINT
+from .CNC_machine import CNCMachine, CNCStatus
+from .CNC_machine import parse_gcode_lines
+from .constants import OPC_UA_ENDPOINT, GCODE_BUFFER_SIZE, SPOOL_DIR, JOB_QUEUE_FILE, CHECKPOINT_INTERVAL, \
+    HISTORY_SIZE, HISTORY_DB_FILE, FAST_PUBLISH_ADDR, PROFILE_DIR
+from .jobs import JobQueue, Job
+from .metrics import MetricsCollector
+from .opcua_schema import ENGINE_SCHEMA
+from .fast_publisher import FastPublisher
+from .spool import SpoolFile
+from components.scheduler import FixedRateScheduler
+from components.checkpoint import CheckpointWriter
+from components.opcua_nodes import NodeBatch, init_server, get_cache_dir
+from components.opcua_binding import OPCUABinding
+from components.opcua_history import RingBufferHistory, enable_history
+from components.profiling import Profiler
+from components.terminal import LineRenderer
 from pathlib import Path
 import asyncio
+import time
+import uuid
+import json
 
 CNCStatus_strings = ["IDLE", "WORKING", "PAUSED"]
 
 
+async def split_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of bytes chunks (e.g. a chunked http body) in text lines
+    :param chunks: the stream of chunks
+    """
+    pending = []  # chunks of the line not terminated yet, joined once (a long line is not copied at every chunk)
+    async for chunk in chunks:
+        start = 0
+        end = chunk.find(b"\n")
+        while end >= 0:
+            pending.append(chunk[start:end])
+            yield b"".join(pending).decode('utf-8')
+            pending.clear()
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield b"".join(pending).decode('utf-8')
+
+
 class Engine:
     """
     Manage terminal display and Opc-ua communication
     """
 
     current_task: Optional[asyncio.Task]
-    axes_node: Optional[Node]
-    heaters_node: Optional[Node]
-    general_node: Optional[Node]
-
-    feedrate_node: Optional[Node]
-    status_node: Optional[Node]
-    power_node: Optional[Node]
-
-    x_axis: Optional[Node]
-    x_axis_pos: Optional[Node]
-    x_axis_speed: Optional[Node]
-    x_axis_acc: Optional[Node]
-    x_axis_target_pos: Optional[Node]
-    x_axis_target_speed: Optional[Node]
-    x_axis_power: Optional[Node]
-    x_axis_settings: Optional[Node]
-    x_axis_max_speed: Optional[Node]
-    x_axis_max_acc: Optional[Node]
-
-    y_axis: Optional[Node]
-    y_axis_pos: Optional[Node]
-    y_axis_speed: Optional[Node]
-    y_axis_acc: Optional[Node]
-    y_axis_target_pos: Optional[Node]
-    y_axis_target_speed: Optional[Node]
-    y_axis_power: Optional[Node]
-    y_axis_settings: Optional[Node]
-    y_axis_max_speed: Optional[Node]
-    y_axis_max_acc: Optional[Node]
-
-    z_axis: Optional[Node]
-    z_axis_pos: Optional[Node]
-    z_axis_speed: Optional[Node]
-    z_axis_acc: Optional[Node]
-    z_axis_target_pos: Optional[Node]
-    z_axis_target_speed: Optional[Node]
-    z_axis_power: Optional[Node]
-    z_axis_settings: Optional[Node]
-    z_axis_max_speed: Optional[Node]
-    z_axis_max_acc: Optional[Node]
-
-    e_axis: Optional[Node]
-    e_axis_pos: Optional[Node]
-    e_axis_speed: Optional[Node]
-    e_axis_acc: Optional[Node]
-    e_axis_target_pos: Optional[Node]
-    e_axis_target_speed: Optional[Node]
-    e_axis_power: Optional[Node]
-    e_axis_settings: Optional[Node]
-    e_axis_max_speed: Optional[Node]
-    e_axis_max_acc: Optional[Node]
-
-    nozzle: Optional[Node]
-    nozzle_temp: Optional[Node]
-    nozzle_target_temp: Optional[Node]
-    nozzle_power: Optional[Node]
-    nozzle_setting: Optional[Node]
-    nozzle_kp: Optional[Node]
-    nozzle_ki: Optional[Node]
-    nozzle_wu: Optional[Node]
-    nozzle_settle_window: Optional[Node]
-    nozzle_settle_time: Optional[Node]
-
-    plate: Optional[Node]
-    plate_temp: Optional[Node]
-    plate_target_temp: Optional[Node]
-    plate_power: Optional[Node]
-    plate_setting: Optional[Node]
-    plate_kp: Optional[Node]
-    plate_ki: Optional[Node]
-    plate_wu: Optional[Node]
-    plate_settle_window: Optional[Node]
-    plate_settle_time: Optional[Node]
-
-    read_gcode_line: Optional[Node]
-    read_gcode_file: Optional[Node]
-    pause_gcode_file: Optional[Node]
-    resume_gcode_file: Optional[Node]
-    abort_gcode_file: Optional[Node]
-
-    def __init__(self, time_mult=1.0, time_step=0.05, draw=True):
+    buffer_task: Optional[asyncio.Task]
+    job_task: Optional[asyncio.Task]
+    server: Optional[Server]
+    opc_binding: Optional[OPCUABinding]
+    history: Optional[RingBufferHistory]
+    fast_publisher: Optional[FastPublisher]
+
+    def __init__(self, time_mult=1.0, time_step=0.05, draw=True, checkpoint_path: Optional[Path] = None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
         self.cnc_machine = CNCMachine()
         self.time_mult = time_mult
         self.time_step = time_step
 
         self.time = .0
+        self.scheduler = FixedRateScheduler(time_step, time_mult)
 
         self.tasks = []
         self.current_task = None
+        self.buffer_task = None
+        self.gcode_buffer = asyncio.Queue(maxsize=GCODE_BUFFER_SIZE)  # (abort generation, g-code command)
+        self.abort_generation = 0  # incremented by every abort, the commands sent before it are dropped
+        self.machine_lock = asyncio.Lock()
+        self.job_task = None
+        self.job_queue = JobQueue(Path(SPOOL_DIR) / JOB_QUEUE_FILE)
+        self._parse_lock = asyncio.Lock()
         self.closing = False
 
+        self.checkpoint_writer = None
+        self.resume_job_id = None
+        self.resume_line = None
+        if checkpoint_path is not None:  # periodic checkpoints of the machine, restored at startup
+            self.checkpoint_writer = CheckpointWriter(checkpoint_path, checkpoint_interval)
+            self.restore_checkpoint()
+
         self.server = None
         self.enable_draw = draw
+        self.renderer = LineRenderer() if draw else LineRenderer(max_fps=0)
 
-        # setting and measure nodes
-        self.axes_node = None
-        self.heaters_node = None
-        self.general_node = None
-
-        self.feedrate_node = None
-        self.status_node = None
-        self.power_node = None
-
-        self.x_axis = None
-        self.x_axis_pos = None
-        self.x_axis_speed = None
-        self.x_axis_acc = None
-        self.x_axis_target_pos = None
-        self.x_axis_target_speed = None
-        self.x_axis_power = None
-        self.x_axis_settings = None
-        self.x_axis_max_speed = None
-        self.x_axis_max_acc = None
-
-        self.y_axis = None
-        self.y_axis_pos = None
-        self.y_axis_speed = None
-        self.y_axis_acc = None
-        self.y_axis_target_pos = None
-        self.y_axis_target_speed = None
-        self.y_axis_power = None
-        self.y_axis_settings = None
-        self.y_axis_max_speed = None
-        self.y_axis_max_acc = None
-
-        self.z_axis = None
-        self.z_axis_pos = None
-        self.z_axis_speed = None
-        self.z_axis_acc = None
-        self.z_axis_target_pos = None
-        self.z_axis_target_speed = None
-        self.z_axis_power = None
-        self.z_axis_settings = None
-        self.z_axis_max_speed = None
-        self.z_axis_max_acc = None
-
-        self.e_axis = None
-        self.e_axis_pos = None
-        self.e_axis_speed = None
-        self.e_axis_acc = None
-        self.e_axis_target_pos = None
-        self.e_axis_target_speed = None
-        self.e_axis_power = None
-        self.e_axis_settings = None
-        self.e_axis_max_speed = None
-        self.e_axis_max_acc = None
-
-        self.nozzle = None
-        self.nozzle_temp = None
-        self.nozzle_target_temp = None
-        self.nozzle_power = None
-        self.nozzle_setting = None
-        self.nozzle_kp = None
-        self.nozzle_ki = None
-        self.nozzle_wu = None
-        self.nozzle_settle_window = None
-        self.nozzle_settle_time = None
-
-        self.plate = None
-        self.plate_temp = None
-        self.plate_target_temp = None
-        self.plate_power = None
-        self.plate_setting = None
-        self.plate_kp = None
-        self.plate_ki = None
-        self.plate_wu = None
-        self.plate_settle_window = None
-        self.plate_settle_time = None
-
-        # actions
-        self.read_gcode_line = None
-        self.read_gcode_file = None
-        self.pause_gcode_file = None
-        self.resume_gcode_file = None
-        self.abort_gcode_file = None
+        self.metrics = MetricsCollector()
+        self.opc_ua_writes = 0
+
+        self.opc_binding = None
+        self.opc_nodes: dict[str, Node] = {}  # nodes by path, e.g. "Axes/X/Current_pos"
+        self.history = None
+        # samples at FAST_PUBLISH_RATE as UDP frames, besides the OPC-UA server
+        self.fast_publisher = FastPublisher.from_address(FAST_PUBLISH_ADDR) if FAST_PUBLISH_ADDR else None
+        self.profiler = Profiler("cnc", Path(SPOOL_DIR) / PROFILE_DIR)
 
     async def server_init(self):
         """
-        Initialize the OPC-UA communication and creates nodes
+        Initialize the OPC-UA communication and creates nodes (all the nodes are added with a single call)
         """
         print("Starting opcua server...", end="\t")
         self.server = Server()
-        await self.server.init()
+        await init_server(self.server, get_cache_dir())
         self.server.set_endpoint(OPC_UA_ENDPOINT)
         uri = "http://test_cnc_machine"
         idx = await self.server.register_namespace(uri)
-        idx = ua.NodeId(0, int(idx))
-
-        self.axes_node = await self.server.nodes.objects.add_object(idx, "Axes")
-        self.heaters_node = await self.server.nodes.objects.add_object(idx, "Heaters")
-        self.general_node = await self.server.nodes.objects.add_object(idx, "General")
-
-        self.feedrate_node = await self.general_node.add_variable(idx, "Feedrate", self.cnc_machine.feedrate_override)
-        self.status_node = await self.general_node.add_variable(idx, "Status", 0)
-        self.power_node = await self.general_node.add_variable(idx, "Power", .0)
-
-        await self.feedrate_node.set_writable()
-
-        self.x_axis = await self.axes_node.add_object(idx, "X")
-        self.x_axis_pos = await self.x_axis.add_variable(idx, "Current_pos", .0)
-        self.x_axis_speed = await self.x_axis.add_variable(idx, "Current_speed", .0)
-        self.x_axis_acc = await self.x_axis.add_variable(idx, "Current_acc", .0)
-        self.x_axis_target_pos = await self.x_axis.add_variable(idx, "Target_pos", .0)
-        self.x_axis_target_speed = await self.x_axis.add_variable(idx, "Target_speed", .0)
-        self.x_axis_power = await self.x_axis.add_variable(idx, "Power", .0)
-
-        self.x_axis_settings = await self.x_axis.add_object(idx, "Settings")
-        self.x_axis_max_speed = await self.x_axis_settings.add_variable(idx, "Max_speed",
-                                                                        self.cnc_machine.x_axis.max_speed)
-        self.x_axis_max_acc = await self.x_axis_settings.add_variable(idx, "Max_acc", self.cnc_machine.x_axis.max_acc)
-
-        await self.x_axis_max_speed.set_writable()
-        await self.x_axis_max_acc.set_writable()
-
-        self.y_axis = await self.axes_node.add_object(idx, "Y")
-        self.y_axis_pos = await self.y_axis.add_variable(idx, "Current_pos", .0)
-        self.y_axis_speed = await self.y_axis.add_variable(idx, "Current_speed", .0)
-        self.y_axis_acc = await self.y_axis.add_variable(idx, "Current_acc", .0)
-        self.y_axis_target_pos = await self.y_axis.add_variable(idx, "Target_pos", .0)
-        self.y_axis_target_speed = await self.y_axis.add_variable(idx, "Target_speed", .0)
-        self.y_axis_power = await self.y_axis.add_variable(idx, "Power", .0)
-
-        self.y_axis_settings = await self.y_axis.add_object(idx, "Settings")
-        self.y_axis_max_speed = await self.y_axis_settings.add_variable(idx, "Max_speed",
-                                                                        self.cnc_machine.y_axis.max_speed)
-        self.y_axis_max_acc = await self.y_axis_settings.add_variable(idx, "Max_acc", self.cnc_machine.y_axis.max_acc)
-
-        await self.y_axis_max_speed.set_writable()
-        await self.y_axis_max_acc.set_writable()
-
-        self.z_axis = await self.axes_node.add_object(idx, "Z")
-        self.z_axis_pos = await self.z_axis.add_variable(idx, "Current_pos", .0)
-        self.z_axis_speed = await self.z_axis.add_variable(idx, "Current_speed", .0)
-        self.z_axis_acc = await self.z_axis.add_variable(idx, "Current_acc", .0)
-        self.z_axis_target_pos = await self.z_axis.add_variable(idx, "Target_pos", .0)
-        self.z_axis_target_speed = await self.z_axis.add_variable(idx, "Target_speed", .0)
-        self.z_axis_power = await self.z_axis.add_variable(idx, "Power", .0)
-
-        self.z_axis_settings = await self.z_axis.add_object(idx, "Settings")
-        self.z_axis_max_speed = await self.z_axis_settings.add_variable(idx, "Max_speed",
-                                                                        self.cnc_machine.z_axis.max_speed)
-        self.z_axis_max_acc = await self.z_axis_settings.add_variable(idx, "Max_acc", self.cnc_machine.z_axis.max_acc)
-
-        await self.z_axis_max_speed.set_writable()
-        await self.z_axis_max_acc.set_writable()
-
-        self.e_axis = await self.axes_node.add_object(idx, "E")
-        self.e_axis_pos = await self.e_axis.add_variable(idx, "Current_pos", .0)
-        self.e_axis_speed = await self.e_axis.add_variable(idx, "Current_speed", .0)
-        self.e_axis_acc = await self.e_axis.add_variable(idx, "Current_acc", .0)
-        self.e_axis_target_pos = await self.e_axis.add_variable(idx, "Target_pos", .0)
-        self.e_axis_target_speed = await self.e_axis.add_variable(idx, "Target_speed", .0)
-        self.e_axis_power = await self.e_axis.add_variable(idx, "Power", .0)
-
-        self.e_axis_settings = await self.e_axis.add_object(idx, "Settings")
-        self.e_axis_max_speed = await self.e_axis_settings.add_variable(idx, "Max_speed",
-                                                                        self.cnc_machine.e_axis.max_speed)
-        self.e_axis_max_acc = await self.e_axis_settings.add_variable(idx, "Max_acc", self.cnc_machine.e_axis.max_acc)
-
-        await self.e_axis_max_speed.set_writable()
-        await self.e_axis_max_acc.set_writable()
-
-        self.nozzle = await self.heaters_node.add_object(idx, "Nozzle")
-        self.nozzle_temp = await self.nozzle.add_variable(idx, "Temperature", .0)
-        self.nozzle_target_temp = await self.nozzle.add_variable(idx, "Target temperature", .0)
-        self.nozzle_power = await self.nozzle.add_variable(idx, "Power", .0)
-        self.nozzle_setting = await self.nozzle.add_object(idx, "Settings")
-        self.nozzle_kp = await self.nozzle_setting.add_variable(idx, "Kp", self.cnc_machine.nozzle.control.kd)
-        self.nozzle_ki = await self.nozzle_setting.add_variable(idx, "Ki", self.cnc_machine.nozzle.control.ki)
-        self.nozzle_wu = await self.nozzle_setting.add_variable(idx, "wind_up", self.cnc_machine.nozzle.control.wind_up)
-        self.nozzle_settle_window = await self.nozzle_setting.add_variable(idx, "settle_windows",
-                                                                           self.cnc_machine.nozzle.reached_temp_threshold)
-        self.nozzle_settle_time = await self.nozzle_setting.add_variable(idx, "settle_time",
-                                                                         self.cnc_machine.nozzle.reached_time_threshold)
-
-        await self.nozzle_kp.set_writable()
-        await self.nozzle_ki.set_writable()
-        await self.nozzle_wu.set_writable()
-        await self.nozzle_settle_time.set_writable()
-        await self.nozzle_settle_window.set_writable()
-
-        self.plate = await self.heaters_node.add_object(idx, "plate")
-        self.plate_temp = await self.plate.add_variable(idx, "Temperature", .0)
-        self.plate_target_temp = await self.plate.add_variable(idx, "Target temperature", .0)
-        self.plate_power = await self.plate.add_variable(idx, "Power", .0)
-        self.plate_setting = await self.plate.add_object(idx, "Settings")
-        self.plate_kp = await self.plate_setting.add_variable(idx, "Kp", self.cnc_machine.plate.control.kd)
-        self.plate_ki = await self.plate_setting.add_variable(idx, "Ki", self.cnc_machine.plate.control.ki)
-        self.plate_wu = await self.plate_setting.add_variable(idx, "wind_up", self.cnc_machine.plate.control.wind_up)
-        self.plate_settle_window = await self.plate_setting.add_variable(idx, "settle_windows",
-                                                                         self.cnc_machine.plate.reached_temp_threshold)
-        self.plate_settle_time = await self.plate_setting.add_variable(idx, "plate_windows",
-                                                                       self.cnc_machine.plate.reached_time_threshold)
-
-        await self.plate_kp.set_writable()
-        await self.plate_ki.set_writable()
-        await self.plate_wu.set_writable()
-        await self.plate_settle_time.set_writable()
-        await self.plate_settle_window.set_writable()
-
-        actions = await self.server.nodes.objects.add_object(idx, "Actions")
-
-        self.read_gcode_line = await actions.add_method(idx, "Execute g-code line", self.ua_execute_gcode_line,
-                                                        [ua.VariantType.LocalizedText])
-        self.read_gcode_file = await actions.add_method(idx, "Execute g-code file", self.ua_execute_gcode_file,
-                                                        [ua.VariantType.LocalizedText])
-        self.pause_gcode_file = await actions.add_method(idx, "Pause g-code file", self.ua_pause_gcode_execution)
-        self.resume_gcode_file = await actions.add_method(idx, "Resume g-code file", self.ua_resume_gcode_execution)
-        self.abort_gcode_file = await actions.add_method(idx, "Abort g-code file", self.abort_gcode_execution)
-
+        nodes = NodeBatch(self.server, idx)  # browse names in namespace 0, as the nodes added with ua.NodeId(0, idx)
+        objects = self.server.nodes.objects
+
+        self.opc_binding = OPCUABinding(self.server)
+        self.opc_nodes = self.opc_binding.add(nodes, objects, ENGINE_SCHEMA, lambda: self)
+
+        actions = nodes.add_object(objects, "Actions")
+        nodes.add_method(actions, "Execute g-code line", self.ua_execute_gcode_line, [ua.VariantType.LocalizedText])
+        nodes.add_method(actions, "Execute g-code file", self.ua_execute_gcode_file, [ua.VariantType.LocalizedText])
+        nodes.add_method(actions, "Pause g-code file", self.ua_pause_gcode_execution)
+        nodes.add_method(actions, "Resume g-code file", self.ua_resume_gcode_execution)
+        nodes.add_method(actions, "Abort g-code file", self.ua_abort_gcode_execution)
+        nodes.add_method(actions, "Start profiling", self.ua_start_profiling, [ua.VariantType.Double],
+                         [ua.VariantType.String])
+        nodes.add_method(actions, "Stop profiling", self.ua_stop_profiling, [], [ua.VariantType.String])
+
+        jobs_node = self.opc_nodes["Jobs"]
+        nodes.add_method(jobs_node, "Add g-code job", self.ua_add_job,
+                         [ua.VariantType.LocalizedText, ua.VariantType.Int64], [ua.VariantType.Boolean])
+        nodes.add_method(jobs_node, "Set job priority", self.ua_set_job_priority,
+                         [ua.VariantType.Int64, ua.VariantType.Int64], [ua.VariantType.Boolean])
+        nodes.add_method(jobs_node, "Move job", self.ua_move_job,
+                         [ua.VariantType.Int64, ua.VariantType.Int64], [ua.VariantType.Boolean])
+        nodes.add_method(jobs_node, "Remove job", self.ua_remove_job, [ua.VariantType.Int64], [ua.VariantType.Boolean])
+
+        await nodes.commit()
+        # positions and temperatures readable with HistoryRead, see ENGINE_SCHEMA
+        self.history = await enable_history(self.server, self.opc_binding.historized, HISTORY_SIZE,
+                                            Path(SPOOL_DIR) / HISTORY_DB_FILE if HISTORY_DB_FILE else None)
         print("ok")
+        print(self.history.report())
 
     async def update_opc_server(self):
         """
         Update opc-monitoring-nodes with the simulation value, update the simulation value with the opc-settings-nodes
+        (one batched write and one batched read, see ENGINE_SCHEMA)
         """
+        with self.profiler.span("update_opc_server"):
+            self.opc_ua_writes += await self.opc_binding.sync()
 
-        # machine -> opcua
-        await self.status_node.write_value(self.cnc_machine.status.value)
-        await self.power_node.write_value(
-            self.cnc_machine.x_axis.power +
-            self.cnc_machine.y_axis.power +
-            self.cnc_machine.z_axis.power +
-            self.cnc_machine.e_axis.power +
-            self.cnc_machine.nozzle.power +
-            self.cnc_machine.plate.power)
-
-        await self.x_axis_pos.write_value(self.cnc_machine.x_axis.get_virtual_position())
-        await self.x_axis_speed.write_value(self.cnc_machine.x_axis.current_speed)
-        await self.x_axis_acc.write_value(self.cnc_machine.x_axis.current_acc)
-        await self.x_axis_target_pos.write_value(self.cnc_machine.x_axis._target_pos)
-        await self.x_axis_target_speed.write_value(self.cnc_machine.x_axis.target_speed)
-        await self.x_axis_power.write_value(self.cnc_machine.x_axis.power)
-
-        await self.y_axis_pos.write_value(self.cnc_machine.y_axis.get_virtual_position())
-        await self.y_axis_speed.write_value(self.cnc_machine.y_axis.current_speed)
-        await self.y_axis_acc.write_value(self.cnc_machine.y_axis.current_acc)
-        await self.y_axis_target_pos.write_value(self.cnc_machine.y_axis._target_pos)
-        await self.y_axis_target_speed.write_value(self.cnc_machine.y_axis.target_speed)
-        await self.y_axis_power.write_value(self.cnc_machine.y_axis.power)
-
-        await self.z_axis_pos.write_value(self.cnc_machine.z_axis.get_virtual_position())
-        await self.z_axis_speed.write_value(self.cnc_machine.z_axis.current_speed)
-        await self.z_axis_acc.write_value(self.cnc_machine.z_axis.current_acc)
-        await self.z_axis_target_pos.write_value(self.cnc_machine.z_axis._target_pos)
-        await self.z_axis_target_speed.write_value(self.cnc_machine.z_axis.target_speed)
-        await self.z_axis_power.write_value(self.cnc_machine.z_axis.power)
-
-        await self.e_axis_pos.write_value(self.cnc_machine.e_axis.get_virtual_position())
-        await self.e_axis_speed.write_value(self.cnc_machine.e_axis.current_speed)
-        await self.e_axis_acc.write_value(self.cnc_machine.e_axis.current_acc)
-        await self.e_axis_target_pos.write_value(self.cnc_machine.e_axis._target_pos)
-        await self.e_axis_target_speed.write_value(self.cnc_machine.e_axis.target_speed)
-        await self.e_axis_power.write_value(self.cnc_machine.e_axis.power)
-
-        await self.nozzle_temp.write_value(self.cnc_machine.nozzle.current_temp)
-        await self.nozzle_target_temp.write_value(self.cnc_machine.nozzle.get_set_point_temp())
-        await self.nozzle_power.write_value(self.cnc_machine.nozzle.power)
-
-        await self.plate_temp.write_value(self.cnc_machine.plate.current_temp)
-        await self.plate_target_temp.write_value(self.cnc_machine.plate.get_set_point_temp())
-        await self.plate_power.write_value(self.cnc_machine.plate.power)
-
-        # opcua -> machine
-        self.cnc_machine.feedrate_override = await self.feedrate_node.get_value()
-        self.cnc_machine.x_axis.max_speed = await self.x_axis_max_speed.get_value()
-        self.cnc_machine.x_axis.max_acc = await self.x_axis_max_acc.get_value()
-        self.cnc_machine.y_axis.max_speed = await self.y_axis_max_speed.get_value()
-        self.cnc_machine.y_axis.max_acc = await self.y_axis_max_acc.get_value()
-        self.cnc_machine.z_axis.max_speed = await self.z_axis_max_speed.get_value()
-        self.cnc_machine.z_axis.max_acc = await self.z_axis_max_acc.get_value()
-        self.cnc_machine.e_axis.max_speed = await self.e_axis_max_speed.get_value()
-        self.cnc_machine.e_axis.max_acc = await self.e_axis_max_acc.get_value()
-
-        self.cnc_machine.nozzle.control.kd = await self.nozzle_kp.get_value()
-        self.cnc_machine.nozzle.control.ki = await self.nozzle_ki.get_value()
-        self.cnc_machine.nozzle.control.wind_up = await self.nozzle_wu.get_value()
-        self.cnc_machine.nozzle.reached_temp_threshold = await self.nozzle_settle_window.get_value()
-        self.cnc_machine.nozzle.reached_time_threshold = await self.nozzle_settle_time.get_value()
-
-        self.cnc_machine.plate.control.kd = await self.plate_kp.get_value()
-        self.cnc_machine.plate.control.ki = await self.plate_ki.get_value()
-        self.cnc_machine.plate.control.wind_up = await self.plate_wu.get_value()
-        self.cnc_machine.plate.reached_temp_threshold = await self.plate_settle_window.get_value()
-        self.cnc_machine.plate.reached_time_threshold = await self.plate_settle_time.get_value()
-
-        # self.cnc_machine.temperature = await self.temp_node.get_value()
+    def is_busy(self) -> bool:
+        """
+        :return: True if a g-code command or job is running or waiting
+        """
+        return self.machine_lock.locked() or not self.gcode_buffer.empty() or bool(self.job_queue.jobs)
+
+    def get_buffer_status(self) -> dict:
+        return {
+            "queued": self.gcode_buffer.qsize(),
+            "capacity": self.gcode_buffer.maxsize
+        }
+
+    def get_jobs_status(self) -> dict:
+        return self.job_queue.get_status(self.cnc_machine.gcode_progress / 100)
+
+    async def gcode_buffer_worker(self):
+        """
+        Execute the buffered g-code commands one at a time, waiting for the running g-code job (if any)
+        """
+        while True:
+            generation, line = await self.gcode_buffer.get()
+            try:
+                if generation != self.abort_generation:  # put by a sender waiting for room while it was aborted
+                    continue
+                async with self.machine_lock:
+                    self.current_task = asyncio.create_task(self.cnc_machine.run_gcode_line(line))
+                    await asyncio.wait([self.current_task])  # not cancelled with the worker, close waits for it
+                    if not self.current_task.cancelled() and self.current_task.exception() is not None:
+                        print(f"G-code command {line.strip()!r} failed: {self.current_task.exception()!r}")
+            finally:
+                self.gcode_buffer.task_done()
+
+    @staticmethod
+    def _read_and_parse(gcode_path: Path) -> tuple[list[str], list]:
+        with gcode_path.open("r", errors="replace") as gfile:  # as the uploads run while received (SpoolFile.lines)
+            file_lines = gfile.readlines()
+        return file_lines, parse_gcode_lines(file_lines)
+
+    async def _parse_job(self, job: Job):
+        async with self._parse_lock:
+            if job.is_parsed():
+                return
+            job.lines, job.parsed = await asyncio.to_thread(self._read_and_parse, Path(job.path))
+            self.job_queue.set_estimate(job, self.cnc_machine.estimate_gcode_time(job.parsed))
+            if job is not self.job_queue.peek() and job is not self.job_queue.current:
+                job.lines = job.parsed = None  # only the estimation is kept for the jobs far in the queue
+            job.parse_task = None
+
+    def parse_job(self, job: Job) -> asyncio.Task:
+        """
+        Read and parse the job file in a worker thread (only once at a time)
+        :param job: the job to parse
+        :return: the parsing task
+        """
+        if job.parse_task is None:
+            job.parse_task = asyncio.create_task(self._parse_job(job))
+            job.parse_task.add_done_callback(lambda task: self._parse_done(job, task))
+        return job.parse_task
+
+    @staticmethod
+    def _parse_done(job: Job, task: asyncio.Task):
+        """
+        Report the parsing errors, also of the jobs parsed in advance (the job is aborted when its turn comes)
+        """
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Job {job.job_id} ({job.name}) can not be parsed: {task.exception()!r}")
+
+    def preparse_jobs(self):
+        """
+        Parse the next job while the current one is running and estimate the jobs not yet estimated
+        """
+        for job in self.job_queue.jobs:
+            if job.spool is not None:
+                continue
+            if (job is self.job_queue.peek() and not job.is_parsed()) or job.estimated_time is None:
+                self.parse_job(job)
+
+    async def job_worker(self):
+        """
+        Execute the queued jobs back to back
+        """
+        while True:
+            await self.job_queue.wait_job()
+            async with self.machine_lock:
+                job = self.job_queue.pop()
+                if job is None:
+                    continue
+
+                if job.spool is not None:  # upload still in progress, the file is followed while it is received
+                    coro = self.cnc_machine.run_gcode_stream(job.spool.lines(), job.name, job.spool.get_progress)
+                else:
+                    try:
+                        await self.parse_job(job)
+                    except Exception:  # unreadable or invalid file (reported by _parse_done), the next jobs go on
+                        self.job_queue.done(aborted=True)
+                        self.delete_spool(job)
+                        continue
+                    start_line = None
+                    if job.job_id == self.resume_job_id:
+                        start_line = self.resume_line
+                        self.resume_job_id = None
+                    coro = self.cnc_machine.run_gcode_file(Path(job.path), job.lines, job.parsed, start_line)
+
+                self.preparse_jobs()
+                self.current_task = asyncio.create_task(coro)
+                await asyncio.wait([self.current_task])
+                job.lines = job.parsed = None
+
+                if not self.cnc_machine.shutdown:  # on shutdown the job is kept to be executed after the restart
+                    aborted = self.current_task.cancelled() or self.current_task.exception() is not None or \
+                              not self.current_task.result()
+                    self.job_queue.done(aborted)
+                    self.delete_spool(job)
+
+    @staticmethod
+    def delete_spool(job: Job):
+        """
+        Delete the file of a job uploaded in the spool directory (the other files are not touched)
+        """
+        if job.spooled:
+            Path(job.path).unlink(missing_ok=True)
+
+    def clear_gcode_buffer(self):
+        """
+        Drop the g-code commands waiting in the buffer
+        """
+        while not self.gcode_buffer.empty():
+            self.gcode_buffer.get_nowait()
+            self.gcode_buffer.task_done()
 
     async def execute_gcode_line(self, line: str):
         """
-        Execute a g-code command, the command is ignored if the machine is busy
+        Append a g-code command to the buffer, wait if the buffer is full
         :param line: gcode command to be executed
         """
-        if self.current_task is None or self.current_task.done():
-            self.current_task = asyncio.create_task(self.cnc_machine.run_gcode_line(line))
+        await self.gcode_buffer.put((self.abort_generation, line))
 
-    async def execute_gcode_file(self, file_path: str):
+    def try_execute_gcode_line(self, line: str) -> bool:
+        """
+        Append a g-code command to the buffer without waiting
+        :param line: gcode command to be executed
+        :return: False if the buffer is full (the command is dropped)
         """
-        Execute a g-code file, the command is ignored if the machine is busy
+        try:
+            self.gcode_buffer.put_nowait((self.abort_generation, line))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def execute_gcode_lines(self, lines: AsyncIterable[str]) -> int:
+        """
+        Append many g-code commands to the buffer, the stream is consumed only when there is room in the buffer. An
+        abort stops the stream: the following commands are not accepted
+        :param lines: the g-code commands
+        :return: number of commands accepted (empty lines are skipped)
+        """
+        generation = self.abort_generation
+        accepted = 0
+        async for line in lines:
+            if self.abort_generation != generation:
+                break
+            if line.strip():
+                await self.gcode_buffer.put((generation, line))
+                if self.abort_generation != generation:  # aborted while waiting for room, the command is dropped
+                    break
+                accepted += 1
+        return accepted
+
+    async def execute_gcode_file(self, file_path: str, priority=0) -> Optional[dict]:
+        """
+        Append a g-code file to the job queue
         :param file_path: path to g-code file
+        :param priority: jobs with higher priority are executed first
+        :return: the new job (None if the file does not exist)
+        """
+        gcode_path = Path(file_path)
+        if not gcode_path.is_file():
+            return None
+        job = self.job_queue.add(str(gcode_path), gcode_path.stem, priority)
+        self.preparse_jobs()
+        return job.to_dict()
+
+    async def execute_gcode_upload(self, name: str, chunks: AsyncIterable[bytes], priority=0) -> dict:
         """
-        if self.current_task is None or self.current_task.done():
-            gcode_path = Path(file_path)
-            if gcode_path.is_file():
-                self.current_task = asyncio.create_task(self.cnc_machine.run_gcode_file(gcode_path))
+        Receive a g-code file in the spool directory and append it to the job queue. If the job starts while the file
+        is still being received, it is executed while it is received
+        :param name: name of the g-code file
+        :param chunks: the content of the file
+        :param priority: jobs with higher priority are executed first
+        :return: the job, the spool file size and sha256
+        """
+        spool_dir = Path(SPOOL_DIR)
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        name = Path(name).name
+        spool = SpoolFile(spool_dir / f"{uuid.uuid4().hex[:8]}_{name}")
+        job = self.job_queue.add(str(spool.path), Path(name).stem, priority)
+        job.spool = spool
+        job.spooled = True
+
+        try:
+            async for chunk in chunks:
+                spool.write(chunk)
+        except Exception:
+            spool.abort()  # the truncated file is never executed
+            if self.job_queue.current is job:  # running or paused: aborted at once, the file is deleted when it ends
+                self.cnc_machine.pause_gcode_file = False
+                self.cnc_machine.abort_gcode_file = True
+            else:
+                self.job_queue.remove(job.job_id)
+                self.delete_spool(job)
+            raise
+        finally:
+            spool.close()
+
+        if self.job_queue.current is not job:  # not started yet, it will be executed as a regular file
+            job.spool = None
+            self.preparse_jobs()
+
+        return job.to_dict() | {
+            "size": spool.size,
+            "sha256": spool.get_sha256()
+        }
+
+    def set_job_priority(self, job_id: int, priority: int) -> bool:
+        res = self.job_queue.set_priority(job_id, priority)
+        self.preparse_jobs()
+        return res
+
+    def move_job(self, job_id: int, position: int) -> bool:
+        res = self.job_queue.move(job_id, position)
+        self.preparse_jobs()
+        return res
+
+    def remove_job(self, job_id: int) -> bool:
+        job = self.job_queue.get(job_id)
+        res = self.job_queue.remove(job_id)
+        if res:
+            self.delete_spool(job)
+        self.preparse_jobs()
+        return res
 
     async def pause_gcode_execution(self):
         """
@@ -437,8 +408,11 @@ class Engine:
 
     async def abort_gcode_execution(self):
         """
-        Abort the current g-code execution after the current line has been executed
+        Abort the current g-code execution after the current line has been executed, the buffered commands are dropped
+        and the streams of commands being received are stopped
         """
+        self.abort_generation += 1
+        self.clear_gcode_buffer()
         if self.current_task is not None and not self.current_task.done():
             self.cnc_machine.abort()
 
@@ -449,7 +423,8 @@ class Engine:
         elif isinstance(line, ua.LocalizedText):
             line = line.Text
 
-        await self.execute_gcode_line(line)
+        if not self.try_execute_gcode_line(line):  # an OPC UA call must not wait for the buffer
+            return ua.StatusCode(ua.StatusCodes.BadResourceUnavailable)
 
     @uamethod
     async def ua_execute_gcode_file(self, parent, file_path):
@@ -460,6 +435,41 @@ class Engine:
 
         await self.execute_gcode_file(file_path)
 
+    @uamethod
+    async def ua_add_job(self, parent, file_path, priority):
+        if isinstance(file_path, bytes) or isinstance(file_path, bytearray):
+            file_path = file_path.decode('utf-8')
+        elif isinstance(file_path, ua.LocalizedText):
+            file_path = file_path.Text
+
+        return await self.execute_gcode_file(file_path, priority) is not None
+
+    @uamethod
+    def ua_set_job_priority(self, parent, job_id, priority):
+        return self.set_job_priority(job_id, priority)
+
+    @uamethod
+    def ua_move_job(self, parent, job_id, position):
+        return self.move_job(job_id, position)
+
+    @uamethod
+    def ua_remove_job(self, parent, job_id):
+        return self.remove_job(job_id)
+
+    @uamethod
+    def ua_start_profiling(self, parent, duration):
+        try:
+            return str(self.profiler.start(duration))
+        except RuntimeError:  # already running
+            return ua.StatusCode(ua.StatusCodes.BadInvalidState)
+        except ValueError:
+            return ua.StatusCode(ua.StatusCodes.BadOutOfRange)
+
+    @uamethod
+    def ua_stop_profiling(self, parent):
+        self.profiler.stop()
+        return json.dumps(self.profiler.report())
+
     @uamethod
     async def ua_pause_gcode_execution(self, parent):
         await self.pause_gcode_execution()
@@ -474,9 +484,15 @@ class Engine:
 
     def draw(self):
         """
-        Print the status of the machine on the terminal
+        Print the status of the machine on the terminal (at most TERMINAL_FPS times per second, only if it changed)
         """
+        if self.renderer.due():
+            self.renderer.render(self.get_status_line())
 
+    def get_status_line(self) -> str:
+        """
+        :return: the status of the machine in one line
+        """
         s = [
             "t:{:.1f} x:{:.1f}/{:.1f} y:{:.1f}/{:.1f} z:{:.1f}/{:.1f} e:{:.1f}/{:.1f} Nozzle:{:.1f}/{:.1f} Plate:{:.1f}/{:.1f} Status: {}".format(
                 self.time,
@@ -501,14 +517,64 @@ class Engine:
         if self.cnc_machine.current_gcode_line is not None:
             s.append(self.cnc_machine.current_gcode_line.rstrip())
 
-        print(
-            "\r{}".format(" - ".join(s)), end="")
+        return " - ".join(s)
+
+    def get_checkpoint_state(self) -> dict:
+        """
+        :return: the state saved in the checkpoints
+        """
+        current = self.job_queue.current
+        return {
+            "time": self.time,
+            "machine": self.cnc_machine,
+            "job_id": current.job_id if current is not None else None,
+        }
+
+    def restore_checkpoint(self) -> bool:
+        """
+        Restore the machine and the simulation time from the checkpoint. If the job running at the checkpoint is the
+        first of the queue, it will be resumed from the line that was running
+        :return: True if a checkpoint has been restored
+        """
+        state = self.checkpoint_writer.load()
+        if state is None:
+            return False
+
+        cnc_machine = state["machine"]
+        cnc_machine.shutdown = False
+        cnc_machine.pause_gcode_file = False
+        cnc_machine.abort_gcode_file = False
+        cnc_machine.status = CNCStatus.IDLE
+        cnc_machine.current_gcode_file = None
+        cnc_machine.current_gcode_line = None
+        self.cnc_machine = cnc_machine
+        self.time = state["time"]
+        self.scheduler.set_time(self.time)
+
+        job = self.job_queue.peek()
+        if job is not None and job.job_id == state["job_id"]:
+            self.resume_job_id = job.job_id
+            self.resume_line = cnc_machine.gcode_line_index
+        print(f"Checkpoint restored (time: {self.time:.1f} s)")
+        return True
+
+    def get_queue_depth(self) -> int:
+        """
+        :return: number of g-code commands waiting or running
+        """
+        running = 1 if self.machine_lock.locked() else 0
+        return self.gcode_buffer.qsize() + len(self.job_queue.jobs) + running
 
     async def close(self):
         """
         Terminate tasks and axit the env main loop
         """
         self.cnc_machine.shutdown = True
+        self.clear_gcode_buffer()
+        if self.buffer_task is not None:
+            self.buffer_task.cancel()
+        if self.job_task is not None:
+            self.job_task.cancel()
         if self.current_task is not None:
             await self.current_task
         self.closing = True
@@ -518,14 +584,38 @@ class Engine:
         Run the env main loop. Call close to terminate the loop.
         """
 
+        self.buffer_task = asyncio.create_task(self.gcode_buffer_worker())
+        self.job_task = asyncio.create_task(self.job_worker())
+        self.preparse_jobs()
+
         async with self.server:
+            self.scheduler.start()
             while not self.closing:
-                self.cnc_machine.run(self.time)
+                tick_start = time.perf_counter()
+                with self.profiler.span("physics"):
+                    if self.fast_publisher is not None:
+                        self.fast_publisher.run(self.cnc_machine, self.time)
+                    else:
+                        self.cnc_machine.run(self.time)
                 if self.enable_draw:
-                    self.draw()
+                    with self.profiler.span("draw"):
+                        self.draw()
                     self.tasks.append(asyncio.create_task(self.update_opc_server()))
-                await asyncio.sleep(self.time_step / self.time_mult)
                 for task in self.tasks:
                     await task
                 self.tasks = []
-                self.time += self.time_step / self.time_mult
+                self.metrics.update(self.cnc_machine, time.perf_counter() - tick_start, self.get_queue_depth(),
+                                    self.opc_ua_writes, self.scheduler.overruns, self.time)
+                if self.checkpoint_writer is not None:
+                    self.checkpoint_writer.maybe_save(self.time, self.get_checkpoint_state)
+                await self.scheduler.wait_next()
+                self.time = self.scheduler.time
+
+        if self.checkpoint_writer is not None:
+            await self.checkpoint_writer.wait()
+            self.checkpoint_writer.save(self.time, self.get_checkpoint_state)
+            await self.checkpoint_writer.wait()
+        if self.fast_publisher is not None:
+            self.fast_publisher.close()
+        self.profiler.stop()  # the stacks of a running session are written
+        self.renderer.close()
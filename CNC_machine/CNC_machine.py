@@ -1,15 +1,17 @@
 import math
 import random
-from typing import Optional
+from typing import Optional, AsyncIterable, Callable
 import asyncio
 import json
 import struct
 from components.mechanic import SingleAxis
 from components.thermal import HeatingBody
+from components.checkpoint import Checkpointable
 from enum import IntEnum
 import pygcode as pgc
 from pygcode.exceptions import GCodeWordStrError
 from pathlib import Path
+from .modal import ModalState
 
 
 # constants
@@ -47,6 +49,28 @@ pgc.gcodes.GCodeMotion.param_letters.add('E')  # we need E to be a valid paramet
 pgc.gcodes.GCodeMotion.param_letters.add('F')  # we need E to be a valid parameter
 pgc.gcodes.GCodeCoordSystemOffset.param_letters = set('XYZE')
 
+MOTION_GCODES = (pgc.GCodeRapidMove, pgc.GCodeLinearMove, pgc.GCodeArcMove)  # G0, G1, G2, G3
+AXES_LETTERS = "XYZE"
+
+
+def parse_gcode_line(line: str) -> Optional[pgc.Line]:
+    """
+    :param line: g-code line
+    :return: the parsed line (None if the line is not valid g-code)
+    """
+    try:
+        return pgc.line.Line(line)
+    except GCodeWordStrError:
+        return None
+
+
+def parse_gcode_lines(lines: list[str]) -> list[Optional[pgc.Line]]:
+    """
+    :param lines: g-code lines
+    :return: the parsed lines (None for the lines that are not valid g-code)
+    """
+    return [parse_gcode_line(line) for line in lines]
+
 
 class CNCStatus(IntEnum):
     IDLE = 0
@@ -54,7 +78,7 @@ class CNCStatus(IntEnum):
     PAUSED = 2
 
 
-class CNCMachine:
+class CNCMachine(Checkpointable):
     """
     Simulation of a simple 3D printer
     """
@@ -83,11 +107,18 @@ class CNCMachine:
         self.abort_gcode_file = False
         self.current_gcode_file = None
         self.current_gcode_line = None
+        self.gcode_line_index = 0  # index of the line being executed in the current g-code file
+        self.gcode_line_origin = None  # target position at the start of that line (None between two lines)
+        self.executed_lines = 0
+        self.modal = ModalState()
         self.shutdown = False
 
     def get_pos(self) -> tuple[float, float, float, float]:
         return self.x_axis.get_virtual_position(), self.y_axis.get_virtual_position(), self.z_axis.get_virtual_position(), self.e_axis.get_virtual_position()
 
+    def get_target_pos(self) -> tuple[float, float, float, float]:
+        return self.x_axis.get_virtual_target(), self.y_axis.get_virtual_target(), self.z_axis.get_virtual_target(), self.e_axis.get_virtual_target()
+
     def get_temp(self) -> tuple[float, float]:
         return self.plate.current_temp, self.nozzle.current_temp
 
@@ -193,6 +224,13 @@ class CNCMachine:
         self.homed = True
         self.default_speed = speed
 
+    async def wait_step(self):
+        """
+        Wait while a blocking command is in progress. The physics is advanced by the simulation loop, the headless
+        simulations override this method to advance the physics themselves
+        """
+        await asyncio.sleep(0.01)
+
     async def set_plate_temp(self, temp: float, blocking=False):
         """
         :param temp: set point temperature of the plate [°C]
@@ -206,7 +244,7 @@ class CNCMachine:
 
         if blocking:
             while not self.plate.temp_reached and not self.shutdown:
-                await asyncio.sleep(0.01)
+                await self.wait_step()
 
     async def set_nozzle_temp(self, temp: float, blocking=False):
         """
@@ -220,7 +258,7 @@ class CNCMachine:
         self.nozzle.set_set_point_temp(temp)
         if blocking:
             while not self.nozzle.temp_reached and not self.shutdown:
-                await asyncio.sleep(0.01)
+                await self.wait_step()
 
     async def set_target(self,
                          x: Optional[float] = None,
@@ -282,47 +320,49 @@ class CNCMachine:
 
         if blocking:
             while self.is_moving() and not self.shutdown:
-                await asyncio.sleep(0.01)
+                await self.wait_step()
 
-    async def run_gcode_line(self, line: str):
+    async def run_gcode_line(self, line: str, gline: Optional[pgc.Line] = None,
+                             origin: Optional[tuple[float, float, float, float]] = None):
         """
         :param line: g-code line to execute
+        :param gline: the line already parsed (optional)
+        :param origin: target position at the start of the line, to execute again a line interrupted by a checkpoint
+        (the current target position if None)
         """
 
         self.current_gcode_line = line
 
-        try:
-            gline = pgc.line.Line(line)
-        except GCodeWordStrError:
+        if gline is None:
+            gline = parse_gcode_line(line)
+
+        if gline is None:
             self.current_gcode_line = None
+            self.executed_lines += 1
             return
 
         for gcode in gline.gcodes:
-            if isinstance(gcode, pgc.GCodeLinearMove):  # linear move (G1)
-                mov_dict = gcode.get_param_dict()
-                await self.set_target(
-                    x=mov_dict['X'] / 1000 if 'X' in mov_dict else None,
-                    y=mov_dict['Y'] / 1000 if 'Y' in mov_dict else None,
-                    z=mov_dict['Z'] / 1000 if 'Z' in mov_dict else None,
-                    e=mov_dict['E'] / 1000 if 'E' in mov_dict else None,
-                    speed=mov_dict['F'] / 60 / 1000 if 'F' in mov_dict else None,
-                    blocking=True
-                )
+            if isinstance(gcode, MOTION_GCODES):  # rapid, linear and arc moves (G0, G1, G2, G3)
+                speed = self.modal.get_speed(gcode.get_param_dict())
+                position = origin if origin is not None else self.get_target_pos()
+                origin = None
+                for x, y, z, e in self.modal.get_targets(gcode, position):
+                    await self.set_target(x=x, y=y, z=z, e=e, speed=speed, blocking=True)
 
             elif isinstance(gcode, pgc.GCodeCoordSystemOffset):  # coord sys offset (G92)
                 mov_dict = gcode.get_param_dict()
 
                 if 'X' in mov_dict:
-                    self.x_axis.set_offset(mov_dict['X'] / 1000)
+                    self.x_axis.set_offset(mov_dict['X'] * self.modal.unit_scale)
 
                 if 'Y' in mov_dict:
-                    self.y_axis.set_offset(mov_dict['Y'] / 1000)
+                    self.y_axis.set_offset(mov_dict['Y'] * self.modal.unit_scale)
 
                 if 'Z' in mov_dict:
-                    self.z_axis.set_offset(mov_dict['Z'] / 1000)
+                    self.z_axis.set_offset(mov_dict['Z'] * self.modal.unit_scale)
 
                 if 'E' in mov_dict:
-                    self.e_axis.set_offset(mov_dict['E'] / 1000)
+                    self.e_axis.set_offset(mov_dict['E'] * self.modal.unit_scale)
 
             elif isinstance(gcode, pgc.GCodeGotoPredefinedPosition):  # home axes (G28)
                 await self.home()
@@ -343,7 +383,11 @@ class CNCMachine:
                 mov_dict = gcode.get_param_dict()
                 await self.set_nozzle_temp(float(mov_dict['S']))
 
+            else:  # distance mode, extrusion mode and units (G90, G91, M82, M83, G20, G21)
+                self.modal.update(gcode)
+
         self.current_gcode_line = None
+        self.executed_lines += 1
 
     async def hang(self):
         """
@@ -354,33 +398,123 @@ class CNCMachine:
             await asyncio.sleep(0.5)
         self.status = CNCStatus.WORKING
 
-    async def run_gcode_file(self, gcode_path: Path):
+    async def run_gcode_stream(self, lines: AsyncIterable[str], name: str,
+                               progress: Optional[Callable[[], float]] = None,
+                               parsed: Optional[list[Optional[pgc.Line]]] = None,
+                               start_line: Optional[int] = None) -> bool:
         """
-        Execute a gcode file une line at a time
-        :param gcode_path: path of the gcode to execute
+        Execute a stream of g-code lines (e.g. a file still being received) one line at a time
+        :param lines: the g-code lines
+        :param name: name of the g-code file
+        :param progress: function returning the fraction of the stream already executed (0.0 - 1.0)
+        :param parsed: the lines already parsed (optional, in the same order of the stream)
+        :param start_line: resume from a checkpoint, the lines before this index are skipped and the line interrupted
+        by the checkpoint starts from gcode_line_origin
+        :return: False if the execution has been aborted
         """
 
-        gfile = gcode_path.open("r")
-        file_lines = gfile.readlines()
-        n_lines = len(file_lines)
-
-        self.current_gcode_file = gcode_path.stem
+        self.current_gcode_file = name
+        self.gcode_progress = 0
+        aborted = False
 
         self.status = CNCStatus.WORKING
 
-        for i, line in enumerate(file_lines):
-            self.gcode_progress = (10 + int(i / n_lines * 80))
-            await self.run_gcode_line(line)
+        origin = self.gcode_line_origin if start_line is not None else None
+        start_line = start_line or 0
+        i = 0
+        async for line in lines:
+            if i < start_line:
+                i += 1
+                continue
+            if progress is not None:
+                self.gcode_progress = int(progress() * 100)
+            self.gcode_line_index = i
+            self.gcode_line_origin = origin if origin is not None else self.get_target_pos()
+            await self.run_gcode_line(line, parsed[i] if parsed is not None else None, origin)
+            origin = None
+            i += 1
+            if not self.shutdown:  # on shutdown the line may have been interrupted
+                self.gcode_line_index = i
+                self.gcode_line_origin = None
             if self.pause_gcode_file:
                 await self.hang()
             if self.abort_gcode_file:
                 self.abort_gcode_file = False
+                aborted = True
                 break
+            if self.shutdown:
+                aborted = True
+                break
+        if self.abort_gcode_file:  # the stream ended after the abort (e.g. a failed upload)
+            self.abort_gcode_file = False
+            aborted = True
 
         self.gcode_progress = 100
         self.status = CNCStatus.IDLE
-        gfile.close()
         self.current_gcode_file = None
+        return not aborted
+
+    async def run_gcode_file(self, gcode_path: Path, file_lines: Optional[list[str]] = None,
+                             parsed: Optional[list[Optional[pgc.Line]]] = None,
+                             start_line: Optional[int] = None) -> bool:
+        """
+        Execute a gcode file une line at a time
+        :param gcode_path: path of the gcode to execute
+        :param file_lines: the lines of the file if already read
+        :param parsed: the lines already parsed (optional)
+        :param start_line: index of the first line to execute (to resume from a checkpoint, see run_gcode_stream)
+        :return: False if the execution has been aborted
+        """
+
+        if file_lines is None:
+            with gcode_path.open("r") as gfile:
+                file_lines = gfile.readlines()
+        n_lines = len(file_lines)
+        i = 0
+
+        async def iter_lines():
+            nonlocal i
+            for i, line in enumerate(file_lines):
+                yield line
+
+        return await self.run_gcode_stream(iter_lines(), gcode_path.stem, lambda: i / n_lines, parsed, start_line)
+
+    def estimate_gcode_time(self, parsed: list[Optional[pgc.Line]]) -> float:
+        """
+        Rough estimation of the execution time of a g-code file (accelerations and heating are not considered)
+        :param parsed: the parsed lines
+        :return: estimated time [s]
+        """
+        modal = ModalState(self.modal.arc_tolerance)
+        pos = [.0, .0, .0, .0]
+        max_speed = (self.x_axis.max_speed, self.y_axis.max_speed, self.z_axis.max_speed, self.e_axis.max_speed)
+        speed = self.default_speed
+        total_time = .0
+
+        for gline in parsed:
+            if gline is None:
+                continue
+            for gcode in gline.gcodes:
+                if isinstance(gcode, MOTION_GCODES):
+                    new_speed = modal.get_speed(gcode.get_param_dict())
+                    if new_speed is not None:
+                        speed = new_speed
+                    for target in modal.get_targets(gcode, tuple(pos)):
+                        deltas = [abs(t - p) if t is not None else .0 for t, p in zip(target, pos)]
+                        pos = [t if t is not None else p for t, p in zip(target, pos)]
+                        s = math.sqrt(deltas[0] ** 2 + deltas[1] ** 2 + deltas[2] ** 2) or deltas[3]
+                        if s:
+                            t = s / (speed * self.feedrate_override)
+                            total_time += max([t] + [delta / axis_speed for delta, axis_speed in
+                                                     zip(deltas, max_speed)])
+                elif isinstance(gcode, pgc.GCodeCoordSystemOffset):
+                    for axis, value in gcode.get_param_dict().items():
+                        if axis in AXES_LETTERS:
+                            pos[AXES_LETTERS.index(axis)] = value * modal.unit_scale
+                else:
+                    modal.update(gcode)
+
+        return total_time
 
     def pause(self):
         if self.status == CNCStatus.WORKING:
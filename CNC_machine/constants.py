@@ -1,6 +1,21 @@
+import os
 
 OPC_UA_ENDPOINT = "opc.tcp://0.0.0.0:4841/cnc_machine/"
 SEVER_APP_ADDR = "0.0.0.0"
 SEVER_APP_PORT = 12345
+REST_API_ENABLED = os.getenv("CNC_REST_API", "1") != "0"  # fastapi and uvicorn are not imported when disabled
 DRAW_ON_TERMINAL = True
 TIME_MULTIPLIER = 1
+GCODE_BUFFER_SIZE = 128  # g-code commands waiting for execution
+SPOOL_DIR = "spool"  # directory of the uploaded g-code files
+JOB_QUEUE_FILE = "jobs.json"  # job queue save file (in the spool directory)
+CHECKPOINT_FILE = "checkpoint.bin"  # simulation checkpoint (in the spool directory)
+CHECKPOINT_INTERVAL = 60.0  # simulated time between two checkpoints [s]
+HISTORY_SIZE = 6000  # samples of every historized OPC-UA variable kept in memory (5 minutes at 20 Hz)
+# SQLite file of the samples older than the last HISTORY_SIZE (in the spool directory), empty to discard them
+HISTORY_DB_FILE = os.getenv("CNC_HISTORY_DB", "")
+# "host:port" of the UADP frames with the 1 kHz samples (e.g. 127.0.0.1:4842 or 239.0.0.1:4842), empty to disable
+FAST_PUBLISH_ADDR = os.getenv("CNC_FAST_PUBLISH", "")
+FAST_PUBLISH_PORT = 4842  # default port of the frames
+FAST_PUBLISH_RATE = 1000.0  # samples per second of simulated time
+PROFILE_DIR = "profiles"  # collapsed stacks of the profiling sessions (in the spool directory)
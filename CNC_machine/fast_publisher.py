@@ -0,0 +1,116 @@
+"""
+High-rate publication of the axes and heaters of the CNC as UADP-style UDP frames (see components.uadp).
+
+Every tick the samples between the previous tick and the current one are computed at FAST_PUBLISH_RATE (simulated
+time): the axis positions and speeds from the motion profile of the current movement (exact, the simulation is not
+changed), the heater temperatures linearly interpolated between the two ticks. A data-acquisition client gets the full
+rate traces without loading the OPC-UA server.
+
+Receive and check the frames of a running simulator (started with CNC_FAST_PUBLISH=127.0.0.1:4842):
+
+    python -m CNC_machine.fast_publisher 127.0.0.1:4842
+"""
+from typing import Optional
+import numpy as np
+from components.uadp import UADPWriter, parse_address
+from .CNC_machine import CNCMachine
+from .constants import FAST_PUBLISH_RATE, FAST_PUBLISH_PORT
+
+# one sample: positions [m] and speeds [m/s] of the x, y, z, e axes, temperatures of the nozzle and the plate [°C]
+SAMPLE_DTYPE = np.dtype([("pos", "<f4", 4), ("speed", "<f4", 4), ("temp", "<f4", 2)])
+CNC_PUBLISHER_ID = 1
+CNC_SAMPLES_WRITER_ID = 1
+
+
+class FastPublisher:
+    """
+    Publish the samples of a CNC machine at a rate higher than the tick rate
+    """
+
+    def __init__(self, writer: UADPWriter, rate=FAST_PUBLISH_RATE):
+        """
+        :param writer: destination of the frames (with SAMPLE_DTYPE)
+        :param rate: samples per second of simulated time
+        """
+        self.writer = writer
+        self.period = 1 / rate
+        self.next_time: Optional[float] = None
+        self.last_time = .0
+        self.last_temps = (.0, .0)
+
+    @classmethod
+    def from_address(cls, address: str, rate=FAST_PUBLISH_RATE) -> "FastPublisher":
+        """
+        :param address: "host:port" or "host" (FAST_PUBLISH_PORT), unicast or multicast
+        :param rate: samples per second of simulated time
+        """
+        host, port = parse_address(address, FAST_PUBLISH_PORT)
+        return cls(UADPWriter(host, port, SAMPLE_DTYPE, CNC_PUBLISHER_ID, CNC_SAMPLES_WRITER_ID), rate)
+
+    def run(self, cnc_machine: CNCMachine, time: float):
+        """
+        Run the machine for the tick (instead of CNCMachine.run) and publish the samples since the previous tick
+        :param cnc_machine: published machine
+        :param time: simulation time [s]
+        """
+        if self.next_time is None or time < self.last_time:  # first tick, or time reset by a restore
+            self.next_time = time
+            self.last_time = time
+            self.last_temps = (cnc_machine.nozzle.current_temp, cnc_machine.plate.current_temp)
+        n_samples = int((time - self.next_time) / self.period + 1e-9) + 1 if time >= self.next_time else 0
+        times = self.next_time + np.arange(n_samples) * self.period
+        samples = np.empty(n_samples, SAMPLE_DTYPE)
+        if n_samples:  # the motion profile is sampled before the run, that can end the movement
+            for i, axis in enumerate((cnc_machine.x_axis, cnc_machine.y_axis, cnc_machine.z_axis,
+                                      cnc_machine.e_axis)):
+                samples["pos"][:, i], samples["speed"][:, i] = axis.sample(times)
+
+        cnc_machine.run(time)
+
+        if not n_samples:
+            return
+        temps = (cnc_machine.nozzle.current_temp, cnc_machine.plate.current_temp)
+        for i in range(2):
+            samples["temp"][:, i] = np.interp(times, (self.last_time, time), (self.last_temps[i], temps[i]))
+        self.writer.send(float(times[0]), self.period, samples)
+        self.next_time = float(times[-1]) + self.period
+        self.last_time = time
+        self.last_temps = temps
+
+    def close(self):
+        self.writer.close()
+
+
+if __name__ == '__main__':
+    # data-acquisition client: print the received rate, the lost frames and the last sample every second
+    import sys
+    import time
+    from components.uadp import open_receiver, decode, UADPError
+
+    host, port = parse_address(sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1", FAST_PUBLISH_PORT)
+    receiver = open_receiver(host, port)
+    receiver.settimeout(1.0)
+    print(f"Listening on {host}:{port}")
+    expected: Optional[int] = None
+    lost = received = 0
+    last_report = time.perf_counter()
+    frame = None
+    while True:
+        try:
+            frame = decode(receiver.recv(65536), SAMPLE_DTYPE)
+        except TimeoutError:
+            pass
+        except UADPError as e:
+            print(f"Invalid frame: {e}")
+        else:
+            if expected is not None and frame.sequence != expected:
+                lost += (frame.sequence - expected) & 0xFFFFFFFF
+            expected = (frame.sequence + 1) & 0xFFFFFFFF
+            received += len(frame.samples)
+        now = time.perf_counter()
+        if now - last_report >= 1.0 and frame is not None:
+            sample = frame.samples[-1]
+            print(f"t: {frame.times()[-1]:.3f} s  {received / (now - last_report):7.1f} samples/s  lost frames: "
+                  f"{lost}  pos: {np.round(sample['pos'] * 1000, 3)} mm  temp: {np.round(sample['temp'], 1)} °C")
+            received = 0
+            last_report = now
@@ -0,0 +1,263 @@
+from typing import Optional
+from enum import IntEnum
+from pathlib import Path
+from .spool import SpoolFile
+import asyncio
+import json
+import time
+
+
+class JobState(IntEnum):
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    ABORTED = 3
+
+
+JobState_strings = ["QUEUED", "RUNNING", "DONE", "ABORTED"]
+
+
+class Job:
+    """
+    A g-code file waiting in the job queue
+    """
+
+    parsed: Optional[list]
+    spool: Optional[SpoolFile]
+    parse_task: Optional[asyncio.Task]
+
+    def __init__(self, job_id: int, path: str, name: str, priority=0):
+        """
+        :param job_id: unique id of the job
+        :param path: path of the g-code file
+        :param name: name of the job
+        :param priority: jobs with higher priority are executed first
+        """
+        self.job_id = job_id
+        self.path = path
+        self.name = name
+        self.priority = priority
+        self.state = JobState.QUEUED
+        self.submitted = time.time()
+        self.estimated_time = None  # [s], known after the pre-parsing
+        self.lines = None  # raw lines, known after the pre-parsing
+        self.parsed = None  # pygcode lines, known after the pre-parsing
+        self.spool = None  # set while the file is being uploaded
+        self.spooled = False  # the file has been uploaded in the spool directory, it is deleted with the job
+        self.parse_task = None
+
+    def is_parsed(self) -> bool:
+        return self.parsed is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.job_id,
+            "path": self.path,
+            "name": self.name,
+            "priority": self.priority,
+            "state": JobState_strings[self.state],
+            "submitted": self.submitted,
+            "estimated_time": self.estimated_time,
+            "spooled": self.spooled
+        }
+
+    @classmethod
+    def from_dict(cls, in_dict: dict) -> "Job":
+        job = cls(in_dict["id"], in_dict["path"], in_dict["name"], in_dict["priority"])
+        job.submitted = in_dict["submitted"]
+        job.estimated_time = in_dict["estimated_time"]
+        job.spooled = in_dict.get("spooled", False)
+        return job
+
+
+class JobQueue:
+    """
+    Priority queue of g-code jobs, saved on file at every change so that it survives a restart
+    """
+
+    current: Optional[Job]
+
+    def __init__(self, save_path: Optional[Path] = None):
+        """
+        :param save_path: json file where the queue is saved (no persistence if None)
+        """
+        self.save_path = save_path
+        self.jobs = []
+        self.current = None
+        self._next_id = 1
+        self._changed = asyncio.Event()
+        self.version = 0  # incremented at every change, the status is serialized again only then
+        self.load()
+
+    def load(self):
+        """
+        Load the queue from the save file. A job that was running when the file was saved is queued again first
+        """
+        if self.save_path is None or not self.save_path.is_file():
+            return
+
+        with self.save_path.open("r") as f:
+            in_dict = json.load(f)
+
+        self._next_id = in_dict["next_id"]
+        self.jobs = [Job.from_dict(job_dict) for job_dict in in_dict["jobs"] if Path(job_dict["path"]).is_file()]
+
+    def save(self):
+        if self.save_path is None:
+            return
+
+        jobs = [self.current] if self.current is not None else []
+        jobs += self.jobs
+        self.save_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.save_path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump({"next_id": self._next_id, "jobs": [job.to_dict() for job in jobs]}, f)
+        tmp_path.replace(self.save_path)
+
+    def _insert(self, job: Job):
+        """
+        Insert the job after all the jobs with the same or higher priority
+        """
+        position = len(self.jobs)
+        for i, queued in enumerate(self.jobs):
+            if queued.priority < job.priority:
+                position = i
+                break
+        self.jobs.insert(position, job)
+
+    def _changed_notify(self):
+        self.version += 1
+        self.save()
+        self._changed.set()
+
+    def add(self, path: str, name: str, priority=0) -> Job:
+        """
+        :param path: path of the g-code file
+        :param name: name of the job
+        :param priority: jobs with higher priority are executed first
+        :return: the new job
+        """
+        job = Job(self._next_id, path, name, priority)
+        self._next_id += 1
+        self._insert(job)
+        self._changed_notify()
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        for job in self.jobs:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def remove(self, job_id: int) -> bool:
+        """
+        :param job_id: id of a queued job
+        :return: False if the job is not in the queue
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        self.jobs.remove(job)
+        self._changed_notify()
+        return True
+
+    def set_priority(self, job_id: int, priority: int) -> bool:
+        """
+        Change the priority of a queued job, the job is moved accordingly
+        :param job_id: id of a queued job
+        :param priority: new priority
+        :return: False if the job is not in the queue
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        self.jobs.remove(job)
+        job.priority = priority
+        self._insert(job)
+        self._changed_notify()
+        return True
+
+    def move(self, job_id: int, position: int) -> bool:
+        """
+        Move a queued job to a specific position, the priority is not changed
+        :param job_id: id of a queued job
+        :param position: new position in the queue (0 is the next job)
+        :return: False if the job is not in the queue
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        self.jobs.remove(job)
+        self.jobs.insert(max(position, 0), job)
+        self._changed_notify()
+        return True
+
+    async def wait_job(self):
+        """
+        Wait until the queue is not empty
+        """
+        while not self.jobs:
+            self._changed.clear()
+            await self._changed.wait()
+
+    def pop(self) -> Optional[Job]:
+        """
+        Remove the next job from the queue and set it as the current one
+        :return: the next job (None if the queue is empty)
+        """
+        if not self.jobs:
+            return None
+        self.current = self.jobs.pop(0)
+        self.current.state = JobState.RUNNING
+        self._changed_notify()
+        return self.current
+
+    def done(self, aborted=False):
+        """
+        Terminate the current job
+        :param aborted: True if the job has been aborted
+        """
+        if self.current is not None:
+            self.current.state = JobState.ABORTED if aborted else JobState.DONE
+            self.current = None
+            self._changed_notify()
+
+    def set_estimate(self, job: Job, estimated_time: float):
+        """
+        :param job: current or queued job
+        :param estimated_time: duration of the job [s]
+        """
+        job.estimated_time = estimated_time
+        self.version += 1
+
+    def peek(self) -> Optional[Job]:
+        return self.jobs[0] if self.jobs else None
+
+    def get_status(self, current_progress=.0) -> dict:
+        """
+        :param current_progress: completion of the current job (0.0 - 1.0)
+        :return: current and queued jobs with their ETA in seconds (None if not yet estimated)
+        """
+        eta = .0
+        current = None
+        if self.current is not None:
+            current = self.current.to_dict()
+            if self.current.estimated_time is not None:
+                eta = self.current.estimated_time * (1 - current_progress)
+                current["eta"] = eta
+            else:
+                eta = None
+                current["eta"] = None
+
+        queue = []
+        for job in self.jobs:
+            job_dict = job.to_dict()
+            if eta is not None and job.estimated_time is not None:
+                eta += job.estimated_time
+                job_dict["eta"] = eta
+            else:
+                eta = None
+                job_dict["eta"] = None
+            queue.append(job_dict)
+
+        return {"current": current, "queue": queue}
@@ -1,14 +1,22 @@
-import fastapi
-import fastapi.responses
+from components.startup import StartupTimer
+timer = StartupTimer()  # created before the other imports, so they are timed too
+
 import signal
-import uvicorn
-from .CNC_engine import Engine
-from .constants import SEVER_APP_ADDR, SEVER_APP_PORT, DRAW_ON_TERMINAL, TIME_MULTIPLIER
+from components.profiling import PROFILE_DURATION
+from .CNC_engine import Engine, split_lines
+from .constants import SEVER_APP_ADDR, SEVER_APP_PORT, DRAW_ON_TERMINAL, TIME_MULTIPLIER, REST_API_ENABLED, SPOOL_DIR, \
+    CHECKPOINT_FILE
+from pathlib import Path
 import asyncio
 
 
-async def main():
-    eng = Engine(time_mult=TIME_MULTIPLIER, draw=DRAW_ON_TERMINAL)
+def create_app(eng: Engine):
+    """
+    :param eng: the engine controlled by the REST API
+    :return: the fastapi application (fastapi is imported only when the REST API is enabled)
+    """
+    import fastapi
+    import fastapi.responses
 
     app = fastapi.FastAPI(
         title=f"CNC Machine simulator",
@@ -16,15 +24,52 @@ async def main():
         # Don't forget to synchronize with setup.py!
         version="0.1"
     )
-    await eng.server_init()
 
     @app.post("/control/execute_line")
     async def post_execute_line(line: str):
         await eng.execute_gcode_line(line)
 
+    @app.post("/control/execute_lines")
+    async def post_execute_lines(request: fastapi.Request):
+        accepted = await eng.execute_gcode_lines(split_lines(request.stream()))
+        return {"accepted": accepted} | eng.get_buffer_status()
+
+    @app.get("/control/buffer")
+    async def get_buffer():
+        return eng.get_buffer_status()
+
     @app.post("/control/execute_file")
-    async def post_execute_file(file_path: str):
-        await eng.execute_gcode_file(file_path)
+    async def post_execute_file(file_path: str, priority: int = 0):
+        job = await eng.execute_gcode_file(file_path, priority)
+        if job is None:
+            raise fastapi.HTTPException(status_code=404, detail=f"File not found: {file_path}")
+        return job
+
+    @app.post("/control/upload_file")
+    async def post_upload_file(name: str, request: fastapi.Request, priority: int = 0):
+        return await eng.execute_gcode_upload(name, request.stream(), priority)
+
+    @app.get("/jobs")
+    async def get_jobs():
+        return eng.get_jobs_status()
+
+    @app.post("/jobs/{job_id}/priority")
+    async def post_job_priority(job_id: int, priority: int):
+        if not eng.set_job_priority(job_id, priority):
+            raise fastapi.HTTPException(status_code=404, detail=f"Job not in queue: {job_id}")
+        return eng.get_jobs_status()
+
+    @app.post("/jobs/{job_id}/move")
+    async def post_job_move(job_id: int, position: int):
+        if not eng.move_job(job_id, position):
+            raise fastapi.HTTPException(status_code=404, detail=f"Job not in queue: {job_id}")
+        return eng.get_jobs_status()
+
+    @app.delete("/jobs/{job_id}")
+    async def delete_job(job_id: int):
+        if not eng.remove_job(job_id):
+            raise fastapi.HTTPException(status_code=404, detail=f"Job not in queue: {job_id}")
+        return eng.get_jobs_status()
 
     @app.post("/control/pause_gcode")
     async def post_pause_gcode():
@@ -38,26 +83,73 @@ async def main():
     async def post_abort_gcode():
         await eng.abort_gcode_execution()
 
-    config = uvicorn.Config(app, host=SEVER_APP_ADDR, port=SEVER_APP_PORT)
-    server = uvicorn.Server(config)
+    @app.get("/metrics", response_class=fastapi.responses.PlainTextResponse)
+    async def get_metrics():
+        return fastapi.responses.PlainTextResponse(eng.metrics.render(),
+                                                   media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.get("/profiler")
+    async def get_profiler():
+        return eng.profiler.report()
+
+    @app.post("/profiler/start")
+    async def post_profiler_start(seconds: float = PROFILE_DURATION):
+        try:
+            eng.profiler.start(seconds)
+        except RuntimeError as e:
+            raise fastapi.HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise fastapi.HTTPException(status_code=422, detail=str(e))
+        return eng.profiler.report()
+
+    @app.post("/profiler/stop")
+    async def post_profiler_stop():
+        await asyncio.to_thread(eng.profiler.stop)  # waits for the sampling thread to write the stacks
+        return eng.profiler.report()
 
-    def shutdown_engine(a, b):
-        eng.close()
+    @app.get("/profiler/collapsed", response_class=fastapi.responses.PlainTextResponse)
+    async def get_profiler_collapsed():
+        if eng.profiler.path is None or eng.profiler.is_running() or not eng.profiler.path.is_file():
+            raise fastapi.HTTPException(status_code=404, detail="No profiling session completed")
+        return fastapi.responses.FileResponse(eng.profiler.path, media_type="text/plain")
 
-    signal.signal(signal.SIGTERM, shutdown_engine)
-    signal.signal(signal.SIGINT, shutdown_engine)
+    return app
+
+
+async def main():
+    timer.mark("imports")
+    eng = Engine(time_mult=TIME_MULTIPLIER, draw=DRAW_ON_TERMINAL, checkpoint_path=Path(SPOOL_DIR) / CHECKPOINT_FILE)
+    timer.mark("engine")
+    await eng.server_init()
+    timer.mark("opc-ua server")
+
+    server = None
+    if REST_API_ENABLED:
+        import uvicorn
+        config = uvicorn.Config(create_app(eng), host=SEVER_APP_ADDR, port=SEVER_APP_PORT)
+        server = uvicorn.Server(config)
+        timer.mark("rest api")
+    timer.report()
+
+    def shutdown_engine():
+        asyncio.create_task(eng.close())
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, shutdown_engine)
+    loop.add_signal_handler(signal.SIGINT, shutdown_engine)
+    loop.add_signal_handler(signal.SIGUSR1, eng.profiler.toggle)
 
     engine_task = asyncio.create_task(eng.run())
 
-    server_task = asyncio.create_task(server.serve())
+    if server is not None:
+        server_task = asyncio.create_task(server.serve())
 
-    await server_task
+        await server_task
 
-    await eng.close()
+        await eng.close()
 
     await engine_task
 
 
-
 if __name__ == '__main__':
     asyncio.run(main())
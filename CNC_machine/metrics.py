@@ -0,0 +1,170 @@
+import time
+from .CNC_machine import CNCMachine
+
+TICK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)  # [s]
+AXES = ("x", "y", "z", "e")
+HEATERS = ("nozzle", "plate")
+
+
+class MetricsSnapshot:
+    """
+    Immutable copy of the values exposed on /metrics. A new snapshot is built by the simulation loop at every tick and
+    replaces the old one with a single reference assignment, so the scrapes never touch the model.
+    """
+
+    __slots__ = ("time", "status", "axes", "heaters", "gcode_lines", "gcode_lines_rate", "queue_depth",
+                 "tick_buckets", "tick_sum", "tick_count", "opc_ua_writes", "overruns")
+
+    def __init__(self, time_: float, status: int, axes: tuple, heaters: tuple, gcode_lines: int,
+                 gcode_lines_rate: float, queue_depth: int, tick_buckets: tuple, tick_sum: float, tick_count: int,
+                 opc_ua_writes: int, overruns: int):
+        """
+        :param time_: simulation time [s]
+        :param status: CNCStatus value
+        :param axes: (position [m], speed [m/s], power [W]) for every axis in AXES
+        :param heaters: (temperature [°C], target temperature [°C], heater power [W]) for every heater in HEATERS
+        :param gcode_lines: number of g-code lines executed
+        :param gcode_lines_rate: g-code lines executed per second
+        :param queue_depth: number of g-code commands waiting or running
+        :param tick_buckets: cumulative tick counts for every bound in TICK_BUCKETS
+        :param tick_sum: sum of the tick durations [s]
+        :param tick_count: number of ticks
+        :param opc_ua_writes: number of values written on the opc-ua server
+        :param overruns: number of tick deadlines missed
+        """
+        self.time = time_
+        self.status = status
+        self.axes = axes
+        self.heaters = heaters
+        self.gcode_lines = gcode_lines
+        self.gcode_lines_rate = gcode_lines_rate
+        self.queue_depth = queue_depth
+        self.tick_buckets = tick_buckets
+        self.tick_sum = tick_sum
+        self.tick_count = tick_count
+        self.opc_ua_writes = opc_ua_writes
+        self.overruns = overruns
+
+
+class MetricsCollector:
+    """
+    Collect the simulation metrics once per tick and render them in the Prometheus text exposition format
+    """
+
+    def __init__(self, rate_window=1.0):
+        """
+        :param rate_window: wall clock window used to compute the g-code lines rate [s]
+        """
+        self.rate_window = rate_window
+        self._tick_counts = [0] * len(TICK_BUCKETS)
+        self._tick_sum = .0
+        self._tick_count = 0
+        self._rate_t0 = time.monotonic()
+        self._rate_lines0 = 0
+        self._lines_rate = .0
+        self.snapshot = None
+        self._rendered_snapshot = None
+        self._rendered_text = ""
+
+    def update(self, cnc_machine: CNCMachine, tick_duration: float, queue_depth: int, opc_ua_writes: int,
+               overruns: int, sim_time: float):
+        """
+        Build a new snapshot, it must be called by the simulation loop once per tick
+        :param cnc_machine: the simulated machine
+        :param tick_duration: wall clock duration of the last tick [s]
+        :param queue_depth: number of g-code commands waiting or running
+        :param opc_ua_writes: number of values written on the opc-ua server
+        :param overruns: number of tick deadlines missed
+        :param sim_time: simulation time [s]
+        """
+        for i, bound in enumerate(TICK_BUCKETS):
+            if tick_duration <= bound:
+                self._tick_counts[i] += 1
+        self._tick_sum += tick_duration
+        self._tick_count += 1
+
+        now = time.monotonic()
+        if now - self._rate_t0 >= self.rate_window:
+            self._lines_rate = (cnc_machine.executed_lines - self._rate_lines0) / (now - self._rate_t0)
+            self._rate_t0 = now
+            self._rate_lines0 = cnc_machine.executed_lines
+
+        axes = tuple((axis.get_virtual_position(), axis.current_speed, axis.power) for axis in
+                     (cnc_machine.x_axis, cnc_machine.y_axis, cnc_machine.z_axis, cnc_machine.e_axis))
+        heaters = tuple((heater.current_temp, heater.get_set_point_temp(), heater.power_consumption) for heater in
+                        (cnc_machine.nozzle, cnc_machine.plate))
+
+        self.snapshot = MetricsSnapshot(sim_time, cnc_machine.status.value, axes, heaters, cnc_machine.executed_lines,
+                                        self._lines_rate, queue_depth, tuple(self._tick_counts), self._tick_sum,
+                                        self._tick_count, opc_ua_writes, overruns)
+
+    def render(self) -> str:
+        """
+        :return: the last snapshot in the Prometheus text exposition format (version 0.0.4)
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            return ""
+        if snapshot is self._rendered_snapshot:
+            return self._rendered_text
+
+        lines = [
+            "# HELP cnc_simulation_time_seconds Simulation time",
+            "# TYPE cnc_simulation_time_seconds gauge",
+            f"cnc_simulation_time_seconds {snapshot.time!r}",
+            "# HELP cnc_status Machine status (0: IDLE, 1: WORKING, 2: PAUSED)",
+            "# TYPE cnc_status gauge",
+            f"cnc_status {snapshot.status:d}",
+            "# HELP cnc_axis_position_meters Axis position",
+            "# TYPE cnc_axis_position_meters gauge",
+        ]
+        lines += [f'cnc_axis_position_meters{{axis="{name}"}} {axis[0]!r}' for name, axis in zip(AXES, snapshot.axes)]
+        lines += ["# HELP cnc_axis_speed_meters_per_second Axis speed",
+                  "# TYPE cnc_axis_speed_meters_per_second gauge"]
+        lines += [f'cnc_axis_speed_meters_per_second{{axis="{name}"}} {axis[1]!r}'
+                  for name, axis in zip(AXES, snapshot.axes)]
+        lines += ["# HELP cnc_axis_power_watts Axis power consumption",
+                  "# TYPE cnc_axis_power_watts gauge"]
+        lines += [f'cnc_axis_power_watts{{axis="{name}"}} {axis[2]!r}' for name, axis in zip(AXES, snapshot.axes)]
+        lines += ["# HELP cnc_heater_temperature_celsius Heater temperature",
+                  "# TYPE cnc_heater_temperature_celsius gauge"]
+        lines += [f'cnc_heater_temperature_celsius{{heater="{name}"}} {heater[0]!r}'
+                  for name, heater in zip(HEATERS, snapshot.heaters)]
+        lines += ["# HELP cnc_heater_target_temperature_celsius Heater target temperature",
+                  "# TYPE cnc_heater_target_temperature_celsius gauge"]
+        lines += [f'cnc_heater_target_temperature_celsius{{heater="{name}"}} {heater[1]!r}'
+                  for name, heater in zip(HEATERS, snapshot.heaters)]
+        lines += ["# HELP cnc_heater_power_watts Heater power consumption",
+                  "# TYPE cnc_heater_power_watts gauge"]
+        lines += [f'cnc_heater_power_watts{{heater="{name}"}} {heater[2]!r}'
+                  for name, heater in zip(HEATERS, snapshot.heaters)]
+        lines += [
+            "# HELP cnc_gcode_lines_total G-code lines executed",
+            "# TYPE cnc_gcode_lines_total counter",
+            f"cnc_gcode_lines_total {snapshot.gcode_lines:d}",
+            "# HELP cnc_gcode_lines_per_second G-code lines executed per second",
+            "# TYPE cnc_gcode_lines_per_second gauge",
+            f"cnc_gcode_lines_per_second {snapshot.gcode_lines_rate!r}",
+            "# HELP cnc_queue_depth G-code commands waiting or running",
+            "# TYPE cnc_queue_depth gauge",
+            f"cnc_queue_depth {snapshot.queue_depth:d}",
+            "# HELP cnc_tick_duration_seconds Wall clock duration of a simulation tick",
+            "# TYPE cnc_tick_duration_seconds histogram",
+        ]
+        lines += [f'cnc_tick_duration_seconds_bucket{{le="{bound!r}"}} {count:d}'
+                  for bound, count in zip(TICK_BUCKETS, snapshot.tick_buckets)]
+        lines += [
+            f'cnc_tick_duration_seconds_bucket{{le="+Inf"}} {snapshot.tick_count:d}',
+            f"cnc_tick_duration_seconds_sum {snapshot.tick_sum!r}",
+            f"cnc_tick_duration_seconds_count {snapshot.tick_count:d}",
+            "# HELP cnc_tick_overruns_total Simulation tick deadlines missed",
+            "# TYPE cnc_tick_overruns_total counter",
+            f"cnc_tick_overruns_total {snapshot.overruns:d}",
+            "# HELP cnc_opc_ua_writes_total Values written on the opc-ua server",
+            "# TYPE cnc_opc_ua_writes_total counter",
+            f"cnc_opc_ua_writes_total {snapshot.opc_ua_writes:d}",
+        ]
+
+        self._rendered_text = "\n".join(lines) + "\n"
+        self._rendered_snapshot = snapshot
+        return self._rendered_text
@@ -0,0 +1,175 @@
+from typing import Optional
+from functools import lru_cache
+import math
+import pygcode as pgc
+from components.checkpoint import Checkpointable
+
+ARC_TOLERANCE = 1e-5  # max distance between an arc and its segments [m]
+ARC_CACHE_SIZE = 4096  # number of arc shapes kept in cache
+
+
+class GCodeAbsoluteExtrusion(pgc.GCodeNonModal):
+    """M82: E axis in absolute mode"""
+    param_letters = set()
+    word_key = pgc.Word('M', 82)
+    word_letter = 'M'
+
+
+class GCodeRelativeExtrusion(pgc.GCodeNonModal):
+    """M83: E axis in relative mode"""
+    param_letters = set()
+    word_key = pgc.Word('M', 83)
+    word_letter = 'M'
+
+
+pgc.gcodes.GCodeArcMove.param_letters.update('EF')  # arcs can extrude and set the feedrate too
+
+
+@lru_cache(maxsize=ARC_CACHE_SIZE)
+def arc_segments(i: float, j: float, dx: float, dy: float, clockwise: bool,
+                 tolerance: float) -> tuple[tuple[float, float], ...]:
+    """
+    Linearize an arc in the XY plane. Everything is relative to the start point of the arc, so the same shape
+    repeated in different positions is computed only once
+    :param i: x offset of the center
+    :param j: y offset of the center
+    :param dx: x offset of the end point (a full circle if the end point is the start point)
+    :param dy: y offset of the end point
+    :param clockwise: True for G2, False for G3
+    :param tolerance: max distance between the arc and the segments
+    :return: the end points of the segments, the last one is (dx, dy)
+    """
+    r_start = math.hypot(i, j)
+    r_end = math.hypot(dx - i, dy - j)
+    a_start = math.atan2(-j, -i)
+
+    # signed angle between the start and the end radius, in (-pi, pi]
+    sweep = math.atan2(-i * (dy - j) + j * (dx - i), -i * (dx - i) - j * (dy - j))
+    if clockwise:
+        if sweep >= 0:
+            sweep -= 2 * math.pi
+    elif sweep <= 0:
+        sweep += 2 * math.pi
+
+    if r_start <= tolerance:
+        return (dx, dy),
+
+    max_angle = 2 * math.acos(1 - tolerance / r_start) if tolerance < r_start else math.pi / 2
+    n = max(math.ceil(abs(sweep) / max_angle), 1)
+
+    points = []
+    for k in range(1, n):
+        a = a_start + sweep * k / n
+        r = r_start + (r_end - r_start) * k / n
+        points.append((i + r * math.cos(a), j + r * math.sin(a)))
+    points.append((dx, dy))
+    return tuple(points)
+
+
+def arc_center_from_radius(dx: float, dy: float, r: float, clockwise: bool) -> tuple[float, float]:
+    """
+    :param dx: x offset of the end point
+    :param dy: y offset of the end point
+    :param r: radius of the arc (negative for arcs longer than half circle)
+    :param clockwise: True for G2, False for G3
+    :return: the offsets of the center (as I and J)
+    """
+    d = math.hypot(dx, dy)
+    if not d:
+        raise ValueError("Arc with radius format needs an end point different from the start point")
+    h_x2_div_d = -math.sqrt(max(4 * r * r - dx * dx - dy * dy, .0)) / d
+    if not clockwise:
+        h_x2_div_d = -h_x2_div_d
+    if r < 0:
+        h_x2_div_d = -h_x2_div_d
+    return 0.5 * (dx - dy * h_x2_div_d), 0.5 * (dy + dx * h_x2_div_d)
+
+
+class ModalState(Checkpointable):
+    """
+    Modal state of the g-code interpreter (distance mode, extrusion mode and units)
+    """
+
+    def __init__(self, arc_tolerance=ARC_TOLERANCE):
+        """
+        :param arc_tolerance: max distance between an arc and its segments [m]
+        """
+        self.relative = False  # G91
+        self.relative_extrusion = False  # M83
+        self.unit_scale = 0.001  # [m / unit], G21
+        self.arc_tolerance = arc_tolerance
+
+    def update(self, gcode: pgc.GCode) -> bool:
+        """
+        :param gcode: a g-code command
+        :return: True if the command changes the modal state
+        """
+        if isinstance(gcode, pgc.GCodeAbsoluteDistanceMode):  # G90
+            self.relative = False
+        elif isinstance(gcode, pgc.GCodeIncrementalDistanceMode):  # G91
+            self.relative = True
+        elif isinstance(gcode, pgc.GCodeUseMillimeters):  # G21
+            self.unit_scale = 0.001
+        elif isinstance(gcode, pgc.GCodeUseInches):  # G20
+            self.unit_scale = 0.0254
+        elif isinstance(gcode, GCodeAbsoluteExtrusion):  # M82
+            self.relative_extrusion = False
+        elif isinstance(gcode, GCodeRelativeExtrusion):  # M83
+            self.relative_extrusion = True
+        else:
+            return False
+        return True
+
+    def get_speed(self, mov_dict: dict) -> Optional[float]:
+        """
+        :param mov_dict: parameters of a motion command
+        :return: the speed of the movement [m/s] (None if not set)
+        """
+        return mov_dict['F'] * self.unit_scale / 60 if 'F' in mov_dict else None
+
+    def _get_axis_target(self, mov_dict: dict, axis: str, position: float, relative: bool) -> Optional[float]:
+        if axis not in mov_dict:
+            return None
+        if relative:
+            return position + mov_dict[axis] * self.unit_scale
+        return mov_dict[axis] * self.unit_scale
+
+    def get_targets(self, gcode: pgc.GCode, position: tuple[float, float, float, float]) -> list[tuple]:
+        """
+        Convert a motion command (G0, G1, G2, G3) in a list of linear movements
+        :param gcode: the motion command
+        :param position: current (x, y, z, e) target of the machine [m]
+        :return: list of (x, y, z, e) targets [m], None for the axes that do not move
+        """
+        mov_dict = gcode.get_param_dict()
+        x0, y0, z0, e0 = position
+
+        x = self._get_axis_target(mov_dict, 'X', x0, self.relative)
+        y = self._get_axis_target(mov_dict, 'Y', y0, self.relative)
+        z = self._get_axis_target(mov_dict, 'Z', z0, self.relative)
+        e = self._get_axis_target(mov_dict, 'E', e0, self.relative or self.relative_extrusion)
+
+        if not isinstance(gcode, pgc.GCodeArcMove):
+            return [(x, y, z, e)]
+
+        clockwise = isinstance(gcode, pgc.GCodeArcMoveCW)
+        dx = x - x0 if x is not None else .0
+        dy = y - y0 if y is not None else .0
+        if 'R' in mov_dict:
+            i, j = arc_center_from_radius(dx, dy, mov_dict['R'] * self.unit_scale, clockwise)
+        else:
+            i = mov_dict.get('I', .0) * self.unit_scale
+            j = mov_dict.get('J', .0) * self.unit_scale
+
+        points = arc_segments(round(i, 9), round(j, 9), round(dx, 9), round(dy, 9), clockwise, self.arc_tolerance)
+
+        n = len(points)
+        targets = []
+        for k, (px, py) in enumerate(points, 1):
+            targets.append((
+                x0 + px,
+                y0 + py,
+                z0 + (z - z0) * k / n if z is not None else None,
+                e0 + (e - e0) * k / n if e is not None else None
+            ))
+        return targets
@@ -0,0 +1,134 @@
+"""
+OPC-UA schema of the CNC machine (see components.opcua_binding). MACHINE_SCHEMA is bound to a CNCMachine, ENGINE_SCHEMA
+to the Engine, so a server can expose one machine at the root (as the CNC engine does) or N machines in N objects.
+
+Benchmark of the per-tick synchronization of N machines, one await per node against the batched binding:
+
+    python -m CNC_machine.opcua_schema
+"""
+import json
+from asyncua import ua
+from components.mechanic import SingleAxis
+from components.thermal import HeatingBody
+from components.opcua_binding import Object, Variable
+from .CNC_machine import CNCMachine
+
+AXIS_SCHEMA = [
+    Variable("Current_pos", SingleAxis.get_virtual_position, historize=True),
+    Variable("Current_speed", "current_speed"),
+    Variable("Current_acc", "current_acc"),
+    Variable("Target_pos", "_target_pos"),
+    Variable("Target_speed", "target_speed"),
+    Variable("Power", "power"),
+    Object("Settings", [
+        Variable("Max_speed", "max_speed", writable=True),
+        Variable("Max_acc", "max_acc", writable=True),
+    ]),
+]
+
+
+def heater_schema(settle_time_name="settle_time") -> list:
+    """
+    :param settle_time_name: browse name of the settle time setting (the plate historically uses "plate_windows")
+    """
+    return [
+        Variable("Temperature", "current_temp", historize=True),
+        Variable("Target temperature", HeatingBody.get_set_point_temp),
+        Variable("Power", "power"),
+        Object("Settings", [
+            Variable("Kp", "control.kd", writable=True),
+            Variable("Ki", "control.ki", writable=True),
+            Variable("wind_up", "control.wind_up", writable=True),
+            Variable("settle_windows", "reached_temp_threshold", writable=True),
+            Variable(settle_time_name, "reached_time_threshold", writable=True),
+        ]),
+    ]
+
+
+def get_total_power(cnc_machine: CNCMachine) -> float:
+    return (cnc_machine.x_axis.power + cnc_machine.y_axis.power + cnc_machine.z_axis.power + cnc_machine.e_axis.power +
+            cnc_machine.nozzle.power + cnc_machine.plate.power)
+
+
+MACHINE_SCHEMA = [
+    Object("Axes", [
+        Object("X", AXIS_SCHEMA, "x_axis"),
+        Object("Y", AXIS_SCHEMA, "y_axis"),
+        Object("Z", AXIS_SCHEMA, "z_axis"),
+        Object("E", AXIS_SCHEMA, "e_axis"),
+    ]),
+    Object("Heaters", [
+        Object("Nozzle", heater_schema(), "nozzle"),
+        Object("plate", heater_schema("plate_windows"), "plate"),
+    ]),
+]
+
+# bound to the Engine: the machine values are read from Engine.cnc_machine
+ENGINE_SCHEMA = [
+    Object("Axes", MACHINE_SCHEMA[0].children, "cnc_machine"),
+    Object("Heaters", MACHINE_SCHEMA[1].children, "cnc_machine"),
+    Object("General", [
+        Variable("Feedrate", "cnc_machine.feedrate_override", writable=True),
+        Variable("Status", lambda engine: engine.cnc_machine.status.value, varianttype=ua.VariantType.Int64),
+        Variable("Power", lambda engine: get_total_power(engine.cnc_machine)),
+        Variable("Buffer", lambda engine: engine.gcode_buffer.qsize(), varianttype=ua.VariantType.Int64),
+    ]),
+    Object("Jobs", [
+        # the ETA of the jobs is updated at every percent of the current one
+        Variable("Queue", lambda engine: json.dumps(engine.get_jobs_status()), varianttype=ua.VariantType.String,
+                 version=lambda engine: (engine.job_queue.version, int(engine.cnc_machine.gcode_progress))),
+        Variable("Queue length", lambda engine: len(engine.job_queue.jobs), varianttype=ua.VariantType.Int64),
+    ]),
+]
+
+
+if __name__ == '__main__':
+    import asyncio
+    import logging
+    import time
+    from asyncua import Server
+    from components.opcua_binding import OPCUABinding
+    from components.opcua_nodes import NodeBatch, init_server, get_cache_dir
+
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+    N_TICKS = 50
+
+    async def bench(n_machines: int):
+        server = Server()
+        await init_server(server, get_cache_dir())
+        idx = await server.register_namespace("http://test_cnc_fleet")
+        nodes = NodeBatch(server, idx)
+        binding = OPCUABinding(server)
+        machines = [CNCMachine() for _ in range(n_machines)]
+        bound = []
+        for i, cnc_machine in enumerate(machines):
+            machine_node = nodes.add_object(server.nodes.objects, f"Machine {i}")
+            bound.append(binding.add(nodes, machine_node, MACHINE_SCHEMA, lambda machine=cnc_machine: machine))
+        await nodes.commit()
+
+        # the same values written and read one node at a time, as the engine did before the binding
+        monitored = [node for machine_nodes in bound for path, node in machine_nodes.items()
+                     if "Settings" not in path and path.count("/") == 2]
+        settings = [node for machine_nodes in bound for path, node in machine_nodes.items()
+                    if "Settings/" in path]
+        t0 = time.perf_counter()
+        for _ in range(N_TICKS):
+            for node in monitored:
+                await node.write_value(.0)
+            for node in settings:
+                await node.get_value()
+        one_by_one = (time.perf_counter() - t0) / N_TICKS
+
+        t0 = time.perf_counter()
+        for _ in range(N_TICKS):
+            await binding.sync()
+        batched = (time.perf_counter() - t0) / N_TICKS
+        print(f"{n_machines}, {binding.n_monitored + binding.n_settings}, {one_by_one * 1000:.2f}, "
+              f"{batched * 1000:.2f}")
+
+    async def main():
+        print("machines, nodes, one by one [ms/tick], batched [ms/tick]")
+        for n_machines in (1, 10, 100):
+            await bench(n_machines)
+
+    asyncio.run(main())
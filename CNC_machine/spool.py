@@ -0,0 +1,100 @@
+from typing import AsyncIterator
+from pathlib import Path
+import asyncio
+import hashlib
+
+READ_CHUNK = 1 << 16  # bytes
+
+
+class SpoolFile:
+    """
+    G-code file received in the spool directory. The file can be read line by line while it is still being written,
+    so the execution can start before the upload is complete.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: path of the spool file (overwritten if it exists)
+        """
+        self.path = path
+        self.size = 0
+        self.read_bytes = 0
+        self.complete = False
+        self.aborted = False
+        self._hash = hashlib.sha256()
+        self._file = path.open("wb")
+        self._data_event = asyncio.Event()
+
+    def write(self, chunk: bytes):
+        """
+        Append a chunk to the file and wake up the reader
+        :param chunk: data received
+        """
+        self._file.write(chunk)
+        self._file.flush()
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        self._data_event.set()
+
+    def close(self):
+        """
+        Mark the file as complete, the reader stops at the end of the file
+        """
+        self._file.close()
+        self.complete = True
+        self._data_event.set()
+
+    def abort(self):
+        """
+        Stop the reader at once (the upload failed): the rest of the file is not read
+        """
+        self.aborted = True
+        self.close()
+
+    def get_sha256(self) -> str:
+        """
+        :return: hex digest of the data received so far
+        """
+        return self._hash.hexdigest()
+
+    def get_progress(self) -> float:
+        """
+        :return: fraction of the file already read (0.0 until the file is complete)
+        """
+        if not self.complete or not self.size:
+            return .0
+        return self.read_bytes / self.size
+
+    async def lines(self) -> AsyncIterator[str]:
+        """
+        Read the file one line at a time, waiting for new data until the file is complete or aborted. The bytes that
+        are not valid UTF-8 are replaced (the line is not valid g-code and it is skipped)
+        """
+        pending = []  # chunks of the line not terminated yet, joined once
+        with self.path.open("rb") as f:
+            while not self.aborted:
+                chunk = f.read(READ_CHUNK)
+                if chunk:
+                    start = 0
+                    end = chunk.find(b"\n")
+                    while end >= 0:
+                        if self.aborted:
+                            return
+                        pending.append(chunk[start:end])
+                        line = b"".join(pending)
+                        pending.clear()
+                        self.read_bytes += len(line) + 1
+                        yield line.decode('utf-8', errors="replace")
+                        start = end + 1
+                        end = chunk.find(b"\n", start)
+                    if start < len(chunk):
+                        pending.append(chunk[start:])
+                elif self.complete:
+                    break
+                else:
+                    self._data_event.clear()
+                    await self._data_event.wait()
+        if pending and not self.aborted:
+            line = b"".join(pending)
+            self.read_bytes += len(line)
+            yield line.decode('utf-8', errors="replace")
@@ -0,0 +1,281 @@
+"""
+Parameter sweeps of the CNC simulation. Every combination of parameters is simulated headless (the physics is advanced
+as fast as possible, not in real time) on every job, the simulations are distributed on a pool of processes.
+
+Example:
+
+    python -m CNC_machine.sweep -j job1 job2 -p max_speed=0.05,0.1,0.2 -p plate_kp=10,20 -o sweep.csv
+
+With --warm-up the beginning of every job is simulated once, then all the parameter sets are forked from the
+checkpoint of the warm machine.
+"""
+from typing import Optional, Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import sys
+import time
+import pygcode as pgc
+from components import checkpoint
+from .CNC_machine import CNCMachine, parse_gcode_lines
+
+GCODE_EXAMPLES_DIR = Path(__file__).parent / "gcode_examples"
+SWEEP_TIME_STEP = 0.05  # [s], same step of the real time simulation
+SWEEP_MAX_TIME = 24 * 3600.  # [s], a simulation is stopped after this simulated time
+
+RESULT_FIELDS = ("job", "completed", "job_time", "energy", "peak_plate_temp", "peak_nozzle_temp", "lines",
+                 "wall_time")
+
+
+def _set_xy(attribute: str) -> Callable[[CNCMachine, float], None]:
+    def setter(cnc_machine: CNCMachine, value: float):
+        for axis in (cnc_machine.x_axis, cnc_machine.y_axis):
+            setattr(axis, attribute, value)
+    return setter
+
+
+def _set_axis(axis_name: str, attribute: str) -> Callable[[CNCMachine, float], None]:
+    def setter(cnc_machine: CNCMachine, value: float):
+        setattr(getattr(cnc_machine, axis_name), attribute, value)
+    return setter
+
+
+def _set_control(heater_name: str, attribute: str) -> Callable[[CNCMachine, float], None]:
+    def setter(cnc_machine: CNCMachine, value: float):
+        setattr(getattr(cnc_machine, heater_name).control, attribute, value)
+    return setter
+
+
+def _set_feedrate_override(cnc_machine: CNCMachine, value: float):
+    cnc_machine.feedrate_override = value
+
+
+# parameters that can be swept: name -> function that applies the value to a new machine
+PARAMETERS: dict[str, Callable[[CNCMachine, float], None]] = {
+    "max_speed": _set_xy("max_speed"),  # x and y axes [m/s]
+    "max_acc": _set_xy("max_acc"),  # x and y axes [m/s^2]
+    "feedrate_override": _set_feedrate_override,
+    "plate_kp": _set_control("plate", "kd"),
+    "plate_ki": _set_control("plate", "ki"),
+    "nozzle_kp": _set_control("nozzle", "kd"),
+    "nozzle_ki": _set_control("nozzle", "ki"),
+    "plate_wind_up": _set_control("plate", "wind_up"),
+    "nozzle_wind_up": _set_control("nozzle", "wind_up"),
+}
+for _axis in "xyze":
+    PARAMETERS[f"{_axis}_max_speed"] = _set_axis(f"{_axis}_axis", "max_speed")
+    PARAMETERS[f"{_axis}_max_acc"] = _set_axis(f"{_axis}_axis", "max_acc")
+
+
+class HeadlessCNCMachine(CNCMachine):
+    """
+    CNC machine that advances its own physics while waiting for the blocking commands, so a job is simulated as fast
+    as the cpu allows. It also integrates the energy consumption and records the peak temperatures.
+    """
+
+    def __init__(self, time_step=SWEEP_TIME_STEP, max_time=SWEEP_MAX_TIME):
+        """
+        :param time_step: simulation time step [s]
+        :param max_time: the job is aborted when the simulation time reaches this value [s]
+        """
+        super().__init__()
+        self.time_step = time_step
+        self.max_time = max_time
+        self.time = .0
+        self.energy = .0  # [J]
+        self.peak_plate_temp = self.plate.current_temp
+        self.peak_nozzle_temp = self.nozzle.current_temp
+        self.timed_out = False
+
+    def run(self, time: float):
+        dt = time - self.time
+        super().run(time)
+        self.time = time
+
+        power = self.plate.power_consumption + self.nozzle.power_consumption
+        for axis in (self.x_axis, self.y_axis, self.z_axis, self.e_axis):
+            if axis.power > 0:  # the braking energy is not recovered
+                power += axis.power
+        self.energy += power * dt
+
+        if self.plate.current_temp > self.peak_plate_temp:
+            self.peak_plate_temp = self.plate.current_temp
+        if self.nozzle.current_temp > self.peak_nozzle_temp:
+            self.peak_nozzle_temp = self.nozzle.current_temp
+
+    async def wait_step(self):
+        self.run(self.time + self.time_step)
+        if self.time >= self.max_time:
+            self.timed_out = True
+            self.shutdown = True
+
+
+_worker_jobs: dict[str, tuple[list[str], list[Optional[pgc.Line]]]] = {}  # jobs already parsed by this process
+
+
+def _get_job(path: str) -> tuple[list[str], list[Optional[pgc.Line]]]:
+    """
+    :param path: path of the g-code file
+    :return: the lines of the file and the parsed lines, each process parses a file only once
+    """
+    if path not in _worker_jobs:
+        with open(path, "r") as f:
+            lines = f.readlines()
+        _worker_jobs[path] = lines, parse_gcode_lines(lines)
+    return _worker_jobs[path]
+
+
+def warm_up(path: str, n_lines: int, time_step=SWEEP_TIME_STEP, max_time=SWEEP_MAX_TIME) -> bytes:
+    """
+    Simulate the beginning of a job with the default parameters
+    :param path: path of the g-code file
+    :param n_lines: number of lines to execute
+    :param time_step: simulation time step [s]
+    :param max_time: the job is aborted when the simulation time reaches this value [s]
+    :return: the checkpoint of the machine after the lines
+    """
+    lines, parsed = _get_job(path)
+    cnc_machine = HeadlessCNCMachine(time_step, max_time)
+    asyncio.run(cnc_machine.run_gcode_file(Path(path), lines[:n_lines], parsed[:n_lines]))
+    return cnc_machine.snapshot()
+
+
+def simulate_job(path: str, parameters: dict[str, float], time_step=SWEEP_TIME_STEP,
+                 max_time=SWEEP_MAX_TIME, warm_checkpoint: Optional[bytes] = None) -> dict:
+    """
+    Simulate a job headless with a set of parameters
+    :param path: path of the g-code file
+    :param parameters: parameter name (see PARAMETERS) -> value
+    :param time_step: simulation time step [s]
+    :param max_time: the job is aborted when the simulation time reaches this value [s]
+    :param warm_checkpoint: checkpoint returned by warm_up, the job continues from there (the warm up time is
+    included in the job time)
+    :return: the parameters and the results of the simulation (see RESULT_FIELDS)
+    """
+    wall_t0 = time.perf_counter()
+    lines, parsed = _get_job(path)
+
+    if warm_checkpoint is None:
+        cnc_machine = HeadlessCNCMachine(time_step, max_time)
+        start_line = None
+    else:
+        cnc_machine = checkpoint.loads(warm_checkpoint)
+        start_line = cnc_machine.gcode_line_index
+    for name, value in parameters.items():
+        PARAMETERS[name](cnc_machine, value)
+
+    completed = asyncio.run(cnc_machine.run_gcode_file(Path(path), lines, parsed, start_line))
+
+    return parameters | {
+        "job": Path(path).stem,
+        "completed": completed,
+        "job_time": cnc_machine.time,
+        "energy": cnc_machine.energy,
+        "peak_plate_temp": cnc_machine.peak_plate_temp,
+        "peak_nozzle_temp": cnc_machine.peak_nozzle_temp,
+        "lines": cnc_machine.executed_lines,
+        "wall_time": time.perf_counter() - wall_t0
+    }
+
+
+def parameter_grid(values: dict[str, list[float]]) -> list[dict[str, float]]:
+    """
+    :param values: parameter name -> values to test
+    :return: all the combinations of the values
+    """
+    for name in values:
+        if name not in PARAMETERS:
+            raise KeyError(f"Unknown parameter: {name}")
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def run_sweep(paths: Iterable[str], parameter_sets: list[dict[str, float]], workers: Optional[int] = None,
+              time_step=SWEEP_TIME_STEP, max_time=SWEEP_MAX_TIME, warm_up_lines=0) -> Iterator[dict]:
+    """
+    Simulate every job with every parameter set on a pool of processes
+    :param paths: paths of the g-code files
+    :param parameter_sets: parameter sets to test
+    :param workers: number of processes (number of cpus if None)
+    :param time_step: simulation time step [s]
+    :param max_time: a simulation is aborted when the simulation time reaches this value [s]
+    :param warm_up_lines: the first lines of every job are simulated once with the default parameters, then the
+    parameter sets are forked from the warm machine (0 to simulate every job from the start)
+    :return: the results in order of completion
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        warm_checkpoints = {}
+        if warm_up_lines:
+            warm_futures = {str(path): executor.submit(warm_up, str(path), warm_up_lines, time_step, max_time)
+                            for path in paths}
+            warm_checkpoints = {path: future.result() for path, future in warm_futures.items()}
+
+        # the simulations are submitted job after job, so every process tends to work on the files it already parsed
+        futures = [executor.submit(simulate_job, str(path), parameters, time_step, max_time,
+                                   warm_checkpoints.get(str(path)))
+                   for path in paths for parameters in parameter_sets]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_job_path(job: str) -> str:
+    path = Path(job)
+    if not path.is_file():
+        path = GCODE_EXAMPLES_DIR / f"{job}.gcode"
+    if not path.is_file():
+        raise argparse.ArgumentTypeError(f"Job not found: {job}")
+    return str(path)
+
+
+def _parameter_values(arg: str) -> tuple[str, list[float]]:
+    name, _, values = arg.partition("=")
+    if name not in PARAMETERS:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name}, available: {', '.join(PARAMETERS)}")
+    try:
+        return name, [float(value) for value in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid values for {name}: {values}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweeps of the CNC simulation")
+    parser.add_argument("-j", "--jobs", nargs="+", type=get_job_path,
+                        default=sorted(str(path) for path in GCODE_EXAMPLES_DIR.glob("*.gcode")),
+                        help="g-code files or names of the examples (default: all the examples)")
+    parser.add_argument("-p", "--parameter", action="append", type=_parameter_values, default=[],
+                        metavar="NAME=V1,V2,...", help="values of a parameter, can be repeated")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument("-o", "--output", type=Path, help="csv file (default: stdout)")
+    parser.add_argument("--time-step", type=float, default=SWEEP_TIME_STEP, help="simulation time step [s]")
+    parser.add_argument("--max-time", type=float, default=SWEEP_MAX_TIME, help="max simulated time of a job [s]")
+    parser.add_argument("--warm-up", type=int, default=0, metavar="LINES",
+                        help="simulate the first LINES of every job once and fork the parameter sets from there")
+    args = parser.parse_args()
+
+    values = dict(args.parameter)
+    parameter_sets = parameter_grid(values)
+
+    out_file = args.output.open("w", newline="") if args.output is not None else sys.stdout
+    try:
+        writer = csv.DictWriter(out_file, fieldnames=list(values) + list(RESULT_FIELDS))
+        writer.writeheader()
+        for result in run_sweep(args.jobs, parameter_sets, args.workers, args.time_step, args.max_time, args.warm_up):
+            writer.writerow(result)
+            out_file.flush()
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+
+
+if __name__ == '__main__':
+    # use the importable module, so the machines in the checkpoints are pickled as CNC_machine.sweep classes
+    from CNC_machine.sweep import main as sweep_main
+    sweep_main()
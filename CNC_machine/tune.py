@@ -0,0 +1,125 @@
+"""
+Offline auto-tuning of the PI gains of the nozzle and plate heaters. The gains are tuned on the heating steps that the
+jobs wait for (M109 and M190, found simulating the beginning of the jobs), then every job is simulated headless with
+the current and the tuned gains to measure the time saved.
+
+Example:
+
+    python -m CNC_machine.tune -j job1 job2 --max-overshoot 1.0
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import re
+from components.tuning import PITuner
+from .CNC_machine import CNCMachine
+from .sweep import GCODE_EXAMPLES_DIR, HeadlessCNCMachine, run_sweep, get_job_path
+
+BLOCKING_TEMP_RE = re.compile(r"^\s*(M109|M190)\b", re.IGNORECASE)
+
+
+class PreambleCNCMachine(HeadlessCNCMachine):
+    """
+    Headless machine that records the temperature steps the job waits for: (set point, time of the set point change,
+    time between the set point change and the blocking command)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.steps = {"nozzle": [], "plate": []}
+        self._set_time = {"nozzle": .0, "plate": .0}
+
+    def _record_step(self, heater_name: str, temp: float, blocking: bool):
+        if not temp:
+            return
+        heater = getattr(self, heater_name)
+        if temp != heater.get_set_point_temp():
+            self._set_time[heater_name] = self.time
+        if blocking:
+            self.steps[heater_name].append((temp, self._set_time[heater_name], self.time - self._set_time[heater_name]))
+
+    async def set_plate_temp(self, temp: float, blocking=False):
+        self._record_step("plate", temp, blocking)
+        await super().set_plate_temp(temp, blocking)
+
+    async def set_nozzle_temp(self, temp: float, blocking=False):
+        self._record_step("nozzle", temp, blocking)
+        await super().set_nozzle_temp(temp, blocking)
+
+
+def get_heating_steps(paths: list[str]) -> dict[str, list[tuple[float, float, float]]]:
+    """
+    Simulate the jobs up to the last command that waits for a temperature (M109, M190)
+    :param paths: paths of the g-code files
+    :return: heater name -> (set point [°C], time of the set point change [s], delay of the blocking command [s]) of
+    the steps the jobs wait for
+    """
+    steps = {"nozzle": set(), "plate": set()}
+    for path in paths:
+        with open(path, "r") as f:
+            lines = f.readlines()
+        last = max((i for i, line in enumerate(lines) if BLOCKING_TEMP_RE.match(line)), default=-1)
+        cnc_machine = PreambleCNCMachine()
+        asyncio.run(cnc_machine.run_gcode_file(Path(path), lines[:last + 1]))
+        for heater_name, heater_steps in cnc_machine.steps.items():
+            steps[heater_name].update((temp, round(start, 3), round(delay, 3)) for temp, start, delay in heater_steps)
+    return {heater_name: sorted(heater_steps) for heater_name, heater_steps in steps.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auto-tuning of the PI gains of the CNC heaters")
+    parser.add_argument("-j", "--jobs", nargs="+", type=get_job_path,
+                        default=sorted(str(path) for path in GCODE_EXAMPLES_DIR.glob("*.gcode")),
+                        help="g-code files or names of the examples (default: all the examples)")
+    parser.add_argument("--max-overshoot", type=float, default=1.0, help="max temperature overshoot [°C]")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="number of processes used to simulate the jobs")
+    parser.add_argument("--no-jobs", action="store_true", help="do not simulate the jobs to compute the time saved")
+    args = parser.parse_args()
+
+    cnc_machine = CNCMachine()
+    heating_steps = get_heating_steps(args.jobs)
+
+    current = {}
+    tuned = {}
+    for name, body in (("nozzle", cnc_machine.nozzle), ("plate", cnc_machine.plate)):
+        steps = heating_steps[name]
+        current |= {f"{name}_kp": body.control.kd, f"{name}_ki": body.control.ki,
+                    f"{name}_wind_up": body.control.wind_up}
+        if not steps:
+            print(f"{name}: no blocking set point in the jobs, not tuned")
+            tuned |= {f"{name}_kp": body.control.kd, f"{name}_ki": body.control.ki,
+                      f"{name}_wind_up": body.control.wind_up}
+            continue
+
+        tuner = PITuner(body, steps, args.max_overshoot)
+        current_cost = tuner.cost(body.control.kd, body.control.ki, body.control.wind_up)
+        kp, ki, wind_up = tuner.tune()
+        tuned_cost = tuner.cost(kp, ki, wind_up)
+        tuned |= {f"{name}_kp": kp, f"{name}_ki": ki, f"{name}_wind_up": wind_up}
+
+        steps_str = ", ".join(f"{temp:g} °C at {start:g} s waited after {delay:g} s" for temp, start, delay in steps)
+        print(f"{name} (steps {steps_str}, {tuner.evaluations} simulations):")
+        print(f"  current: kp={body.control.kd:g} ki={body.control.ki:g} wind_up={body.control.wind_up:g}, "
+              f"settle time {current_cost[1]:.1f} s, overshoot above limit {current_cost[0]:.2f} °C")
+        print(f"  tuned:   kp={kp:.4g} ki={ki:.4g} wind_up={wind_up:.4g}, "
+              f"settle time {tuned_cost[1]:.1f} s, overshoot above limit {tuned_cost[0]:.2f} °C")
+
+    if args.no_jobs:
+        return
+
+    results = {}
+    for result in run_sweep(args.jobs, [current, tuned], args.workers):
+        results[(result["job"], tuple(result[key] for key in current))] = result
+
+    print("job, current time [s], tuned time [s], time saved [s]")
+    for path in args.jobs:
+        job = Path(path).stem
+        current_time = results[(job, tuple(current.values()))]["job_time"]
+        tuned_time = results[(job, tuple(tuned.values()))]["job_time"]
+        print(f"{job}, {current_time:.1f}, {tuned_time:.1f}, {current_time - tuned_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmarks of the simulators: physics models, payload encoding and end-to-end ticks with the protocol stacks.
+
+Every benchmark is a function registered with the benchmark decorator that returns a Result (a rate, e.g. calls per
+second, higher is better). The dependencies are imported inside the functions: a benchmark whose dependency is missing
+is reported as skipped. The results are saved as JSON, so two runs can be compared:
+
+    python -m benchmarks -o before.json
+    python -m benchmarks -o after.json --compare before.json
+"""
+from typing import Optional, Callable, Awaitable
+from datetime import datetime, timezone
+from pathlib import Path
+import fnmatch
+import json
+import platform
+import subprocess
+import time
+import traceback
+
+BENCH_MIN_TIME = 0.5  # time spent measuring every benchmark [s]
+BENCH_REPEAT = 3  # the measuring time is split in repeats, the best one is kept
+REGRESSION_THRESHOLD = 0.15  # a rate lower than the baseline by more than this fraction is a regression
+RESULTS_VERSION = 1
+
+
+class Result:
+    """
+    Rate measured by a benchmark
+    """
+
+    def __init__(self, operations: int, seconds: float, unit="ops/s"):
+        """
+        :param operations: operations executed in the best repeat
+        :param seconds: duration of the best repeat [s]
+        :param unit: unit of the rate
+        """
+        self.operations = operations
+        self.seconds = seconds
+        self.unit = unit
+
+    @property
+    def rate(self) -> float:
+        return self.operations / self.seconds if self.seconds > 0 else .0
+
+
+class Benchmark:
+    def __init__(self, name: str, function: Callable[[float], Result], group: str):
+        self.name = name
+        self.function = function
+        self.group = group
+
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark, the function gets the measuring time [s] and returns a Result
+    :param name: "group.name", e.g. "physics.single_axis_run"
+    """
+    def register(function: Callable[[float], Result]) -> Callable[[float], Result]:
+        BENCHMARKS[name] = Benchmark(name, function, name.partition(".")[0])
+        return function
+
+    return register
+
+
+def measure(function: Callable[[], Optional[int]], min_time=BENCH_MIN_TIME, repeat=BENCH_REPEAT,
+            unit="ops/s") -> Result:
+    """
+    Call the function repeatedly for min_time
+    :param function: executes some operations, returns how many (None for 1)
+    :param min_time: measuring time [s]
+    :param repeat: number of repeats, the fastest is kept
+    :param unit: unit of the rate
+    """
+    best = None
+    for _ in range(repeat):
+        operations = 0
+        t0 = time.perf_counter()
+        elapsed = .0
+        while elapsed < min_time / repeat:
+            done = function()
+            operations += 1 if done is None else done
+            elapsed = time.perf_counter() - t0
+        if best is None or operations / elapsed > best.rate:
+            best = Result(operations, elapsed, unit)
+    return best
+
+
+async def measure_async(function: Callable[[], Awaitable[Optional[int]]], min_time=BENCH_MIN_TIME,
+                        repeat=BENCH_REPEAT, unit="ops/s") -> Result:
+    """
+    Same as measure, for a coroutine function (awaited in the running loop)
+    """
+    best = None
+    for _ in range(repeat):
+        operations = 0
+        t0 = time.perf_counter()
+        elapsed = .0
+        while elapsed < min_time / repeat:
+            done = await function()
+            operations += 1 if done is None else done
+            elapsed = time.perf_counter() - t0
+        if best is None or operations / elapsed > best.rate:
+            best = Result(operations, elapsed, unit)
+    return best
+
+
+def load_all():
+    """
+    Import the modules that register the benchmarks
+    """
+    from . import physics, protocol, end_to_end  # noqa: F401
+
+
+def select(patterns: Optional[list[str]] = None) -> list[Benchmark]:
+    """
+    :param patterns: shell patterns of the names (e.g. "physics.*"), None for all
+    """
+    load_all()
+    if not patterns:
+        return list(BENCHMARKS.values())
+    return [bench for name, bench in BENCHMARKS.items() if any(fnmatch.fnmatch(name, p) for p in patterns)]
+
+
+def run_benchmark(bench: Benchmark, min_time=BENCH_MIN_TIME) -> dict:
+    """
+    :return: the result as saved in the JSON file, status "ok", "skipped" (missing dependency) or "error"
+    """
+    entry = {"name": bench.name, "group": bench.group}
+    try:
+        result = bench.function(min_time)
+    except ImportError as e:
+        return entry | {"status": "skipped", "reason": f"{type(e).__name__}: {e}"}
+    except Exception as e:
+        traceback.print_exc()
+        return entry | {"status": "error", "reason": f"{type(e).__name__}: {e}"}
+    return entry | {"status": "ok", "rate": result.rate, "unit": result.unit, "operations": result.operations,
+                    "seconds": result.seconds}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def make_report(results: list[dict]) -> dict:
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def save_report(path: Path, report: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(path: Path) -> dict:
+    with path.open() as f:
+        return json.load(f)
+
+
+def compare(results: list[dict], baseline: dict, threshold=REGRESSION_THRESHOLD) -> list[tuple[str, float, float]]:
+    """
+    :param results: results of the current run
+    :param baseline: report of a previous run
+    :param threshold: relative slowdown considered a regression
+    :return: the regressions (name, baseline rate, current rate)
+    """
+    previous = {entry["name"]: entry for entry in baseline["results"] if entry["status"] == "ok"}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry["name"])
+        if entry["status"] == "ok" and old is not None and entry["rate"] < old["rate"] * (1 - threshold):
+            regressions.append((entry["name"], old["rate"], entry["rate"]))
+    return regressions
@@ -0,0 +1,65 @@
+"""
+Run the benchmarks, save the results as JSON and compare them with a previous run:
+
+    python -m benchmarks                              # all the benchmarks, results in benchmark_results.json
+    python -m benchmarks -k "physics.*" -o physics.json
+    python -m benchmarks --compare baseline.json      # exit code 1 if a benchmark is slower than the baseline
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# the simulators are created without their own MQTT connection: the end-to-end benchmarks attach a client to a local
+# stand-in broker (set before the simulators are imported, the flag is read at import)
+os.environ.setdefault("MQTT_ENABLED", "0")
+
+from . import select, run_benchmark, make_report, save_report, load_report, compare, BENCH_MIN_TIME, \
+    REGRESSION_THRESHOLD  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulators")
+    parser.add_argument("-k", "--select", nargs="+", metavar="PATTERN",
+                        help="shell patterns of the benchmark names (default: all)")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark_results.json"), help="JSON results")
+    parser.add_argument("--compare", type=Path, metavar="BASELINE", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--min-time", type=float, default=BENCH_MIN_TIME, help="measuring time of a benchmark [s]")
+    parser.add_argument("-l", "--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    benchmarks = select(args.select)
+    if args.list:
+        for bench in benchmarks:
+            print(bench.name)
+        return 0
+
+    baseline = load_report(args.compare) if args.compare is not None else None
+    previous = {entry["name"]: entry for entry in baseline["results"]} if baseline is not None else {}
+    results = []
+    for bench in benchmarks:
+        entry = run_benchmark(bench, args.min_time)
+        results.append(entry)
+        if entry["status"] != "ok":
+            print(f"{bench.name:<45} {entry['status']}: {entry['reason']}")
+            continue
+        line = f"{bench.name:<45} {entry['rate']:>14,.1f} {entry['unit']}"
+        old = previous.get(bench.name)
+        if old is not None and old["status"] == "ok":
+            line += f"  ({(entry['rate'] / old['rate'] - 1) * 100:+.1f}%)"
+        print(line)
+
+    save_report(args.output, make_report(results))
+    print(f"Results saved in {args.output}")
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, old_rate, rate in regressions:
+        print(f"REGRESSION {name}: {old_rate:,.1f} -> {rate:,.1f}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+End-to-end ticks per second: the simulation step plus the updates of the protocol stacks, with the clients attached
+to local stand-ins. The simulators run in a temporary directory (their spool and checkpoints are not touched) and the
+time is not scheduled: a tick starts as soon as the previous one ends.
+"""
+from typing import Callable, Awaitable
+import asyncio
+import os
+import socket
+import tempfile
+from . import benchmark, measure_async, Result
+
+OPC_UA_BENCH_PORT = 48410  # the servers of the benchmarks do not take the ports of the running simulators
+SUBSCRIPTION_PERIOD = 50  # publishing interval of the OPC-UA client [ms]
+SERVER_START_TIMEOUT = 10.0  # [s]
+
+
+def _in_temp_dir(run: Callable[[], Awaitable[Result]]) -> Result:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            return asyncio.run(run())
+        finally:
+            os.chdir(cwd)
+
+
+def _free_port() -> int:
+    """
+    :return: a TCP port free on the loopback (the server of the benchmark does not take the port of a running simulator)
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_server(port: int, server_task: asyncio.Task):
+    """
+    Wait until the server accepts the connections, RuntimeError if it stopped or it is not started in time
+    """
+    deadline = asyncio.get_running_loop().time() + SERVER_START_TIMEOUT
+    while True:
+        if server_task.done():
+            error = server_task.exception() if not server_task.cancelled() else None
+            raise RuntimeError(f"Server on port {port} stopped: {error!r}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(f"Server on port {port} not started in {SERVER_START_TIMEOUT:g} s")
+            await asyncio.sleep(0.01)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+class _DataChangeCounter:
+    def __init__(self):
+        self.notifications = 0
+
+    def datachange_notification(self, node, val, data):
+        self.notifications += 1
+
+
+@benchmark("e2e.cnc_opcua_tick")
+def cnc_opcua_tick(min_time: float) -> Result:
+    from asyncua import Client
+    from CNC_machine.CNC_engine import Engine
+
+    async def run() -> Result:
+        engine = Engine(draw=False)
+        await engine.server_init()
+        endpoint = f"opc.tcp://127.0.0.1:{OPC_UA_BENCH_PORT}/cnc_machine/"
+        engine.server.set_endpoint(endpoint)
+        state = {"time": .0}
+        engine.cnc_machine.x_axis.set_target(0.2)
+        engine.cnc_machine.nozzle.set_set_point_temp(200)
+
+        async def tick():
+            state["time"] += 0.05
+            engine.cnc_machine.run(state["time"])
+            await engine.update_opc_server()
+
+        # a client subscribed to all the monitored values, as a dashboard
+        async with engine.server, Client(endpoint) as client:
+            counter = _DataChangeCounter()
+            subscription = await client.create_subscription(SUBSCRIPTION_PERIOD, counter)
+            await subscription.subscribe_data_change(
+                [client.get_node(node.nodeid) for path, node in engine.opc_nodes.items()
+                 if path.count("/") == 2 and "Settings" not in path])
+            return await measure_async(tick, min_time, unit="ticks/s")
+
+    return _in_temp_dir(run)
+
+
+@benchmark("e2e.conveyor_opcua_mqtt_tick")
+def conveyor_opcua_mqtt_tick(min_time: float) -> Result:
+    from paho.mqtt import client as mqtt_client
+    from box_conveyor.box_conveyor import Engine
+    from .standins import MQTTStandIn
+
+    async def run() -> Result:
+        engine = Engine(checkpoint_path=None)
+        await engine.server_init()
+        engine.server.set_endpoint(f"opc.tcp://127.0.0.1:{OPC_UA_BENCH_PORT}/conveyor/")
+
+        with MQTTStandIn() as broker:
+            if hasattr(mqtt_client, "CallbackAPIVersion"):  # paho 2
+                client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2, client_id="benchmark")
+            else:
+                client = mqtt_client.Client(client_id="benchmark")
+            client.connect(broker.host, broker.port)
+            engine.attach_mqtt_client(client)
+
+            async def tick():
+                engine.conveyor.advance()
+                await engine.update_opc_server()
+                await engine.update_mqtt_client()
+
+            async with engine.server:
+                result = await measure_async(tick, min_time, unit="ticks/s")
+            client.disconnect()
+        return result
+
+    return _in_temp_dir(run)
+
+
+@benchmark("e2e.pool_modbus_tick")
+def pool_modbus_tick(min_time: float) -> Result:
+    from pymodbus.client import AsyncModbusTcpClient
+    from pool_boiler.pool_boiler_engine import Engine
+
+    async def run() -> Result:
+        engine = Engine(None)
+        port = _free_port()
+        engine.server_init(port)
+        await _wait_server(port, engine.server_task)
+        client = AsyncModbusTcpClient("127.0.0.1", port=port)
+        if not await client.connect():
+            raise RuntimeError(f"Modbus client not connected to port {port}")
+        engine.coils_memory.values[0] = True  # filling and heating
+        engine.holding_register_memory.values[0] = 100
+        state = {"time": .0}
+
+        async def tick():  # a SCADA polling the registers every tick
+            state["time"] += engine.time_step
+            engine.time = state["time"]
+            await engine.check_memory()
+            engine.run_physical_model()
+            await client.read_input_registers(3001, count=2)
+
+        try:
+            return await measure_async(tick, min_time, unit="ticks/s")
+        finally:
+            client.close()
+            engine.server_task.cancel()
+
+    return _in_temp_dir(run)
@@ -0,0 +1,131 @@
+"""
+Physics models: calls per second of the functions run every tick, and g-code lines per second of a headless CNC
+"""
+from . import benchmark, measure, Result
+
+TIME_STEP = 0.05  # [s], the step of the simulators
+CONVEYOR_CELLS = (20, 200, 2000, 20000)
+GCODE_FIRST_LINE = 18  # index of the first line of job1.gcode after the heating and the homing
+GCODE_LINES = 500
+
+
+@benchmark("physics.single_axis_run")
+def single_axis_run(min_time: float) -> Result:
+    from components.mechanic import SingleAxis
+
+    axis = SingleAxis(max_speed=0.1, max_acc=1.0)
+    state = {"time": .0}
+
+    def step():
+        state["time"] += TIME_STEP
+        if not axis.is_moving():  # always moving, the slowest path
+            axis.set_target(0.2 if axis.get_virtual_position() < 0.1 else .0)
+        axis.run(state["time"])
+
+    return measure(step, min_time, unit="calls/s")
+
+
+@benchmark("physics.single_axis_set_target")
+def single_axis_set_target(min_time: float) -> Result:
+    from components.mechanic import SingleAxis
+
+    axis = SingleAxis(max_speed=0.1, max_acc=1.0)
+    targets = [0.001 * i for i in range(1, 200)]  # short and long moves (triangular and trapezoidal profiles)
+
+    def set_targets() -> int:
+        for target in targets:
+            axis.set_target(target)
+        return len(targets)
+
+    return measure(set_targets, min_time, unit="calls/s")
+
+
+@benchmark("physics.heating_body_run")
+def heating_body_run(min_time: float) -> Result:
+    from components.thermal import HeatingBody
+
+    body = HeatingBody(25, mass=0.02, surface=0.001, h_power=120, c_heat=420, k_heat=25)
+    body.set_set_point_temp(200)
+    state = {"time": .0}
+
+    def step():
+        state["time"] += TIME_STEP
+        body.run(state["time"])
+
+    return measure(step, min_time, unit="calls/s")
+
+
+@benchmark("physics.boiling_pot_run")
+def boiling_pot_run(min_time: float) -> Result:
+    from pool_boiler.pool_boiler import BoilingPot
+
+    pot = BoilingPot()
+    state = {"time": .0}
+
+    def step():
+        state["time"] += TIME_STEP
+        # filled up to half, then heated to boiling
+        in_flow = 0.001 if pot.wat_h < pot.h_max / 2 else .0
+        pot.run(state["time"], power_in=5000.0, in_flow=in_flow)
+
+    return measure(step, min_time, unit="calls/s")
+
+
+def _conveyor_advance(cells: int):
+    def run(min_time: float) -> Result:
+        from box_conveyor.box_conveyor import Conveyor
+
+        conveyor = Conveyor()
+        conveyor.cells = cells
+        conveyor.mes_pos = cells * 7 // 10
+        for _ in range(cells):  # full belt
+            conveyor.advance()
+        return measure(conveyor.advance, min_time, unit="calls/s")
+
+    return run
+
+
+for _cells in CONVEYOR_CELLS:
+    benchmark(f"physics.conveyor_advance_{_cells}_cells")(_conveyor_advance(_cells))
+
+
+@benchmark("physics.conveyor_fast_line")
+def conveyor_fast_line(min_time: float) -> Result:
+    from box_conveyor.box_conveyor import Conveyor
+
+    # 200 cells at 1000 cells/s, two gauges and a rejector, 2000 boxes/s, advanced by ticks of 10 ms
+    conveyor = Conveyor.from_config({
+        "cells": 200,
+        "speed": 1000,
+        "stations": [{"type": "gauge", "position": 60}, {"type": "gauge", "position": 120},
+                     {"type": "rejector", "position": 150}],
+        "arrivals": {"type": "poisson", "rate": 2000},
+    })
+    for _ in range(100):  # full belt
+        conveyor.advance(0.01)
+
+    def step() -> int:
+        conveyor.advance(0.01)
+        return len(conveyor.measured)
+
+    return measure(step, min_time, unit="boxes/s")
+
+
+@benchmark("physics.gcode_lines")
+def gcode_lines(min_time: float) -> Result:
+    import asyncio
+    from CNC_machine.sweep import HeadlessCNCMachine, GCODE_EXAMPLES_DIR
+    from CNC_machine.CNC_machine import parse_gcode_lines
+
+    # moves of the first layer of an example job, after the heating and the homing
+    with (GCODE_EXAMPLES_DIR / "job1.gcode").open() as f:
+        lines = f.readlines()[GCODE_FIRST_LINE:GCODE_FIRST_LINE + GCODE_LINES]
+    parsed = parse_gcode_lines(lines)
+
+    async def run_lines() -> int:
+        cnc_machine = HeadlessCNCMachine()
+        for line, gline in zip(lines, parsed):
+            await cnc_machine.run_gcode_line(line, gline)
+        return len(lines)
+
+    return measure(lambda: asyncio.run(run_lines()), min_time, repeat=1, unit="lines/s")
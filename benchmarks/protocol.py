@@ -0,0 +1,211 @@
+"""
+Payload encoding: messages per second of the binary and JSON payloads of the simulators, and messages per second and
+per MB of payload of every MQTT payload format (components.codecs)
+"""
+from . import benchmark, measure, Result
+
+N_MESSAGES = 100  # messages encoded or decoded by one call of the measured function
+CODEC_FORMATS = ("json", "msgpack", "cbor", "bin")  # payload formats of components.codecs
+
+
+def _box():
+    from box_conveyor.box_conveyor import Box
+
+    box = Box()
+    box.measures = [50.1, 79.8, 100.2]
+    box.marked = True
+    return box
+
+
+def _measured_box():
+    from box_conveyor.box_conveyor import Box, Conveyor
+
+    box = Box()
+    box.marked = Conveyor().measure_box(box)  # measures with all their digits, as published
+    return box
+
+
+@benchmark("protocol.box_bin_encode")
+def box_bin_encode(min_time: float) -> Result:
+    box = _box()
+
+    def encode() -> int:
+        for _ in range(N_MESSAGES):
+            box.to_bin()
+        return N_MESSAGES
+
+    return measure(encode, min_time, unit="msg/s")
+
+
+@benchmark("protocol.box_bin_decode")
+def box_bin_decode(min_time: float) -> Result:
+    import struct
+
+    payload = _box().to_bin()
+
+    def decode() -> int:  # as a client does: 6 characters of serial, 3 float32 measures, the result
+        for _ in range(N_MESSAGES):
+            payload[:6].decode("utf-8"), struct.unpack_from("fff?", payload, 6)
+        return N_MESSAGES
+
+    return measure(decode, min_time, unit="msg/s")
+
+
+@benchmark("protocol.box_json_encode")
+def box_json_encode(min_time: float) -> Result:
+    box = _box()
+
+    def encode() -> int:
+        for _ in range(N_MESSAGES):
+            box.to_json()
+        return N_MESSAGES
+
+    return measure(encode, min_time, unit="msg/s")
+
+
+def _box_codec_encode(fmt: str):
+    def encode_box(min_time: float) -> Result:
+        from components.codecs import get_codec
+        from box_conveyor.box_conveyor import BOX_SCHEMA
+
+        codec = get_codec(fmt)  # ImportError if the package of the format is missing: skipped
+        record = _measured_box().to_record()
+
+        def encode() -> int:
+            for _ in range(N_MESSAGES):
+                codec.encode(BOX_SCHEMA, record)
+            return N_MESSAGES
+
+        return measure(encode, min_time, unit="msg/s")
+
+    return encode_box
+
+
+def _box_codec_decode(fmt: str):
+    def decode_box(min_time: float) -> Result:
+        from components.codecs import get_codec
+        from box_conveyor.box_conveyor import BOX_SCHEMA
+
+        codec = get_codec(fmt)
+        payload = codec.encode(BOX_SCHEMA, _measured_box().to_record())
+
+        def decode() -> int:
+            for _ in range(N_MESSAGES):
+                codec.decode(BOX_SCHEMA, payload)
+            return N_MESSAGES
+
+        return measure(decode, min_time, unit="msg/s")
+
+    return decode_box
+
+
+def _box_codec_size(fmt: str):
+    def size_box(min_time: float) -> Result:
+        """
+        Messages per MB of payload (the broker traffic, higher is better as the other rates)
+        """
+        from components.codecs import get_codec
+        from box_conveyor.box_conveyor import BOX_SCHEMA
+
+        codec = get_codec(fmt)
+        payload_bytes = sum(len(codec.encode(BOX_SCHEMA, _measured_box().to_record())) for _ in range(N_MESSAGES))
+        return Result(N_MESSAGES, payload_bytes / 1e6, unit="msg/MB")
+
+    return size_box
+
+
+for _fmt in CODEC_FORMATS:
+    benchmark(f"protocol.box_{_fmt}_codec_encode")(_box_codec_encode(_fmt))
+    benchmark(f"protocol.box_{_fmt}_codec_decode")(_box_codec_decode(_fmt))
+    benchmark(f"protocol.box_{_fmt}_codec_size")(_box_codec_size(_fmt))
+
+
+@benchmark("protocol.conveyor_counters_bin_encode")
+def conveyor_counters_bin_encode(min_time: float) -> Result:
+    from box_conveyor.box_conveyor import Conveyor
+
+    conveyor = Conveyor()
+
+    def encode() -> int:
+        for _ in range(N_MESSAGES):
+            conveyor.get_counters_bin()
+        return N_MESSAGES
+
+    return measure(encode, min_time, unit="msg/s")
+
+
+@benchmark("protocol.conveyor_settings_bin_roundtrip")
+def conveyor_settings_bin_roundtrip(min_time: float) -> Result:
+    from box_conveyor.box_conveyor import Conveyor
+
+    conveyor = Conveyor()
+
+    def roundtrip() -> int:
+        for _ in range(N_MESSAGES):
+            conveyor.set_settings_from_bin(conveyor.get_settings_bin())
+        return N_MESSAGES
+
+    return measure(roundtrip, min_time, unit="msg/s")
+
+
+@benchmark("protocol.conveyor_settings_json_roundtrip")
+def conveyor_settings_json_roundtrip(min_time: float) -> Result:
+    from box_conveyor.box_conveyor import Conveyor
+
+    conveyor = Conveyor()
+
+    def roundtrip() -> int:
+        for _ in range(N_MESSAGES):
+            conveyor.set_settings_from_json(conveyor.get_settings_json())
+        return N_MESSAGES
+
+    return measure(roundtrip, min_time, unit="msg/s")
+
+
+@benchmark("protocol.cnc_settings_bin_roundtrip")
+def cnc_settings_bin_roundtrip(min_time: float) -> Result:
+    from CNC_machine.CNC_machine import CNCMachine
+
+    cnc_machine = CNCMachine()
+
+    def roundtrip() -> int:
+        for _ in range(N_MESSAGES):
+            cnc_machine.set_settings_from_bin(cnc_machine.get_settings_bin())
+        return N_MESSAGES
+
+    return measure(roundtrip, min_time, unit="msg/s")
+
+
+@benchmark("protocol.uadp_encode")
+def uadp_encode(min_time: float) -> Result:
+    import numpy as np
+    from components.uadp import UADPWriter
+    from CNC_machine.fast_publisher import SAMPLE_DTYPE
+
+    writer = UADPWriter("127.0.0.1", 9, SAMPLE_DTYPE)  # only encoded, never sent
+    samples = np.zeros(50, SAMPLE_DTYPE)  # one 50 ms tick at 1 kHz
+
+    def encode() -> int:
+        writer.encode(.0, 0.001, samples)
+        return len(samples)
+
+    try:
+        return measure(encode, min_time, unit="samples/s")
+    finally:
+        writer.close()
+
+
+@benchmark("protocol.uadp_decode")
+def uadp_decode(min_time: float) -> Result:
+    import numpy as np
+    from components.uadp import UADPWriter, decode
+    from CNC_machine.fast_publisher import SAMPLE_DTYPE
+
+    writer = UADPWriter("127.0.0.1", 9, SAMPLE_DTYPE)
+    frames = writer.encode(.0, 0.001, np.zeros(50, SAMPLE_DTYPE))
+    writer.close()
+
+    def decode_frames() -> int:
+        return sum(len(decode(frame, SAMPLE_DTYPE).samples) for frame in frames)
+
+    return measure(decode_frames, min_time, unit="samples/s")
@@ -0,0 +1,102 @@
+"""
+Local stand-ins of the external services used by the end-to-end benchmarks
+"""
+import socket
+import threading
+
+MQTT_CONNECT = 0x10
+MQTT_CONNACK = 0x20
+MQTT_PUBLISH = 0x30
+MQTT_PUBACK = 0x40
+MQTT_SUBSCRIBE = 0x80
+MQTT_SUBACK = 0x90
+MQTT_PINGREQ = 0xC0
+MQTT_PINGRESP = 0xD0
+MQTT_DISCONNECT = 0xE0
+
+
+class MQTTStandIn:
+    """
+    Minimal MQTT 3.1.1 broker on the loopback: it accepts the connections and the subscriptions and counts the
+    published messages, nothing is forwarded
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """
+        :param host: listening address
+        :param port: listening port, 0 for a free one (see self.port)
+        """
+        self.listener = socket.create_server((host, port))
+        self.host, self.port = self.listener.getsockname()
+        self.published = 0
+        self.received_bytes = 0
+        self._threads: list[threading.Thread] = []
+        self._closing = False
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+
+    def __enter__(self) -> "MQTTStandIn":
+        self._accept_thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _accept(self):
+        while not self._closing:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve, args=(connection,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _read(connection: socket.socket, n: int) -> bytes:
+        data = b""
+        while len(data) < n:
+            chunk = connection.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def _serve(self, connection: socket.socket):
+        with connection:
+            try:
+                while True:
+                    packet_type = self._read(connection, 1)[0]
+                    length, multiplier = 0, 1
+                    while True:  # variable length encoding of the remaining length
+                        byte = self._read(connection, 1)[0]
+                        length += (byte & 0x7F) * multiplier
+                        multiplier *= 128
+                        if not byte & 0x80:
+                            break
+                    body = self._read(connection, length)
+                    self.received_bytes += length + 2
+                    kind = packet_type & 0xF0
+                    if kind == MQTT_CONNECT:
+                        connection.sendall(bytes((MQTT_CONNACK, 2, 0, 0)))
+                    elif kind == MQTT_PUBLISH:
+                        self.published += 1
+                        if (packet_type >> 1) & 0x03:  # QoS 1 or 2: the packet id follows the topic
+                            topic_length = int.from_bytes(body[:2], "big")
+                            packet_id = body[2 + topic_length:4 + topic_length]
+                            connection.sendall(bytes((MQTT_PUBACK, 2)) + packet_id)
+                    elif kind == MQTT_SUBSCRIBE:
+                        packet_id, position, granted = body[:2], 2, b""
+                        while position < len(body):  # topic filters: length, topic, requested QoS
+                            position += 2 + int.from_bytes(body[position:position + 2], "big") + 1
+                            granted += b"\x00"
+                        connection.sendall(bytes((MQTT_SUBACK, 2 + len(granted))) + packet_id + granted)
+                    elif kind == MQTT_PINGREQ:
+                        connection.sendall(bytes((MQTT_PINGRESP, 0)))
+                    elif kind == MQTT_DISCONNECT:
+                        return
+            except (ConnectionError, OSError):
+                return
+
+    def close(self):
+        self._closing = True
+        self.listener.close()
@@ -3,19 +3,85 @@ from typing import Optional
 from asyncua import Server, ua, uamethod
 from asyncua.common.node import Node
 import asyncio
-from paho.mqtt import client as mqtt_client
+from components.scheduler import FixedRateScheduler
+from components.checkpoint import Checkpointable, CheckpointWriter, CHECKPOINT_INTERVAL
+from components.opcua_nodes import NodeBatch, init_server, get_cache_dir
+from components.opcua_history import RingBufferHistory, enable_history
+from components.profiling import Profiler
+from components.terminal import LineRenderer
+from components.mqtt_cache import PublishCache
+from components.codecs import Schema, Codec, get_codec, parse_formats
+from .results import BoxResultStore
+from .spc import SpcStats, DIMENSIONS, SPC_REPORT_INTERVAL
+from .commands import CommandQueue
+from .line import Station, Gauge, Rejector, ArrivalProcess, CellArrivals, snap, first_below, build_stations, \
+    build_arrivals, load_line_config
 import json
 import struct
 import os
+import time
+from pathlib import Path
 
 
 # constants
 MQTT_ADDR = os.getenv("MQTT_BROKER_ADDR", "localhost")
+MQTT_ENABLED = os.getenv("MQTT_ENABLED", "1") != "0"  # paho is not imported when disabled
 MQTT_PORT = 1883
 OPC_UA_ENDPOINT =  "opc.tcp://0.0.0.0:4841/conveyor/"
+HISTORY_SIZE = 3600  # samples of every historized OPC-UA variable kept in memory
+HISTORY_DB = os.getenv("CONVEYOR_HISTORY_DB", "")  # SQLite file of the older samples, empty to discard them
+RESULTS_DB = os.getenv("CONVEYOR_RESULTS_DB", "")  # SQLite file of all the box results, empty to keep only the last ones
+LINE_CONFIG = os.getenv("CONVEYOR_LINE", "")  # JSON file of the line (see box_conveyor.line), empty for the default
+TIME_MULT = float(os.getenv("CONVEYOR_TIME_MULT", "1"))  # simulation speed multiplier
+MIN_TICK_PERIOD = 0.01  # wall clock period of the fastest tick [s], faster belts move by more than one cell per tick
+MQTT_FORMATS = os.getenv("CONVEYOR_MQTT_FORMATS", "")  # payload formats per message family, e.g. "box=msgpack"
+MQTT_DEFAULT_FORMATS = {"box": ["json", "bin"], "counters": ["json", "bin"], "settings": ["json", "bin"],
+                        "statistics": ["json"]}
+SPC_NODES = {"count": 0, "mean": .0, "std": .0, "ewma": .0, "ewma_lcl": .0, "ewma_ucl": .0, "lcl": .0, "ucl": .0,
+             "cp": .0, "cpk": .0}  # statistics of every dimension on the OPC-UA server (Statistics/<dimension>/<name>)
 
 
-class Box:
+def _pack_box(record: dict) -> bytes:
+    return record["serial"].encode('utf-8') + struct.pack("fff", *record["measures"]) + \
+        struct.pack('?', record["accepted"])
+
+
+def _unpack_box(payload: bytes) -> dict:
+    width, depth, height, accepted = struct.unpack_from("fff?", payload, 6)
+    return BOX_SCHEMA.record(payload[:6].decode('utf-8'), [width, depth, height], accepted)
+
+
+SETTINGS_BIN_SIZE = struct.calcsize("fffff")
+TOLERANCE_FIELDS = ("tolerance/0", "tolerance/1", "tolerance/2")  # settings fields of the width, depth, height tolerances
+TOLERANCE_INDEX = {field: i for i, field in enumerate(TOLERANCE_FIELDS)}
+
+
+def _pack_settings(record: dict) -> bytes:
+    return struct.pack("fffff", record["speed"], record["temperature"],
+                       *(tol["value"] for tol in sorted(record["tolerances"], key=lambda tol: tol["id"])))
+
+
+def _unpack_settings(payload: bytes) -> dict:
+    if len(payload) not in (SETTINGS_BIN_SIZE, SETTINGS_BIN_SIZE + 4):
+        raise ValueError(f"Settings of {len(payload)} bytes, expected {SETTINGS_BIN_SIZE} or {SETTINGS_BIN_SIZE + 4}")
+    speed, temperature, *tols = struct.unpack_from("fffff", payload)
+    record = SETTINGS_SCHEMA.record(speed, temperature, [{"id": i, "value": tol} for i, tol in enumerate(tols)])
+    if len(payload) > SETTINGS_BIN_SIZE:  # a set command with its sequence number
+        record["seq"], = struct.unpack_from("I", payload, SETTINGS_BIN_SIZE)
+    return record
+
+
+# messages published on MQTT, in every payload format (components.codecs)
+BOX_SCHEMA = Schema("box", ("serial", "measures", "accepted"), _pack_box, _unpack_box)
+COUNTERS_SCHEMA = Schema("counters", ("boxes", "accepted", "rejected"),
+                         lambda record: struct.pack("iii", *record.values()),
+                         lambda payload: COUNTERS_SCHEMA.record(*struct.unpack("iii", payload)))
+SETTINGS_SCHEMA = Schema("settings", ("speed", "temperature", "tolerances"), _pack_settings, _unpack_settings)
+STATISTICS_SCHEMA = Schema("statistics", DIMENSIONS)  # SpcStats.report, no binary layout
+SCHEMAS = {schema.name: schema for schema in (BOX_SCHEMA, COUNTERS_SCHEMA, SETTINGS_SCHEMA, STATISTICS_SCHEMA)}
+
+
+class Box(Checkpointable):
     N_WIDTH = 50
     N_DEPTH = 80
     N_HEIGHT = 100
@@ -30,10 +96,11 @@ class Box:
         self.size = [self.width, self.depth, self.height]
         self.measures = [.0, .0, .0]
 
+    def to_record(self) -> dict:
+        return BOX_SCHEMA.record(self.serial, self.measures, self.marked)
+
     def to_json(self):
-        return json.dumps({"serial": self.serial,
-                           "measures": self.measures,
-                           "accepted": self.marked})
+        return get_codec("json").encode(BOX_SCHEMA, self.to_record()).decode()
 
     def to_bin(self):
         s = bytes()
@@ -43,16 +110,26 @@ class Box:
         return s
 
 
-class Conveyor:
+class Conveyor(Checkpointable):
     measuring: Optional[Box]
     server: Optional[Server]
     boxes: list[Box]
-
-    def __init__(self):
-        self.cells = 20
+    stations: list[Station]
+
+    def __init__(self, cells=20, stations: Optional[list[Station]] = None, arrivals: Optional[ArrivalProcess] = None):
+        """
+        :param cells: length of the belt [cells]
+        :param stations: stations along the belt (default: one gauge at cell 14)
+        :param arrivals: arrival process of the boxes (default: one chance in three for every cell of belt)
+        """
+        self.cells = cells
         self.boxes = []
-        self.measuring = None
-        self.mes_pos = 14
+        self.measuring = None  # last box measured by the last gauge in the last step
+        self.measured: list[Box] = []  # all the boxes measured by the last gauge in the last step
+        self.stations = []
+        self.set_stations(stations if stations is not None else [Gauge(14)])
+        self.arrivals = arrivals if arrivals is not None else CellArrivals()
+        self.belt_time = .0  # time the belt has been running [s]
         self.speed = 1.0
         self.temperature = random.uniform(15.0, 35.0)
         self.thresholds = [Box.N_WIDTH * 0.1, Box.N_DEPTH * 0.1, Box.N_HEIGHT * 0.1]
@@ -62,71 +139,205 @@ class Conveyor:
         self.boxes_accepted = 0
         self.paused = False
         self.max_accepted_boxes = None
-
-    def advance(self):
+        self.spc = SpcStats()  # rolling statistics of the measures of the last gauge
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Conveyor":
+        """
+        :param config: line configuration, see box_conveyor.line
+        """
+        conveyor = cls(config.get("cells", 20),
+                       build_stations(config["stations"]) if "stations" in config else None,
+                       build_arrivals(config["arrivals"]) if "arrivals" in config else None)
+        if "speed" in config:
+            conveyor.speed = float(config["speed"])
+        return conveyor
+
+    def __setstate__(self, state: dict):
+        super().__setstate__(state)
+        if "stations" not in state:  # checkpoint of the conveyor with a single gauge
+            self.measured = []
+            self.stations = []
+            self.set_stations([Gauge(self.__dict__.pop("mes_pos", 14))])
+            self.arrivals = CellArrivals()
+            self.belt_time = .0
+        if "spc" not in state:
+            self.spc = SpcStats()
+
+    def set_stations(self, stations: list[Station]):
+        """
+        :param stations: stations along the belt, in any order
+        """
+        for station in stations:
+            if not 0 <= station.position < self.cells:
+                raise ValueError(f"Station {station.name} at cell {station.position} is not on the belt")
+        self.stations = sorted(stations, key=lambda station: station.position)
+        gauges = [station for station in self.stations if isinstance(station, Gauge)]
+        for gauge in gauges:
+            gauge.first = gauge is gauges[0]
+            gauge.last = gauge is gauges[-1]
+
+    @property
+    def mes_pos(self) -> int:
+        """
+        Cell of the first gauge
+        """
+        for station in self.stations:
+            if isinstance(station, Gauge):
+                return int(station.position)
+        return -1
+
+    @mes_pos.setter
+    def mes_pos(self, position: int):
+        for station in self.stations:
+            if isinstance(station, Gauge):
+                station.position = float(position)
+                self.set_stations(self.stations)
+                return
+        self.set_stations(self.stations + [Gauge(position)])
+
+    def advance(self, dt: Optional[float] = None):
+        """
+        Move the belt by speed * dt cells: the new boxes are placed where they are at the end of the step, all the boxes
+        are moved in one pass, the boxes that crossed a station are processed by it and the boxes that left the belt
+        or have been removed by a station are dropped
+        :param dt: duration of the step [s] (default: the time of one cell)
+        """
         if not self.paused:
             if self.max_accepted_boxes is not None:
                 if self.boxes_accepted >= self.max_accepted_boxes:
                     self.paused = True
                     return
 
+            if dt is None:  # one cell
+                dt = 1 / self.speed
+                distance = 1.0
+            else:
+                distance = snap(self.speed * dt)  # whole cells stay whole
+
+            start = self.belt_time
+            self.belt_time += dt
+            boxes = self.boxes
+            for arrival in self.arrivals.arrivals(start, self.belt_time, self.speed):
+                box = Box()
+                box.position = snap((start - arrival) * self.speed)  # before the belt, on it at the end of the step
+                boxes.append(box)
+
             self.measuring = None
-            to_del = []
-            for i, box in enumerate(self.boxes):
-                box.position += 1
-                if box.position == self.mes_pos:
-                    self.measuring = box
-                    self.measure()
-                    self.boxes_count += 1
-                    if box.marked:
-                        self.boxes_accepted += 1
-                    else:
-                        self.boxes_rejected += 1
-
-                if box.position >= self.cells:
-                    to_del.append(i)
-
-            for del_n in to_del:
-                self.boxes.pop(del_n)
-
-            creation = random.randint(0, 2)
-            if creation == 0:
-                self.boxes.append(Box())
+            self.measured.clear()
+            for box in boxes:
+                box.position += distance
+
+            if not boxes:
+                return
+
+            # the boxes are ordered by position (the oldest first): the boxes that crossed a station in this step are
+            # a slice of the list, the boxes that left the belt are the head of the list
+            farthest = boxes[0].position
+            nearest = boxes[-1].position
+            removed = None
+            for station in self.stations:
+                if station.position > farthest or station.position + distance <= nearest:
+                    continue  # no box crossed the station
+                for i in range(first_below(boxes, station.position + distance), first_below(boxes, station.position)):
+                    box = boxes[i]
+                    if removed is not None and id(box) in removed:
+                        continue
+                    if not station.process(self, box):
+                        if removed is None:
+                            removed = set()
+                        removed.add(id(box))
+
+            exited = first_below(boxes, self.cells) if farthest >= self.cells else 0
+            if removed is not None:
+                boxes[:] = [box for box in boxes[exited:] if id(box) not in removed]
+            elif exited:
+                del boxes[:exited]
+
+    def count_box(self, box: Box):
+        """
+        Count the result of a box measured by the last gauge
+        :param box: the measured box
+        """
+        self.measuring = box
+        self.measured.append(box)
+        self.spc.add(box.measures)
+        self.boxes_count += 1
+        if box.marked:
+            self.boxes_accepted += 1
+        else:
+            self.boxes_rejected += 1
+
+    def check_invariants(self, previous: Optional[list[Box]] = None):
+        """
+        Check the state of the belt, raise AssertionError if it is broken
+        :param previous: copy of self.boxes before the last advance, to check that only the boxes that reached the end
+        of the belt or a rejector have been dropped
+        """
+        last = float(self.cells)
+        for box in self.boxes:
+            if not 0 <= box.position < self.cells or box.position > last:  # on the belt, the oldest first
+                raise AssertionError(f"Box {box.serial} at cell {box.position}, expected 0 <= cell <= {last}")
+            last = box.position
+        if self.measuring is not None and self.measuring not in self.measured:
+            raise AssertionError(f"Measured box {self.measuring.serial} not counted")
+        if previous is not None:
+            current = set(map(id, self.boxes))
+            rejectors = [station.position for station in self.stations if isinstance(station, Rejector)]
+            for box in previous:
+                if id(box) in current or box.position >= self.cells:
+                    continue
+                if box.marked or not any(position <= box.position for position in rejectors):
+                    raise AssertionError(f"Box {box.serial} dropped at cell {box.position}")
+
+    def measure_box(self, box: Box) -> bool:
+        """
+        :param box: the box in a gauge
+        :return: True if the box is within the tolerances
+        """
+        for i, size in enumerate(box.size):
+            mes = size + random.gauss(0, self.speed * 0.2)  # speed error
+            mes = mes * (1 + 0.05 * (self.temperature - 25))  # temp error
+            box.measures[i] = mes
+        return self.evaluate(box)
 
     def measure(self):
         if self.measuring is not None:
-            for i, size in enumerate(self.measuring.size):
-                mes = size + random.gauss(0, self.speed * 0.2)  # speed error
-                mes = mes * (1 + 0.05 * (self.temperature - 25))  # temp error
-                self.measuring.measures[i] = mes
-                self.measuring.marked = self.evaluate()
+            self.measuring.marked = self.measure_box(self.measuring)
 
     def is_measuring(self):
         return self.measuring is not None
 
-    def evaluate(self):
-        for i, size in enumerate(self.measuring.size):
+    def evaluate(self, box: Optional[Box] = None):
+        """
+        :param box: the box to evaluate (default: the measured box)
+        """
+        if box is None:
+            box = self.measuring
+        for i, size in enumerate(box.size):
             if self.ref_mes[i] + self.thresholds[i] >= size >= self.ref_mes[i] - self.thresholds[i]:
                 pass
             else:
                 return False
         return True
 
+    def get_counters_record(self) -> dict:
+        return COUNTERS_SCHEMA.record(self.boxes_count, self.boxes_accepted, self.boxes_rejected)
+
     def get_counters_json(self):
-        return json.dumps({"boxes": self.boxes_count,
-                           "accepted": self.boxes_accepted,
-                           "rejected": self.boxes_rejected})
+        return get_codec("json").encode(COUNTERS_SCHEMA, self.get_counters_record()).decode()
 
     def get_counters_bin(self):
         return struct.pack("iii", self.boxes_count, self.boxes_accepted, self.boxes_rejected)
 
-    def get_settings_json(self):
+    def get_settings_record(self) -> dict:
         tols = []
         for i, tol in enumerate(self.thresholds):
             tols.append({"id": i, "value": tol})
-        return json.dumps({"speed": self.speed,
-                           "temperature": self.temperature,
-                           "tolerances": tols})
+        return SETTINGS_SCHEMA.record(self.speed, self.temperature, tols)
+
+    def get_settings_json(self):
+        return get_codec("json").encode(SETTINGS_SCHEMA, self.get_settings_record()).decode()
 
     def get_settings_bin(self):
         s = bytes()
@@ -136,24 +347,57 @@ class Conveyor:
         return s
 
     def set_settings_from_json(self, in_json: str):
-        in_dict = json.loads(in_json)
+        self.apply_settings(self.get_settings_fields(get_codec("json").decode(SETTINGS_SCHEMA, in_json)))
 
+    def set_settings_from_bin(self, in_bytes: bytes):
+        self.speed, self.temperature, self.thresholds[0], self.thresholds[1], self.thresholds[2] =\
+            struct.unpack("fffff", in_bytes)
+
+    def get_settings_fields(self, in_dict: dict) -> dict:
+        """
+        :param in_dict: settings record, in any format, the missing fields are left unchanged ("pause" is optional)
+        :return: the fields set by the record ("speed", "temperature", "tolerance/<id>", "pause"), ValueError if one
+        is invalid
+        """
+        fields = {}
         if "speed" in in_dict:
-            self.speed = float(in_dict["speed"])
+            fields["speed"] = float(in_dict["speed"])
 
         if "temperature" in in_dict:
-            self.temperature = float(in_dict["temperature"])
+            fields["temperature"] = float(in_dict["temperature"])
 
         if "tolerances" in in_dict:
             for vec in in_dict["tolerances"]:
-                self.thresholds[vec["id"]] = float(vec["value"])
+                i = int(vec["id"])
+                if not 0 <= i < len(TOLERANCE_FIELDS):
+                    raise ValueError(f"Invalid tolerance id: {vec['id']}")
+                fields[TOLERANCE_FIELDS[i]] = float(vec["value"])
 
         if "pause" in in_dict:
-            self.paused = bool(in_dict['pause'])
-
-    def set_settings_from_bin(self, in_bytes: bytes):
-        self.speed, self.temperature, self.thresholds[0], self.thresholds[1], self.thresholds[2] =\
-            struct.unpack("fffff", in_bytes)
+            fields["pause"] = bool(in_dict['pause'])
+        return fields
+
+    def apply_settings(self, fields: dict) -> dict:
+        """
+        :param fields: settings fields, see get_settings_fields
+        :return: the fields whose value changed, with their new value
+        """
+        changed = {}
+        for field, value in fields.items():
+            if field == "speed":
+                if self.speed != value:
+                    self.speed = changed[field] = value
+            elif field == "temperature":
+                if self.temperature != value:
+                    self.temperature = changed[field] = value
+            elif field == "pause":
+                if self.paused != value:
+                    self.paused = changed[field] = value
+            else:
+                i = TOLERANCE_INDEX[field]
+                if self.thresholds[i] != value:
+                    self.thresholds[i] = changed[field] = value
+        return changed
 
 
 class Engine:
@@ -170,12 +414,25 @@ class Engine:
     w_tol_node: Optional[Node]
     d_tol_node: Optional[Node]
     h_tol_node: Optional[Node]
+    history: Optional[RingBufferHistory]
 
-    def __init__(self, time_mult=1.0):
-        self.conveyor = Conveyor()
+    def __init__(self, time_mult=1.0, checkpoint_path: Optional[Path] = None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 line_config: Optional[dict] = None):
+        if line_config is None and LINE_CONFIG:
+            line_config = load_line_config(Path(LINE_CONFIG))
+        self.conveyor = Conveyor.from_config(line_config) if line_config is not None else Conveyor()
         self.time_mult = time_mult
 
         self.time = .0
+        self.checkpoint_writer = None
+        if checkpoint_path is not None:  # periodic checkpoints of the conveyor, restored at startup
+            self.checkpoint_writer = CheckpointWriter(checkpoint_path, checkpoint_interval)
+            state = self.checkpoint_writer.load()
+            if state is not None:
+                self.conveyor = state["conveyor"]
+                self.time = state["time"]
+        self.scheduler = FixedRateScheduler(self.get_time_step(), time_mult)
+        self.scheduler.set_time(self.time)
 
         self.tasks = []
 
@@ -194,6 +451,13 @@ class Engine:
         self.w_tol_node = None
         self.d_tol_node = None
         self.h_tol_node = None
+        self.history = None
+        self.spc_nodes: dict[str, dict[str, Node]] = {}  # dimension -> statistic -> node
+        self.spc_report: Optional[dict] = None  # report of the tick, to publish (None between two reports)
+        self.next_spc_report = .0
+        self.results = BoxResultStore(db_path=Path(RESULTS_DB) if RESULTS_DB else None)
+        self.profiler = Profiler("conveyor")
+        self.renderer = LineRenderer()
 
         self.reset_node = None
         self.disable_ac_box_node = None
@@ -205,25 +469,35 @@ class Engine:
         self.mqtt_settings_topic = f"{self.mqtt_base_topic}/settings"
         self.mqtt_counters_topic = f"{self.mqtt_base_topic}/counters"
         self.mqtt_error_topic = f"{self.mqtt_base_topic}/error"
+        self.mqtt_statistics_topic = f"{self.mqtt_base_topic}/statistics"
 
         self.mqtt_width_topic = f"{self.mqtt_gauge_topic}/width"
         self.mqtt_depth_topic = f"{self.mqtt_gauge_topic}/depth"
         self.mqtt_height_topic = f"{self.mqtt_gauge_topic}/height"
-        self.mqtt_box_json_topic = f"{self.mqtt_gauge_topic}/json_box"
-        self.mqtt_box_bin_topic = f"{self.mqtt_gauge_topic}/bin_box"
-
-        self.mqtt_counter_json_topic = f"{self.mqtt_counters_topic}/json"
-        self.mqtt_counter_bin_topic = f"{self.mqtt_counters_topic}/bin"
-
         self.mqtt_frequency_topic = f"{self.mqtt_settings_topic}/frequency"
-        self.mqtt_settings_json = f"{self.mqtt_settings_topic}/json"
-        self.mqtt_settings_bin = f"{self.mqtt_settings_topic}/bin"
-        self.mqtt_settings_set_json = f"{self.mqtt_settings_topic}/set/json"
-        self.mqtt_settings_set_bin = f"{self.mqtt_settings_topic}/set/bin"
 
-        self.mqtt_client = self.mqtt_client_init()
+        # one topic per payload format of every message family: format -> topic
+        self.mqtt_formats = parse_formats(MQTT_FORMATS, MQTT_DEFAULT_FORMATS)
+        self.mqtt_codecs = self.get_mqtt_codecs(self.mqtt_formats)
+        self.mqtt_box_topics = {fmt: f"{self.mqtt_gauge_topic}/{fmt}_box" for fmt in self.mqtt_formats["box"]}
+        self.mqtt_counters_topics = {fmt: f"{self.mqtt_counters_topic}/{fmt}" for fmt in self.mqtt_formats["counters"]}
+        self.mqtt_settings_topics = {fmt: f"{self.mqtt_settings_topic}/{fmt}" for fmt in self.mqtt_formats["settings"]}
+        self.mqtt_statistics_topics = {fmt: f"{self.mqtt_statistics_topic}/{fmt}"
+                                       for fmt in self.mqtt_formats["statistics"]}
+        self.mqtt_settings_set_topics = {f"{self.mqtt_settings_topic}/set/{fmt}": fmt  # topic -> format
+                                         for fmt in self.mqtt_formats["settings"]}
+        self.mqtt_settings_ack_topic = f"{self.mqtt_settings_topic}/ack"
+        self.commands = CommandQueue()  # settings received on MQTT, applied at the next tick
+
+        self.mqtt_client = None
+        self.mqtt_cache: Optional[PublishCache] = None  # states published retained and only when they change
+        self.attach_mqtt_client(self.mqtt_client_init())
 
     def mqtt_client_init(self):
+        if not MQTT_ENABLED:
+            return None
+        from paho.mqtt import client as mqtt_client
+
         print(f"Connecting to mqtt broker ({MQTT_ADDR}:{MQTT_PORT:d})...", end="\t")
         client = mqtt_client.Client(client_id="box_conveyor_sim")
         try:
@@ -238,121 +512,215 @@ class Engine:
             print("Error")
             return None
 
-        client.publish(self.mqtt_width_topic, str(.0))
-        client.publish(self.mqtt_depth_topic, str(.0))
-        client.publish(self.mqtt_height_topic, str(.0))
-        client.publish(self.mqtt_frequency_topic, str(self.conveyor.speed))
-        client.publish(self.mqtt_error_topic, "")
-
-        client.subscribe(self.mqtt_settings_set_json, 2)
-        client.subscribe(self.mqtt_settings_set_bin, 2)
+        for topic in self.mqtt_settings_set_topics:
+            client.subscribe(topic, 2)
         client.on_message = self.on_mqtt_message
         # client.loop_start()
 
         return client
 
+    def attach_mqtt_client(self, client):
+        """
+        Publish on a connected paho client, starting with the initial states
+        :param client: the client, None to disable MQTT
+        """
+        self.mqtt_client = client
+        self.mqtt_cache = PublishCache(client) if client is not None else None
+        if client is None:
+            return
+        self.mqtt_cache.publish_state(self.mqtt_width_topic, str(.0))
+        self.mqtt_cache.publish_state(self.mqtt_depth_topic, str(.0))
+        self.mqtt_cache.publish_state(self.mqtt_height_topic, str(.0))
+        self.mqtt_cache.publish_state(self.mqtt_frequency_topic, str(self.conveyor.speed))
+        self.mqtt_cache.publish_event(self.mqtt_error_topic, "")
+
     def on_mqtt_message(self, client, userdata, msg):
         # print(f"Received `{msg.payload.decode()}` from `{msg.topic}` topic")
+        fmt = self.mqtt_settings_set_topics.get(msg.topic)
+        if fmt is None:
+            return
         try:
-            if msg.topic == self.mqtt_settings_set_json:
-                self.conveyor.set_settings_from_json(msg.payload.decode())
-            elif msg.topic == self.mqtt_settings_set_bin:
-                self.conveyor.set_settings_from_bin(msg.payload)
-            self.tasks.append(asyncio.create_task(self.update_opcua_nodes()))
+            record = self.mqtt_codecs[fmt].decode(SETTINGS_SCHEMA, msg.payload)
+            fields = self.conveyor.get_settings_fields(record)
+            seq = int(record["seq"]) if record.get("seq") is not None else None
+            client_id = str(record.get("client", ""))
         except Exception as e:
             self.write_mqtt_error(msg.topic, str(e))
-
-    async def update_opcua_nodes(self):
-        await self.frequency_node.set_value(self.conveyor.speed)
-        await self.temp_node.set_value(self.conveyor.temperature)
-        await self.w_tol_node.set_value(self.conveyor.thresholds[0])
-        await self.d_tol_node.set_value(self.conveyor.thresholds[1])
-        await self.h_tol_node.set_value(self.conveyor.thresholds[2])
+            return
+        ack = self.commands.add(fields, seq, client_id)  # applied at the next tick
+        if ack is not None:
+            self.write_mqtt_ack(ack)
+
+    async def apply_commands(self):
+        """
+        Apply the settings received since the last tick, write the OPC-UA nodes of the changed ones
+        """
+        fields, acks = self.commands.take()
+        if fields:
+            await self.update_opcua_nodes(self.conveyor.apply_settings(fields))
+        for ack in acks:
+            self.write_mqtt_ack(ack)
+
+    async def update_opcua_nodes(self, changed: dict):
+        """
+        :param changed: settings fields changed by MQTT, with their new value
+        """
+        if self.server is None:
+            return
+        nodes = {"speed": self.frequency_node, "temperature": self.temp_node, "tolerance/0": self.w_tol_node,
+                 "tolerance/1": self.d_tol_node, "tolerance/2": self.h_tol_node}
+        for field, value in changed.items():
+            if field in nodes:
+                await nodes[field].set_value(value)
 
     async def update_mqtt_client(self):
-        if self.mqtt_client is not None:
+        if self.mqtt_client is None:
+            return
+        with self.profiler.span("update_mqtt_client"):
+            cache = self.mqtt_cache
             if self.conveyor.is_measuring():
-                self.mqtt_client.publish(self.mqtt_width_topic, self.conveyor.measuring.measures[0])
-                self.mqtt_client.publish(self.mqtt_depth_topic, self.conveyor.measuring.measures[1])
-                self.mqtt_client.publish(self.mqtt_height_topic, self.conveyor.measuring.measures[2])
-                self.mqtt_client.publish(self.mqtt_box_json_topic, self.conveyor.measuring.to_json())
-                self.mqtt_client.publish(self.mqtt_box_bin_topic, self.conveyor.measuring.to_bin())
+                cache.publish_state(self.mqtt_width_topic, self.conveyor.measuring.measures[0])
+                cache.publish_state(self.mqtt_depth_topic, self.conveyor.measuring.measures[1])
+                cache.publish_state(self.mqtt_height_topic, self.conveyor.measuring.measures[2])
+                for box in self.conveyor.measured:  # every box measured in the tick, many on fast lines
+                    self.publish_record(self.mqtt_box_topics, BOX_SCHEMA, box.to_record(), state=False)
+
+            # states: sent when they change (and at every keyframe), the unchanged ones cost a comparison
+            self.publish_record(self.mqtt_counters_topics, COUNTERS_SCHEMA, self.conveyor.get_counters_record())
 
-            self.mqtt_client.publish(self.mqtt_counter_json_topic, self.conveyor.get_counters_json())
-            self.mqtt_client.publish(self.mqtt_counter_bin_topic, self.conveyor.get_counters_bin())
+            cache.publish_state(self.mqtt_frequency_topic, str(self.conveyor.speed))
+            self.publish_record(self.mqtt_settings_topics, SETTINGS_SCHEMA, self.conveyor.get_settings_record())
 
-            self.mqtt_client.publish(self.mqtt_settings_json, self.conveyor.get_settings_json())
-            self.mqtt_client.publish(self.mqtt_settings_bin, self.conveyor.get_settings_bin())
+            if self.spc_report is not None:
+                self.publish_record(self.mqtt_statistics_topics, STATISTICS_SCHEMA, self.spc_report)
 
             await self.mqtt_client_loop()
 
+    def publish_record(self, topics: dict[str, str], schema: Schema, record: dict, state=True):
+        """
+        Publish a message in every payload format of its family
+        :param topics: format -> topic
+        :param schema: schema of the message
+        :param record: the message
+        :param state: True for a state (retained, sent on change), False for an event
+        """
+        for fmt, topic in topics.items():
+            payload = self.mqtt_codecs[fmt].encode(schema, record)
+            if state:
+                self.mqtt_cache.publish_state(topic, payload)
+            else:
+                self.mqtt_cache.publish_event(topic, payload)
+
+    @staticmethod
+    def get_mqtt_codecs(formats: dict[str, list[str]]) -> dict[str, Codec]:
+        """
+        :param formats: message family -> payload formats
+        :return: format -> codec, ValueError if a format cannot encode its family, ImportError if its package is missing
+        """
+        codecs = {}
+        for family, names in formats.items():
+            for name in names:
+                codec = codecs[name] = get_codec(name)
+                if not codec.supports(SCHEMAS[family]):
+                    raise ValueError(f"Payload format {name} not available for the {family} messages")
+        return codecs
+
+    def write_mqtt_ack(self, ack: dict):
+        if self.mqtt_cache is not None:
+            self.mqtt_cache.publish_event(self.mqtt_settings_ack_topic, json.dumps(ack))
+
     def write_mqtt_error(self, topic: str, message: str):
-        if self.mqtt_client is not None:
+        if self.mqtt_cache is not None:
             msg = json.dumps({"topic": topic, "message": message})
-            self.mqtt_client.publish(self.mqtt_error_topic, msg)
+            self.mqtt_cache.publish_event(self.mqtt_error_topic, msg)
 
     async def server_init(self):
         print("Starting opcua server...", end="\t")
         self.server = Server()
-        await self.server.init()
+        await init_server(self.server, get_cache_dir())
         self.server.set_endpoint(OPC_UA_ENDPOINT)
         uri = "http://test_dummy_machine"
         idx = await self.server.register_namespace(uri)
-        gauge = await self.server.nodes.objects.add_object(idx, "Gauge")
-        self.width_node = await gauge.add_variable(idx, "width", .0)
-        self.depth_node = await gauge.add_variable(idx, "depth", .0)
-        self.height_node = await gauge.add_variable(idx, "height", .0)
-        self.mes_node = await gauge.add_variable(idx, "measures", [.0, .0, .0])
-        self.box_id_node = await gauge.add_variable(idx, "Box id", "")
-        self.box_accepted_node = await gauge.add_variable(idx, "Box accepted", True)
-
-        counter = await self.server.nodes.objects.add_object(idx, "Counters")
-        self.box_count_node = await counter.add_variable(idx, "Boxes", 0)
-        self.accepted_count_node = await counter.add_variable(idx, "Accepted", 0)
-        self.rejected_count_node = await counter.add_variable(idx, "Rejected", 0)
-
-        settings = await self.server.nodes.objects.add_object(idx, "Settings")
-        self.temp_node = await settings.add_variable(idx, "Temperature", self.conveyor.temperature)
-        self.frequency_node = await settings.add_variable(idx, "Speed", self.conveyor.speed)
-        self.w_tol_node = await settings.add_variable(idx, "width tolerance ", self.conveyor.thresholds[0])
-        self.d_tol_node = await settings.add_variable(idx, "depth tolerance", self.conveyor.thresholds[1])
-        self.h_tol_node = await settings.add_variable(idx, "height tolerance", self.conveyor.thresholds[2])
-
-        actions = await self.server.nodes.objects.add_object(idx, "Actions")
-        self.reset_node = await actions.add_method(idx, "Reset counter", self.reset_counter)
-        self.pause_node = await actions.add_method(idx, "Start-stop conveyor", self.pause, [], [ua.VariantType.Boolean])
-        self.max_ac_box_node = await actions.add_method(idx, "Set max accepted boxes", self.set_max_accepted_boxes,
-                                                        [ua.VariantType.Int64])
-        self.disable_ac_box_node = await actions.add_method(idx, "Disable accepted boxes",
-                                                            self.disable_max_accepted_boxes)
-
-        await self.temp_node.set_writable()
-        await self.frequency_node.set_writable()
-        await self.w_tol_node.set_writable()
-        await self.d_tol_node.set_writable()
-        await self.h_tol_node.set_writable()
-
+        nodes = NodeBatch(self.server, idx, browse_idx=idx)
+        objects = self.server.nodes.objects
+
+        gauge = nodes.add_object(objects, "Gauge")
+        self.width_node = nodes.add_variable(gauge, "width", .0)
+        self.depth_node = nodes.add_variable(gauge, "depth", .0)
+        self.height_node = nodes.add_variable(gauge, "height", .0)
+        self.mes_node = nodes.add_variable(gauge, "measures", [.0, .0, .0])
+        self.box_id_node = nodes.add_variable(gauge, "Box id", "")
+        self.box_accepted_node = nodes.add_variable(gauge, "Box accepted", True)
+
+        counter = nodes.add_object(objects, "Counters")
+        self.box_count_node = nodes.add_variable(counter, "Boxes", 0)
+        self.accepted_count_node = nodes.add_variable(counter, "Accepted", 0)
+        self.rejected_count_node = nodes.add_variable(counter, "Rejected", 0)
+
+        settings = nodes.add_object(objects, "Settings")
+        self.temp_node = nodes.add_variable(settings, "Temperature", self.conveyor.temperature, writable=True)
+        self.frequency_node = nodes.add_variable(settings, "Speed", self.conveyor.speed, writable=True)
+        self.w_tol_node = nodes.add_variable(settings, "width tolerance ", self.conveyor.thresholds[0], writable=True)
+        self.d_tol_node = nodes.add_variable(settings, "depth tolerance", self.conveyor.thresholds[1], writable=True)
+        self.h_tol_node = nodes.add_variable(settings, "height tolerance", self.conveyor.thresholds[2], writable=True)
+
+        actions = nodes.add_object(objects, "Actions")
+        self.reset_node = nodes.add_method(actions, "Reset counter", self.reset_counter)
+        self.pause_node = nodes.add_method(actions, "Start-stop conveyor", self.pause, [], [ua.VariantType.Boolean])
+        self.max_ac_box_node = nodes.add_method(actions, "Set max accepted boxes", self.set_max_accepted_boxes,
+                                                [ua.VariantType.Int64])
+        self.disable_ac_box_node = nodes.add_method(actions, "Disable accepted boxes",
+                                                    self.disable_max_accepted_boxes)
+        nodes.add_method(actions, "Start profiling", self.start_profiling, [ua.VariantType.Double],
+                         [ua.VariantType.String])
+        nodes.add_method(actions, "Stop profiling", self.stop_profiling, [], [ua.VariantType.String])
+
+        statistics = nodes.add_object(objects, "Statistics")
+        for dimension in DIMENSIONS:
+            folder = nodes.add_object(statistics, dimension)
+            self.spc_nodes[dimension] = {name: nodes.add_variable(folder, name, value)
+                                         for name, value in SPC_NODES.items()}
+
+        results = nodes.add_object(objects, "Results")
+        nodes.add_method(results, "Get box", self.get_box_result, [ua.VariantType.String], [ua.VariantType.String])
+        nodes.add_method(results, "Reject rate", self.get_reject_rate, [ua.VariantType.Double], [ua.VariantType.String])
+
+        await nodes.commit()
+        # counters and temperature readable with HistoryRead
+        self.history = await enable_history(self.server, [self.box_count_node, self.accepted_count_node,
+                                                          self.rejected_count_node, self.temp_node],
+                                            HISTORY_SIZE, Path(HISTORY_DB) if HISTORY_DB else None)
         print("ok")
+        print(self.history.report())
+        print(self.results.report())
 
     async def update_opc_server(self):
-        if self.conveyor.is_measuring():
-            await self.width_node.write_value(self.conveyor.measuring.measures[0])
-            await self.depth_node.write_value(self.conveyor.measuring.measures[1])
-            await self.height_node.write_value(self.conveyor.measuring.measures[2])
-            await self.mes_node.write_value(self.conveyor.measuring.measures)
-
-            await self.box_id_node.write_value(self.conveyor.measuring.serial)
-            await self.box_accepted_node.write_value(self.conveyor.measuring.marked)
-
-        await self.box_count_node.write_value(self.conveyor.boxes_count)
-        await self.accepted_count_node.write_value(self.conveyor.boxes_accepted)
-        await self.rejected_count_node.write_value(self.conveyor.boxes_rejected)
-
-        self.conveyor.temperature = await self.temp_node.get_value()
-        self.conveyor.speed = await self.frequency_node.get_value()
-        self.conveyor.thresholds[0] = await self.w_tol_node.get_value()
-        self.conveyor.thresholds[1] = await self.d_tol_node.get_value()
-        self.conveyor.thresholds[2] = await self.h_tol_node.get_value()
+        with self.profiler.span("update_opc_server"):
+            if self.conveyor.is_measuring():
+                await self.width_node.write_value(self.conveyor.measuring.measures[0])
+                await self.depth_node.write_value(self.conveyor.measuring.measures[1])
+                await self.height_node.write_value(self.conveyor.measuring.measures[2])
+                await self.mes_node.write_value(self.conveyor.measuring.measures)
+
+                await self.box_id_node.write_value(self.conveyor.measuring.serial)
+                await self.box_accepted_node.write_value(self.conveyor.measuring.marked)
+
+            await self.box_count_node.write_value(self.conveyor.boxes_count)
+            await self.accepted_count_node.write_value(self.conveyor.boxes_accepted)
+            await self.rejected_count_node.write_value(self.conveyor.boxes_rejected)
+
+            if self.spc_report is not None:
+                for dimension, nodes in self.spc_nodes.items():
+                    stats = self.spc_report[dimension]
+                    for name, node in nodes.items():
+                        value = stats[name]
+                        await node.write_value(type(SPC_NODES[name])(value) if value is not None else float("nan"))
+
+            self.conveyor.temperature = await self.temp_node.get_value()
+            self.conveyor.speed = await self.frequency_node.get_value()
+            self.conveyor.thresholds[0] = await self.w_tol_node.get_value()
+            self.conveyor.thresholds[1] = await self.d_tol_node.get_value()
+            self.conveyor.thresholds[2] = await self.h_tol_node.get_value()
 
     @uamethod
     def reset_counter(self, parent):
@@ -373,6 +741,33 @@ class Engine:
     def disable_max_accepted_boxes(self, parent):
         self.conveyor.max_accepted_boxes = None
 
+    @uamethod
+    def start_profiling(self, parent, duration: float):
+        try:
+            return str(self.profiler.start(duration))
+        except RuntimeError:  # already running
+            return ua.StatusCode(ua.StatusCodes.BadInvalidState)
+        except ValueError:
+            return ua.StatusCode(ua.StatusCodes.BadOutOfRange)
+
+    @uamethod
+    def stop_profiling(self, parent):
+        self.profiler.stop()
+        return json.dumps(self.profiler.report())
+
+    @uamethod
+    def get_box_result(self, parent, serial: str):
+        result = self.results.get_box(serial)
+        if result is None:
+            return ua.StatusCode(ua.StatusCodes.BadNotFound)
+        return json.dumps(result)
+
+    @uamethod
+    def get_reject_rate(self, parent, minutes: float):
+        if not minutes > 0:
+            return ua.StatusCode(ua.StatusCodes.BadOutOfRange)
+        return json.dumps(self.results.reject_rate(minutes))
+
     def get_mes_info(self) -> str:
         if self.conveyor.is_measuring():
             box_info = self.conveyor.measuring.serial
@@ -393,47 +788,85 @@ class Engine:
         return f"serial: {box_info} w:{w} mm d:{d} mm h:{h} mm - result: {res}"
 
     def draw(self):
+        """
+        Print the conveyor on the terminal (at most TERMINAL_FPS times per second, only if it changed)
+        """
+        if self.renderer.due():
+            self.renderer.render(self.get_status_line())
+
+    def get_status_line(self) -> str:
         s = ["="] * self.conveyor.cells
-        s[self.conveyor.mes_pos] = "x"
+        gauges = set()
+        for station in self.conveyor.stations:
+            if isinstance(station, Gauge):
+                gauges.add(int(station.position))
+                s[int(station.position)] = "x"
+            else:
+                s[int(station.position)] = "v"
         for box in self.conveyor.boxes:
-            if box.position == self.conveyor.mes_pos:
-                s[box.position] = "⛝"
+            cell = int(box.position)
+            if cell in gauges:
+                s[cell] = "⛝"
             else:
                 if box.marked:
-                    s[box.position] = "■"
+                    s[cell] = "■"
                 else:
-                    s[box.position] = "□"
+                    s[cell] = "□"
 
         if self.conveyor.paused:
             status = "STOPPED"
         else:
             status = "RUNNING"
 
-        print("\r{} T:{:.1f}°C S:{:.1f} box/s B:{:d} A:{:d} R:{:d} status: {} {} time: {:.1f} s".format("".join(s),
-                                                                                                        self.conveyor.temperature,
-                                                                                                        self.conveyor.speed,
-                                                                                                        self.conveyor.boxes_count,
-                                                                                                        self.conveyor.boxes_accepted,
-                                                                                                        self.conveyor.boxes_rejected,
-                                                                                                        status,
-                                                                                                        self.get_mes_info(),
-                                                                                                        self.time),
-              end="")
+        return "{} T:{:.1f}°C S:{:.1f} box/s B:{:d} A:{:d} R:{:d} status: {} {} time: {:.1f} s".format(
+            "".join(s), self.conveyor.temperature, self.conveyor.speed, self.conveyor.boxes_count,
+            self.conveyor.boxes_accepted, self.conveyor.boxes_rejected, status, self.get_mes_info(), self.time)
+
+    def update_spc_report(self):
+        """
+        Make a new report of the statistics of the measures if the last one is older than SPC_REPORT_INTERVAL
+        """
+        now = time.monotonic()
+        if now >= self.next_spc_report:
+            self.next_spc_report = now + SPC_REPORT_INTERVAL
+            self.spc_report = self.conveyor.spc.report(self.conveyor.ref_mes, self.conveyor.thresholds)
+        else:
+            self.spc_report = None
+
+    def get_time_step(self) -> float:
+        """
+        :return: simulated time of a tick [s]: one cell of belt, or more if the tick would be shorter than
+        MIN_TICK_PERIOD of wall clock
+        """
+        return max(1 / self.conveyor.speed, MIN_TICK_PERIOD * self.time_mult)
 
     async def mqtt_client_loop(self):
-        self.mqtt_client.loop()
+        self.mqtt_client.loop(timeout=0)  # a tick without publications would wait for the socket for 1 s
 
     async def run(self):
         async with self.server:
+            self.scheduler.start()
             while True:
-                self.conveyor.advance()
-                self.draw()
+                await self.apply_commands()
+                with self.profiler.span("physics"):
+                    self.conveyor.advance(self.scheduler.time_step)
+                with self.profiler.span("results"):
+                    for box in self.conveyor.measured:
+                        self.results.add(box, self.time)
+                    self.results.maybe_flush()
+                self.update_spc_report()
+                with self.profiler.span("draw"):
+                    self.draw()
                 self.tasks.append(asyncio.create_task(self.update_opc_server()))
                 self.tasks.append(asyncio.create_task(self.update_mqtt_client()))
-                await asyncio.sleep(1 / (self.conveyor.speed * self.time_mult))
                 for task in self.tasks:
                     await task
                 self.tasks = []
-                self.time += 1 / self.conveyor.speed
+                if self.checkpoint_writer is not None:
+                    self.checkpoint_writer.maybe_save(self.time, lambda: {"time": self.time, "conveyor": self.conveyor})
+                if self.scheduler.time_step != self.get_time_step():  # speed changed by opc-ua or mqtt
+                    self.scheduler.set_time_step(self.get_time_step())
+                await self.scheduler.wait_next()
+                self.time = self.scheduler.time
 
 
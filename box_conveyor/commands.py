@@ -0,0 +1,52 @@
+"""
+Settings commands received on MQTT, applied once per tick.
+
+The commands received between two ticks are coalesced field by field (the last writer wins), so a burst of messages
+changes the conveyor, and writes the OPC-UA nodes of the changed fields, once. A command can carry a sequence number
+("seq", and optionally "client", the sender): a command whose number is not greater than the last one accepted from
+the same client is a duplicate or a stale retry and is dropped. Every numbered command is acknowledged:
+
+    {"client": "line-ui", "seq": 42, "status": "applied"}
+
+status "applied" (at the tick that applies it), "duplicate" or "stale" (dropped, at once).
+"""
+from typing import Any, Optional
+
+
+class CommandQueue:
+    """
+    Settings fields waiting for the next tick, and the last sequence number of every client
+    """
+
+    def __init__(self):
+        self.fields: dict[str, Any] = {}  # field -> value, the last command wins
+        self.acks: list[dict] = []  # numbered commands merged in the fields, acknowledged when applied
+        self.last_seq: dict[str, int] = {}  # client -> last sequence number accepted
+        self.received = 0
+        self.dropped = 0
+
+    def add(self, fields: dict[str, Any], seq: Optional[int] = None, client="") -> Optional[dict]:
+        """
+        :param fields: the fields set by the command (validated)
+        :param seq: sequence number of the command, None if not numbered
+        :param client: sender of the command, the sequence numbers of every client are independent
+        :return: the ack of a dropped command, None if the command is queued
+        """
+        self.received += 1
+        if seq is not None:
+            last = self.last_seq.get(client)
+            if last is not None and seq <= last:
+                self.dropped += 1
+                return {"client": client, "seq": seq, "status": "duplicate" if seq == last else "stale"}
+            self.last_seq[client] = seq
+            self.acks.append({"client": client, "seq": seq, "status": "applied"})
+        self.fields.update(fields)
+        return None
+
+    def take(self) -> tuple[dict[str, Any], list[dict]]:
+        """
+        :return: the coalesced fields and the acks of their commands, the queue is emptied
+        """
+        fields, acks = self.fields, self.acks
+        self.fields, self.acks = {}, []
+        return fields, acks
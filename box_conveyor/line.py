@@ -0,0 +1,272 @@
+"""
+Line model of the conveyor: the stations along the belt and the arrival processes of the boxes.
+
+The positions on the belt are in cells (floats, a box can be anywhere between two cells), the belt moves by
+speed * dt cells in a step. A line is configured by a JSON file (environment variable CONVEYOR_LINE):
+
+    {
+        "cells": 200,
+        "speed": 1000,
+        "stations": [{"type": "gauge", "position": 60}, {"type": "gauge", "position": 120},
+                     {"type": "rejector", "position": 150}],
+        "arrivals": {"type": "poisson", "rate": 800}
+    }
+
+arrivals: {"type": "cell", "probability": 0.33} (one chance per cell of belt, the default),
+{"type": "poisson", "rate": <boxes per second>} or {"type": "trace", "path": <file>, "loop": true}, the trace file has
+one arrival time per line [s] (the first column of a csv file, lines starting with # are skipped).
+"""
+from typing import Optional, TYPE_CHECKING
+from pathlib import Path
+import json
+import random
+from components.checkpoint import Checkpointable
+
+if TYPE_CHECKING:
+    from .box_conveyor import Box, Conveyor
+
+CELL_ARRIVAL_PROBABILITY = 1 / 3  # chance of a new box for every cell of belt, as the original conveyor
+POSITION_EPS = 1e-9  # [cells], steps closer than this to a whole number of cells are rounded
+
+
+def snap(cells: float) -> float:
+    """
+    :param cells: a distance or a position on the belt
+    :return: the same value, rounded if it is within POSITION_EPS of a whole cell
+    """
+    whole = round(cells)
+    return float(whole) if abs(cells - whole) < POSITION_EPS else cells
+
+
+def first_below(boxes: list["Box"], position: float) -> int:
+    """
+    :param boxes: boxes ordered by position, the farthest first
+    :param position: a position on the belt [cells]
+    :return: index of the first box before the position (len(boxes) if none)
+    """
+    low, high = 0, len(boxes)
+    while low < high:
+        middle = (low + high) // 2
+        if boxes[middle].position < position:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class Station(Checkpointable):
+    """
+    A station at a fixed position of the belt, every box crossing the position is processed once
+    """
+
+    def __init__(self, position: float, name: Optional[str] = None):
+        """
+        :param position: position on the belt [cells]
+        :param name: name of the station (default: type and position)
+        """
+        self.position = float(position)
+        self.name = name if name is not None else f"{type(self).__name__.lower()}@{position:g}"
+
+    def process(self, conveyor: "Conveyor", box: "Box") -> bool:
+        """
+        :param conveyor: the conveyor of the station
+        :param box: box crossing the station
+        :return: False if the box is removed from the belt
+        """
+        return True
+
+    def get_counters(self) -> dict:
+        return {"name": self.name}
+
+
+class Gauge(Station):
+    """
+    Measuring station: the box is measured and marked if all the gauges it crossed accepted it. The last gauge of the
+    line gives the result of the box (conveyor counters and Conveyor.measured)
+    """
+
+    def __init__(self, position: float, name: Optional[str] = None):
+        super().__init__(position, name)
+        self.first = True  # set by Conveyor.set_stations
+        self.last = True
+        self.measured = 0
+        self.failed = 0
+
+    def process(self, conveyor: "Conveyor", box: "Box") -> bool:
+        passed = conveyor.measure_box(box)
+        box.marked = passed if self.first else box.marked and passed
+        self.measured += 1
+        if not passed:
+            self.failed += 1
+        if self.last:
+            conveyor.count_box(box)
+        return True
+
+    def get_counters(self) -> dict:
+        return {"name": self.name, "measured": self.measured, "failed": self.failed}
+
+
+class Rejector(Station):
+    """
+    Removes the boxes that are not marked (measured out of tolerance by a gauge before it)
+    """
+
+    def __init__(self, position: float, name: Optional[str] = None):
+        super().__init__(position, name)
+        self.removed = 0
+
+    def process(self, conveyor: "Conveyor", box: "Box") -> bool:
+        if box.marked:
+            return True
+        self.removed += 1
+        return False
+
+    def get_counters(self) -> dict:
+        return {"name": self.name, "removed": self.removed}
+
+
+class ArrivalProcess(Checkpointable):
+    """
+    Arrival times of the new boxes at the start of the belt
+    """
+
+    def arrivals(self, start: float, end: float, speed: float) -> list[float]:
+        """
+        :param start: belt time at the start of the step [s]
+        :param end: belt time at the end of the step [s]
+        :param speed: belt speed [cells/s]
+        :return: the arrival times in (start, end], in order
+        """
+        raise NotImplementedError
+
+
+class CellArrivals(ArrivalProcess):
+    """
+    One chance of a new box every time the belt moves by one cell
+    """
+
+    def __init__(self, probability=CELL_ARRIVAL_PROBABILITY):
+        """
+        :param probability: chance of a new box for every cell of belt
+        """
+        self.probability = probability
+        self.distance = .0  # belt moved since the last cell [cells]
+
+    def arrivals(self, start: float, end: float, speed: float) -> list[float]:
+        self.distance += (end - start) * speed
+        times = []
+        while self.distance >= 1 - POSITION_EPS:
+            self.distance = max(self.distance - 1, .0)
+            if random.random() < self.probability:
+                times.append(end - self.distance / speed)
+        return times
+
+
+class PoissonArrivals(ArrivalProcess):
+    """
+    Boxes arriving at random, independent of the belt speed
+    """
+
+    def __init__(self, rate: float):
+        """
+        :param rate: mean number of boxes per second
+        """
+        self.rate = rate
+        self.next_time: Optional[float] = None
+
+    def arrivals(self, start: float, end: float, speed: float) -> list[float]:
+        if self.next_time is None:
+            self.next_time = start + random.expovariate(self.rate)
+        times = []
+        while self.next_time <= end:
+            times.append(self.next_time)
+            self.next_time += random.expovariate(self.rate)
+        return times
+
+
+class TraceArrivals(ArrivalProcess):
+    """
+    Arrival times read from a file (e.g. recorded on a real line), optionally repeated
+    """
+
+    _checkpoint_exclude = ("_times",)  # read again from the file after a restore
+
+    def __init__(self, path: str, loop=True, period: Optional[float] = None):
+        """
+        :param path: text or csv file, one arrival time per line [s from the start]
+        :param loop: repeat the trace when it ends
+        :param period: duration of the trace when it is repeated [s] (default: the last time plus the mean interval)
+        """
+        self.path = path
+        self.loop = loop
+        self.period = period
+        self.index = 0
+        self.offset = .0
+        self._times: Optional[list[float]] = None
+
+    def get_times(self) -> list[float]:
+        if self._times is None:
+            times = []
+            with open(self.path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        times.append(float(line.split(",")[0]))
+            self._times = sorted(times)
+            if self.period is None and self._times:
+                mean_interval = self._times[-1] / len(self._times)
+                self.period = self._times[-1] + mean_interval
+        return self._times
+
+    def arrivals(self, start: float, end: float, speed: float) -> list[float]:
+        trace = self.get_times()
+        times = []
+        while trace:
+            if self.index >= len(trace):
+                if not self.loop or not self.period > 0:
+                    break
+                self.index = 0
+                self.offset += self.period
+            arrival = trace[self.index] + self.offset
+            if arrival > end:
+                break
+            times.append(max(arrival, start))  # the times before the first step arrive at its start
+            self.index += 1
+        return times
+
+
+STATION_TYPES = {"gauge": Gauge, "rejector": Rejector}
+
+
+def build_stations(config: list[dict]) -> list[Station]:
+    """
+    :param config: list of {"type": "gauge" | "rejector", "position": <cells>, "name": <optional>}
+    """
+    stations = []
+    for station in config:
+        if station["type"] not in STATION_TYPES:
+            raise ValueError(f"Unknown station type: {station['type']}")
+        stations.append(STATION_TYPES[station["type"]](station["position"], station.get("name")))
+    return stations
+
+
+def build_arrivals(config: dict) -> ArrivalProcess:
+    """
+    :param config: {"type": "cell" | "poisson" | "trace", ...}, see the module documentation
+    """
+    kind = config["type"]
+    if kind == "cell":
+        return CellArrivals(config.get("probability", CELL_ARRIVAL_PROBABILITY))
+    if kind == "poisson":
+        return PoissonArrivals(config["rate"])
+    if kind == "trace":
+        return TraceArrivals(config["path"], config.get("loop", True), config.get("period"))
+    raise ValueError(f"Unknown arrival process: {kind}")
+
+
+def load_line_config(path: Path) -> dict:
+    """
+    :param path: JSON file of the line, see the module documentation
+    """
+    with path.open() as f:
+        return json.load(f)
@@ -1,18 +1,30 @@
-from .box_conveyor import Engine
+from components.startup import StartupTimer
+timer = StartupTimer()  # created before the other imports, so they are timed too
+
+from .box_conveyor import Engine, TIME_MULT
 import asyncio
+import signal
 
 
 async def main():
-    eng = Engine()
+    timer.mark("imports")
+    eng = Engine(time_mult=TIME_MULT)
+    timer.mark("engine")
 
     await eng.server_init()
+    timer.mark("opc-ua server")
+    timer.report()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, eng.profiler.toggle)
 
     try:
         await eng.run()
     except KeyboardInterrupt:
-        print("")
+        eng.renderer.close()
         # eng.mqtt_client.loop_stop()
         print("Closing")
+    finally:
+        eng.renderer.close()  # ends the status line (nothing to do if already closed)
+        eng.results.close()  # writes the results not yet in the database
 
 
 if __name__ == '__main__':
@@ -0,0 +1,237 @@
+"""
+Record of the measured boxes of the conveyor.
+
+BoxResultStore appends every result (serial, time, measures, accepted) to a preallocated ring buffer and writes the new
+results to SQLite in batches (WAL mode, one executemany per batch, indexes on serial and time). A box is found by
+serial with a dictionary of the results in memory and the serial index of the database, the reject rate of the last
+minutes is the sum of per-minute counters: no query scans the results. The queries can be made from another thread
+(the OPC-UA methods run in an executor) while the simulation loop adds the results.
+
+The times are simulated times (Engine.time), so an accelerated line fills its minutes faster than the wall clock.
+Fill a store and time the queries:
+
+    python -m box_conveyor.results
+"""
+from typing import Optional, TYPE_CHECKING
+from pathlib import Path
+import sqlite3
+import threading
+import time
+import numpy as np
+
+if TYPE_CHECKING:
+    from .box_conveyor import Box
+
+RESULTS_SIZE = 65536  # results kept in memory
+RESULTS_MINUTES = 1440  # minutes of reject counters kept in memory (one day)
+RESULTS_FLUSH_INTERVAL = 1.0  # wall clock time between two writes of the database [s]
+RESULTS_FLUSH_BATCH = 4096  # results that trigger a write before the interval
+
+RESULT_DTYPE = np.dtype([
+    ("serial", "U6"),
+    ("time", "<f8"),
+    ("measures", "<f4", (3,)),
+    ("accepted", "?"),
+])
+
+
+class BoxResultStore:
+    """
+    Results of the measured boxes: the last RESULTS_SIZE in memory, all of them in an optional SQLite database
+    """
+
+    def __init__(self, capacity=RESULTS_SIZE, db_path: Optional[Path] = None, minutes=RESULTS_MINUTES,
+                 flush_interval=RESULTS_FLUSH_INTERVAL, flush_batch=RESULTS_FLUSH_BATCH):
+        """
+        :param capacity: results kept in memory
+        :param db_path: SQLite database of all the results, None to keep only the results in memory
+        :param minutes: minutes of reject counters (maximum window of reject_rate)
+        :param flush_interval: wall clock time between two writes of the database [s]
+        :param flush_batch: number of new results that triggers a write before the interval
+        """
+        self.capacity = capacity
+        self.results = np.zeros(capacity, RESULT_DTYPE)
+        self.head = 0  # index of the next result
+        self.size = 0
+        self.total = 0  # results added since the start
+        self.by_serial: dict[str, int] = {}  # serial -> index of its last result in memory
+
+        # per-minute counters, a ring indexed by minute % minutes
+        self.minutes = minutes
+        self.bucket_minute = [-1] * minutes
+        self.bucket_boxes = [0] * minutes
+        self.bucket_rejected = [0] * minutes
+        self.last_time = .0
+
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.pending = 0  # results not yet written to the database
+        self.flushed = 0
+        self.next_flush = time.monotonic() + flush_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path is not None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)  # used under _db_lock
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS boxes (serial TEXT NOT NULL, time REAL NOT NULL, "
+                             "width REAL, depth REAL, height REAL, accepted INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS boxes_serial ON boxes (serial)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS boxes_time ON boxes (time)")
+            self._db.commit()
+
+    @property
+    def nbytes(self) -> int:
+        return self.results.nbytes
+
+    def add(self, box: "Box", time_: float):
+        """
+        Record the result of a box, the oldest result in memory is overwritten when the buffer is full (it has been
+        written to the database before)
+        :param box: the measured box
+        :param time_: time of the measure [s]
+        """
+        if self.pending == self.capacity:
+            self.flush()
+        i = self.head
+        if self.size == self.capacity:
+            old = str(self.results["serial"][i])
+            if self.by_serial.get(old) == i:
+                del self.by_serial[old]
+        self.results[i] = (box.serial, time_, box.measures, box.marked)
+        self.by_serial[box.serial] = i
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.total += 1
+        self.pending += 1
+
+        minute = int(time_ // 60)
+        slot = minute % self.minutes
+        if self.bucket_minute[slot] != minute:
+            self.bucket_minute[slot] = minute
+            self.bucket_boxes[slot] = 0
+            self.bucket_rejected[slot] = 0
+        self.bucket_boxes[slot] += 1
+        if not box.marked:
+            self.bucket_rejected[slot] += 1
+        self.last_time = time_
+
+    def maybe_flush(self):
+        """
+        Write the new results if the flush interval has elapsed or enough results are waiting (call it every tick)
+        """
+        if self.pending >= self.flush_batch or (self.pending and time.monotonic() >= self.next_flush):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the new results to the database (one executemany)
+        """
+        self.next_flush = time.monotonic() + self.flush_interval
+        if self._db is None or not self.pending:
+            self.pending = 0
+            return
+        first = (self.head - self.pending) % self.capacity
+        if first + self.pending <= self.capacity:
+            rows = self.results[first:first + self.pending]
+        else:
+            rows = np.concatenate((self.results[first:], self.results[:self.head]))
+        measures = rows["measures"].astype(float).T.tolist()  # python floats, sqlite3 stores numpy scalars as blobs
+        with self._db_lock:
+            self._db.executemany("INSERT INTO boxes (serial, time, width, depth, height, accepted) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 zip(rows["serial"].tolist(), rows["time"].tolist(), *measures,
+                                     rows["accepted"].tolist()))
+            self._db.commit()
+        self.flushed += self.pending
+        self.pending = 0
+
+    def get_box(self, serial: str) -> Optional[dict]:
+        """
+        :param serial: serial of the box
+        :return: the last result of the box (None if unknown)
+        """
+        i = self.by_serial.get(serial)
+        if i is not None:
+            result = self.results[i].copy()
+            if result["serial"] == serial:  # else overwritten by the simulation loop meanwhile, it is in the database
+                return {"serial": serial, "time": float(result["time"]),
+                        "measures": result["measures"].astype(float).tolist(), "accepted": bool(result["accepted"])}
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT serial, time, width, depth, height, accepted FROM boxes WHERE serial = ? "
+                                   "ORDER BY time DESC LIMIT 1", (serial,)).fetchone()
+        if row is not None:
+            return {"serial": row[0], "time": row[1], "measures": list(row[2:5]), "accepted": bool(row[5])}
+        return None
+
+    def reject_rate(self, minutes: float) -> dict:
+        """
+        :param minutes: window ending at the last result, in minutes (the minute of the last result counts as a whole
+        one), at most the minutes of counters kept
+        :return: boxes, rejected boxes and reject rate (0 without boxes) in the window
+        """
+        last = int(self.last_time // 60)
+        window = max(1, min(int(-(-minutes // 1)), self.minutes))
+        boxes = rejected = 0
+        for minute in range(last - window + 1, last + 1):
+            slot = minute % self.minutes
+            if self.bucket_minute[slot] == minute:
+                boxes += self.bucket_boxes[slot]
+                rejected += self.bucket_rejected[slot]
+        return {
+            "minutes": window,
+            "boxes": boxes,
+            "rejected": rejected,
+            "reject_rate": rejected / boxes if boxes else .0,
+        }
+
+    def close(self):
+        """
+        Write the remaining results and close the database
+        """
+        self.flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def report(self) -> str:
+        db = f", database {self.db_path}" if self.db_path is not None else ""
+        return f"Box results: {self.capacity} in memory ({self.nbytes / 1024:.0f} kB){db}"
+
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+    from .box_conveyor import Box
+
+    N = 200_000
+    boxes = [Box() for _ in range(1000)]
+    for box in boxes:
+        box.marked = random.random() < 0.7
+    with tempfile.TemporaryDirectory() as tmp:
+        store = BoxResultStore(db_path=Path(tmp) / "results.sqlite")
+        t0 = time.perf_counter()
+        for n in range(N):
+            box = boxes[n % len(boxes)]
+            box.serial = f"{n:06X}"
+            store.add(box, n * 0.001)  # 1000 boxes per second
+            store.maybe_flush()
+        store.flush()
+        elapsed = time.perf_counter() - t0
+        print(f"{N} results in {elapsed:.2f} s ({N / elapsed:,.0f} results/s, written in batches)")
+
+        for label, serial in (("in memory", f"{N - 10:06X}"), ("in the database", f"{10:06X}")):
+            t0 = time.perf_counter()
+            for _ in range(1000):
+                result = store.get_box(serial)
+            print(f"box by serial, {label}: {(time.perf_counter() - t0) * 1000:.1f} us, {result}")
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            rate = store.reject_rate(3)
+        print(f"reject rate of the last 3 minutes: {(time.perf_counter() - t0) * 1000:.1f} us, {rate}")
+        store.close()
@@ -0,0 +1,177 @@
+"""
+Rolling SPC statistics of the gauge measures (width, depth, height). The measures are queued and merged in batches
+(every SPC_BATCH measures and before a report), so a step of the belt only appends its measures to a list:
+- mean and standard deviation of all the measures (Welford, merged batch by batch)
+- EWMA of the measures, with the control limits of the EWMA chart around the nominal size
+- the last SPC_WINDOW measures in a ring buffer: individuals control limits (mean +- 3 sigma), Cp and Cpk against the
+  tolerances, histogram over nominal +- 2 tolerances
+
+A merge costs the same whatever the number of boxes measured since the start; the windowed values are derived from
+the ring when a report is made (at most once per SPC_REPORT_INTERVAL by the engine). Time the updates and the report:
+
+    python -m box_conveyor.spc
+"""
+import numpy as np
+from components.checkpoint import Checkpointable
+
+SPC_WINDOW = 1000  # measures of the rolling window
+SPC_EWMA_ALPHA = 0.05  # weight of a new measure in the EWMA
+SPC_EWMA_L = 3.0  # width of the EWMA control limits [sigma of the EWMA]
+SPC_BATCH = 256  # queued measures merged at once
+SPC_BINS = 20  # histogram bins between nominal - 2 tolerances and nominal + 2 tolerances
+SPC_REPORT_INTERVAL = 1.0  # wall clock time between two reports published by the engine [s]
+DIMENSIONS = ("width", "depth", "height")
+_ARRAYS = ("mean", "m2", "ewma", "window")  # numpy attributes of SpcStats
+
+
+class SpcStats(Checkpointable):
+    """
+    Rolling statistics of the three dimensions of the measured boxes
+    """
+
+    def __init__(self, window=SPC_WINDOW, alpha=SPC_EWMA_ALPHA, bins=SPC_BINS):
+        """
+        :param window: measures of the rolling window
+        :param alpha: weight of a new measure in the EWMA (0 < alpha <= 1)
+        :param bins: histogram bins between nominal - 2 tolerances and nominal + 2 tolerances
+        """
+        self.alpha = alpha
+        self.bins = bins
+        self.count = 0
+        self.mean = np.zeros(len(DIMENSIONS))
+        self.m2 = np.zeros(len(DIMENSIONS))  # sum of the squared deviations from the mean
+        self.ewma = np.zeros(len(DIMENSIONS))
+        self.window = np.zeros((window, len(DIMENSIONS)))
+        self.head = 0  # index of the next measure in the window
+        self.size = 0
+        self.pending: list[list[float]] = []  # measures not merged yet
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        for name in _ARRAYS:  # lists, the restricted unpickler of the checkpoints does not load numpy arrays
+            state[name] = state[name].tolist()
+        return state
+
+    def __setstate__(self, state: dict):
+        super().__setstate__(state)
+        for name in _ARRAYS:
+            setattr(self, name, np.asarray(getattr(self, name), dtype=float))
+
+    def add(self, measures: list[float]):
+        """
+        :param measures: width, depth and height of a measured box
+        """
+        pending = self.pending
+        pending.append(measures)
+        if len(pending) >= SPC_BATCH:
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the queued measures into the statistics
+        """
+        measures = self.pending
+        if not measures:
+            return
+        self.pending = []
+        batch = np.asarray(measures, dtype=float)
+        n = len(batch)
+
+        # Welford: the batch mean and squared deviations are merged with the previous ones
+        batch_mean = batch.mean(axis=0)
+        batch_m2 = ((batch - batch_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * (n / total)
+        self.m2 += batch_m2 + delta ** 2 * (self.count * n / total)
+
+        # EWMA: e_k = (1 - alpha) * e_k-1 + alpha * x_k, applied to the batch at once
+        values = batch
+        if self.count == 0:
+            self.ewma[:] = values[0]
+            values = values[1:]
+        if len(values):
+            decay = (1 - self.alpha) ** np.arange(len(values) - 1, -1, -1)
+            self.ewma = self.ewma * (1 - self.alpha) ** len(values) + self.alpha * (decay @ values)
+        self.count = total
+
+        # window: only the last measures of a batch longer than the window are kept
+        capacity = len(self.window)
+        latest = batch[-capacity:]
+        first = self.head
+        end = first + len(latest)
+        if end <= capacity:
+            self.window[first:end] = latest
+        else:
+            split = capacity - first
+            self.window[first:] = latest[:split]
+            self.window[:end - capacity] = latest[split:]
+        self.head = end % capacity
+        self.size = min(self.size + len(latest), capacity)
+
+    def get_std(self) -> np.ndarray:
+        """
+        :return: standard deviation of the merged measures
+        """
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros(len(DIMENSIONS))
+
+    def report(self, nominal: list[float], tolerances: list[float]) -> dict:
+        """
+        :param nominal: nominal width, depth and height (center of the tolerance interval)
+        :param tolerances: half width of the tolerance intervals
+        :return: statistics of every dimension, Cp and Cpk are None without enough measures in the window
+        """
+        self.merge()
+        std = self.get_std()
+        ewma_sigma = std * np.sqrt(self.alpha / (2 - self.alpha))  # asymptotic sigma of the EWMA
+        window = self.window[:self.size]
+        window_mean = window.mean(axis=0) if self.size else np.zeros(len(DIMENSIONS))
+        window_std = window.std(axis=0, ddof=1) if self.size > 1 else np.zeros(len(DIMENSIONS))
+
+        dimensions = {}
+        for i, name in enumerate(DIMENSIONS):
+            mean, sigma, tol = float(window_mean[i]), float(window_std[i]), float(tolerances[i])
+            low, high = nominal[i] - 2 * tol, nominal[i] + 2 * tol
+            counts = np.histogram(np.clip(window[:, i], low, high), self.bins, (low, high))[0] if tol > 0 else []
+            dimensions[name] = {
+                "count": self.count,
+                "mean": float(self.mean[i]),
+                "std": float(std[i]),
+                "ewma": float(self.ewma[i]),
+                "ewma_lcl": nominal[i] - SPC_EWMA_L * float(ewma_sigma[i]),
+                "ewma_ucl": nominal[i] + SPC_EWMA_L * float(ewma_sigma[i]),
+                "window": self.size,
+                "window_mean": mean,
+                "window_std": sigma,
+                "lcl": mean - 3 * sigma,
+                "ucl": mean + 3 * sigma,
+                "cp": tol / (3 * sigma) if sigma > 0 else None,
+                "cpk": min(nominal[i] + tol - mean, mean - nominal[i] + tol) / (3 * sigma) if sigma > 0 else None,
+                "histogram": {"low": low, "high": high, "counts": [int(c) for c in counts]},  # ends include outliers
+            }
+        return dimensions
+
+
+if __name__ == '__main__':
+    import json
+    import random
+    import time
+
+    stats = SpcStats()
+    nominal, tolerances = [50.0, 80.0, 100.0], [5.0, 8.0, 10.0]
+    for batch_size in (1, 100):
+        batches = [[[random.gauss(m, t / 3) for m, t in zip(nominal, tolerances)] for _ in range(batch_size)]
+                   for _ in range(100)]
+        N = 20000 // batch_size
+        t0 = time.perf_counter()
+        for k in range(N):
+            for measures in batches[k % 100]:
+                stats.add(measures)
+        elapsed = time.perf_counter() - t0
+        print(f"update, {batch_size:3d} boxes per step: {elapsed / N * 1e6:6.1f} us per step, "
+              f"{elapsed / (N * batch_size) * 1e6:5.2f} us per box")
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        report = stats.report(nominal, tolerances)
+    print(f"report: {(time.perf_counter() - t0) * 1000:.1f} us")
+    print(json.dumps(report["width"]))
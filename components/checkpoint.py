@@ -0,0 +1,199 @@
+"""
+Snapshot and restore of the simulation models.
+
+A checkpoint is CHECKPOINT_MAGIC, one version byte and the zlib compressed pickle of the state. Only the models of
+the simulator packages (Checkpointable subclasses), their enumerations and a few builtins can be loaded back, not the
+other classes of the packages nor the ones they import, so a checkpoint can not execute arbitrary code.
+"""
+from typing import Optional, Callable, Any
+from pathlib import Path
+from enum import Enum
+import asyncio
+import io
+import pickle
+import zlib
+
+CHECKPOINT_MAGIC = b"SIMCKPT"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_COMPRESSION = 6  # zlib level
+CHECKPOINT_INTERVAL = 60.0  # default simulated time between two periodic checkpoints [s]
+ALLOWED_PACKAGES = ("components", "CNC_machine", "box_conveyor", "pool_boiler")
+ALLOWED_BUILTINS = {"set", "frozenset", "complex", "range", "slice", "bytearray"}
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class RestrictedUnpickler(pickle.Unpickler):
+    """
+    Unpickler that loads only the models of the simulator packages (Checkpointable) and their enumerations
+    """
+
+    def find_class(self, module: str, name: str):
+        if "." not in name:  # a dotted name would reach the attributes of the module (its imports)
+            if module == "builtins" and name in ALLOWED_BUILTINS:
+                return super().find_class(module, name)
+            if module.split(".")[0] in ALLOWED_PACKAGES:
+                cls = super().find_class(module, name)
+                # not the functions, the other classes (their constructor could be called with any argument) nor
+                # the classes the module imported from elsewhere
+                if isinstance(cls, type) and issubclass(cls, (Checkpointable, Enum)) and \
+                        cls.__module__.split(".")[0] in ALLOWED_PACKAGES:
+                    return cls
+        raise CheckpointError(f"Class not allowed in a checkpoint: {module}.{name}")
+
+
+class Checkpointable:
+    """
+    Mixin for the simulation models. The attributes listed in _checkpoint_exclude (servers, tasks, clients...) are not
+    saved and are restored as None
+    """
+
+    _checkpoint_exclude: tuple[str, ...] = ()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for name in self._checkpoint_exclude:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        for name in self._checkpoint_exclude:
+            setattr(self, name, None)
+
+    def snapshot(self) -> bytes:
+        """
+        :return: the checkpoint of the object
+        """
+        return dumps(self)
+
+    def fork(self):
+        """
+        :return: an independent copy of the object, made through the checkpoint format
+        """
+        return loads(self.snapshot())
+
+
+def compress(payload: bytes) -> bytes:
+    """
+    :param payload: pickled state
+    :return: the checkpoint
+    """
+    return CHECKPOINT_MAGIC + bytes((CHECKPOINT_VERSION,)) + zlib.compress(payload, CHECKPOINT_COMPRESSION)
+
+
+def dumps(state: Any) -> bytes:
+    """
+    :param state: the object (or a dict/tuple of objects) to save
+    :return: the checkpoint
+    """
+    return compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def loads(data: bytes) -> Any:
+    """
+    :param data: a checkpoint
+    :return: the saved object
+    """
+    header_len = len(CHECKPOINT_MAGIC) + 1
+    if data[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise CheckpointError("Not a checkpoint")
+    if data[len(CHECKPOINT_MAGIC)] != CHECKPOINT_VERSION:
+        raise CheckpointError(f"Unsupported checkpoint version: {data[len(CHECKPOINT_MAGIC)]}")
+    try:
+        payload = zlib.decompress(data[header_len:])
+    except zlib.error as e:
+        raise CheckpointError(f"Corrupted checkpoint: {e}")
+    return RestrictedUnpickler(io.BytesIO(payload)).load()
+
+
+def write_file(path: Path, data: bytes):
+    """
+    Write the checkpoint on a temporary file and replace the old one, a crash never leaves a half written checkpoint
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(data)
+    tmp_path.replace(path)
+
+
+def save(path: Path, state: Any):
+    write_file(path, dumps(state))
+
+
+def load(path: Path) -> Any:
+    with path.open("rb") as f:
+        return loads(f.read())
+
+
+class CheckpointWriter:
+    """
+    Periodic checkpoints of a running simulation. The state is pickled in the event loop between two ticks (so it is
+    consistent and it is only a copy in memory), the compression and the file writing run in a worker thread
+    """
+
+    def __init__(self, path: Path, interval=CHECKPOINT_INTERVAL):
+        """
+        :param path: checkpoint file
+        :param interval: simulated time between two checkpoints [s]
+        """
+        self.path = path
+        self.interval = interval
+        self.last_time: Optional[float] = None
+        self.saved = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _write(self, payload: bytes):
+        write_file(self.path, compress(payload))
+        self.saved += 1
+
+    def save(self, sim_time: float, get_state: Callable[[], Any]) -> bool:
+        """
+        Start a checkpoint, unless the previous one is still being written
+        :param sim_time: simulation time [s]
+        :param get_state: function returning the state to save
+        :return: True if the checkpoint has been started
+        """
+        if self._task is not None and not self._task.done():
+            return False
+        payload = pickle.dumps(get_state(), protocol=pickle.HIGHEST_PROTOCOL)
+        self._task = asyncio.create_task(asyncio.to_thread(self._write, payload))
+        self.last_time = sim_time
+        return True
+
+    def maybe_save(self, sim_time: float, get_state: Callable[[], Any]) -> bool:
+        """
+        Start a checkpoint if the interval has elapsed since the last one, it must be called once per tick
+        :param sim_time: simulation time [s]
+        :param get_state: function returning the state to save (called only when a checkpoint is due)
+        :return: True if the checkpoint has been started
+        """
+        if self.last_time is None:
+            self.last_time = sim_time
+            return False
+        if sim_time - self.last_time < self.interval:
+            return False
+        return self.save(sim_time, get_state)
+
+    async def wait(self):
+        """
+        Wait for the checkpoint being written (if any)
+        """
+        if self._task is not None:
+            await self._task
+
+    def load(self) -> Optional[Any]:
+        """
+        :return: the saved state, None if there is no valid checkpoint
+        """
+        if not self.path.is_file():
+            return None
+        try:
+            return load(self.path)
+        except (CheckpointError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError,
+                ValueError) as e:  # also a checkpoint of an older version of the classes
+            print(f"Invalid checkpoint {self.path}: {e}")
+            return None
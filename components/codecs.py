@@ -0,0 +1,202 @@
+"""
+Payload formats of the MQTT messages. A message is a record, a dict built by a Schema: its fields are always in the
+order of the schema, so every format lays out the same message the same way whatever the code that filled it.
+
+Formats (selected by name with get_codec):
+- json: orjson when installed (same output, compact and faster), else the json module
+- msgpack: MessagePack map of the fields (package msgpack)
+- cbor: CBOR map of the fields (package cbor2)
+- bin: the fixed struct layout of the schema, without field names (only the schemas that define one)
+
+Bytes per message and encoding time of every format:
+
+    python -m components.codecs
+"""
+from typing import Callable, Optional
+import json
+
+try:
+    import orjson
+except ImportError:  # the json module is used
+    orjson = None
+
+
+class Schema:
+    """
+    Fields of a message, in order, and its optional struct layout
+    """
+
+    def __init__(self, name: str, fields: tuple[str, ...], pack: Optional[Callable[[dict], bytes]] = None,
+                 unpack: Optional[Callable[[bytes], dict]] = None):
+        """
+        :param name: name of the message
+        :param fields: names of the fields, in order
+        :param pack: record -> struct bytes (format bin), None if the message has no binary layout
+        :param unpack: struct bytes -> record
+        """
+        self.name = name
+        self.fields = fields
+        self.pack = pack
+        self.unpack = unpack
+
+    def record(self, *values) -> dict:
+        """
+        :param values: values of the fields, in order
+        """
+        return dict(zip(self.fields, values))
+
+
+class Codec:
+    """
+    Encoding of the records in a payload format
+    """
+    name = ""
+
+    def supports(self, schema: Schema) -> bool:
+        return True
+
+    def encode(self, schema: Schema, record: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, schema: Schema, payload: bytes) -> dict:
+        """
+        :return: the record, with the fields present in the payload
+        """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def encode(self, schema: Schema, record: dict) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(record)
+        return json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, schema: Schema, payload: bytes) -> dict:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, schema: Schema, record: dict) -> bytes:
+        return self._packb(record)
+
+    def decode(self, schema: Schema, payload: bytes) -> dict:
+        return self._unpackb(payload)
+
+
+class CborCodec(Codec):
+    name = "cbor"
+
+    def __init__(self):
+        import cbor2
+        self._dumps = cbor2.dumps
+        self._loads = cbor2.loads
+
+    def encode(self, schema: Schema, record: dict) -> bytes:
+        return self._dumps(record)
+
+    def decode(self, schema: Schema, payload: bytes) -> dict:
+        return self._loads(payload)
+
+
+class StructCodec(Codec):
+    name = "bin"
+
+    def supports(self, schema: Schema) -> bool:
+        return schema.pack is not None
+
+    def encode(self, schema: Schema, record: dict) -> bytes:
+        return schema.pack(record)
+
+    def decode(self, schema: Schema, payload: bytes) -> dict:
+        return schema.unpack(payload)
+
+
+CODECS: dict[str, Callable[[], Codec]] = {
+    JsonCodec.name: JsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    CborCodec.name: CborCodec,
+    StructCodec.name: StructCodec,
+}
+_instances: dict[str, Codec] = {}
+
+
+def register_codec(name: str, factory: Callable[[], Codec]):
+    """
+    :param name: name of the format
+    :param factory: creates the codec (it can import its package, ImportError if missing)
+    """
+    CODECS[name] = factory
+    _instances.pop(name, None)
+
+
+def get_codec(name: str) -> Codec:
+    """
+    :param name: name of the format
+    :return: the codec, ValueError if the format is unknown, ImportError if its package is not installed
+    """
+    codec = _instances.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError(f"Unknown payload format: {name} (formats: {', '.join(CODECS)})")
+        codec = _instances[name] = CODECS[name]()
+    return codec
+
+
+def parse_formats(spec: str, defaults: dict[str, list[str]]) -> dict[str, list[str]]:
+    """
+    :param spec: formats of some message families, e.g. "box=msgpack;counters=json,cbor" (empty for the defaults)
+    :param defaults: family -> formats
+    :return: family -> formats, the families not in spec keep their defaults
+    """
+    formats = {family: list(names) for family, names in defaults.items()}
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        family, _, names = item.partition("=")
+        family = family.strip()
+        if family not in formats:
+            raise ValueError(f"Unknown message family: {family} (families: {', '.join(formats)})")
+        formats[family] = [name.strip() for name in names.split(",") if name.strip()]
+    return formats
+
+
+if __name__ == '__main__':
+    import time
+    from box_conveyor.box_conveyor import Box, Conveyor, BOX_SCHEMA, COUNTERS_SCHEMA, SETTINGS_SCHEMA
+
+    N = 20000
+    conveyor = Conveyor()
+    box = Box()
+    box.marked = conveyor.measure_box(box)  # measures with all their digits, as published
+    records = [(BOX_SCHEMA, box.to_record()), (COUNTERS_SCHEMA, conveyor.get_counters_record()),
+               (SETTINGS_SCHEMA, conveyor.get_settings_record())]
+    print(f"json: {'orjson' if orjson is not None else 'json module'}")
+    print(f"{'format':<8} {'message':<9} {'bytes':>6} {'encode':>9} {'decode':>9}")
+    for name in CODECS:
+        try:
+            codec = get_codec(name)
+        except ImportError as e:
+            print(f"{name:<8} not available: {e}")
+            continue
+        for schema, record in records:
+            if not codec.supports(schema):
+                continue
+            payload = codec.encode(schema, record)
+            t0 = time.perf_counter()
+            for _ in range(N):
+                codec.encode(schema, record)
+            encode = (time.perf_counter() - t0) / N
+            t0 = time.perf_counter()
+            for _ in range(N):
+                codec.decode(schema, payload)
+            decode = (time.perf_counter() - t0) / N
+            print(f"{name:<8} {schema.name:<9} {len(payload):>6} {encode * 1e6:>6.2f} us {decode * 1e6:>6.2f} us")
@@ -1,20 +1,27 @@
 from typing import Optional
+from .checkpoint import Checkpointable
 
 
-class PIRegulator:
+class PIRegulator(Checkpointable):
     def __init__(self, kd: float,
                  ki: float,
                  set_point: float,
                  max_out: Optional[float] = None,
                  min_out: Optional[float] = None,
-                 wind_up: Optional[float] = None):
+                 wind_up: Optional[float] = None,
+                 k_back: Optional[float] = None,
+                 k_der=.0):
         """
         :param kd: proportional gain
         :param ki: integral gain
         :param set_point: starting set point
         :param max_out: max output value
         :param min_out: min output value
-        :param wind_up: anti wind up value (limit of the integral error)
+        :param wind_up: anti wind up value (limit of the absolute value of the integral error)
+        :param k_back: back-calculation anti wind up gain, when the output is saturated the integral error is
+        corrected by k_back * (saturated output - output) / ki per second (disabled if None)
+        :param k_der: derivative gain, the derivative is computed on the measurement (not on the error) so a set point
+        change does not kick the output
         """
 
         self.kd = kd
@@ -23,36 +30,67 @@ class PIRegulator:
         self.max_out = max_out
         self.min_out = min_out
         self.wind_up = wind_up
-        self._ie = 0
-        self._old_e = 0
-        self._old_t = 0
+        self.k_back = k_back
+        self.k_der = k_der
+        self._ie = .0
+        self._old_e = .0
+        self._old_input = .0
+        self._old_t: Optional[float] = None  # None until the first run after a reset
+        self._saturation = .0  # saturated output - output of the last run
 
-    def run(self, time: float, input_val: float):
+    @property
+    def kp(self) -> float:
+        """
+        proportional gain (historically called kd)
+        """
+        return self.kd
+
+    @kp.setter
+    def kp(self, value: float):
+        self.kd = value
+
+    def run(self, time: float, input_val: float) -> float:
         """
         Main function that compute the new parameters for the simulation
         :param time: current time [s]
         :param input_val: current input value
         """
         e = self.set_point - input_val
-        self._ie += (self._old_e + e) * (time - self._old_t) / 2
-        if self.wind_up is not None and self._ie > self.wind_up:
-            self._ie = self.wind_up
+
+        if self._old_t is None:  # first run: nothing to integrate or derive
+            dt = .0
+            d_input = .0
+        else:
+            dt = time - self._old_t
+            d_input = (input_val - self._old_input) / dt if dt > 0 else .0
+
+        self._ie += (self._old_e + e) * dt / 2
+        if self.k_back is not None and self.ki:
+            self._ie += self.k_back * self._saturation / self.ki * dt
+        if self.wind_up is not None:
+            if self._ie > self.wind_up:
+                self._ie = self.wind_up
+            elif self._ie < -self.wind_up:
+                self._ie = -self.wind_up
 
         self._old_e = e
+        self._old_input = input_val
         self._old_t = time
 
-        out = self.kd * e + self.ki * self._ie
+        out = self.kd * e + self.ki * self._ie - self.k_der * d_input
 
+        saturated = out
         if self.max_out is not None and out > self.max_out:
-            return self.max_out
-        if self.min_out is not None and out < self.min_out:
-            return self.min_out
+            saturated = self.max_out
+        elif self.min_out is not None and out < self.min_out:
+            saturated = self.min_out
+        self._saturation = saturated - out
 
-        return out
+        return saturated
 
     def reset(self):
-        self._ie = 0
-        self._old_e = 0
-
-
-
+        self._ie = .0
+        self._old_e = .0
+        self._old_input = .0
+        self._old_t = None
+        self._saturation = .0
@@ -1,8 +1,10 @@
 from typing import Optional
 import math
+import numpy as np
+from .checkpoint import Checkpointable
 
 
-class SingleAxis:
+class SingleAxis(Checkpointable):
     def __init__(self, min_pos=.0, max_pos=100.0, max_speed=10.0, max_acc=100.0, mass=1.0, friction=10.0):
         """
         :param min_pos: the minimum position of the axis (CURRENTLY NOT USED)
@@ -185,6 +187,33 @@ class SingleAxis:
     def is_moving(self) -> bool:
         return not math.isclose(self._target_pos, self._current_pos)
 
+    def sample(self, times: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Virtual position and speed of the axis at the given times, computed from the current movement without changing
+        the state. Call it before the run of the tick: the times are between the last run and the next one (the last
+        time), a movement not started yet starts at the next run
+        :param times: ascending simulation times [s]
+        :return: positions [m] and speeds [m/s]
+        """
+        if not self.is_moving():
+            return (np.full(len(times), self.get_virtual_position()),
+                    np.full(len(times), self.current_speed))
+        start_time = self._movement_start_time or times[-1]
+        t = np.maximum(times - start_time, .0)
+        t_dec = t - self.dec_time
+        acc_phase = t < self.acc_time
+        const_phase = (t >= self.acc_time) & (t < self.dec_time)
+        dec_phase = (t >= self.dec_time) & (t < self.movement_time)
+        trip = np.select([acc_phase, const_phase, dec_phase],
+                         [0.5 * self.max_acc * t ** 2,
+                          self.acc_trip + self.target_speed * (t - self.acc_time),
+                          self.dec_trip + self.target_speed * t_dec - 0.5 * self.max_acc * t_dec ** 2],
+                         self.trip)
+        speed = np.select([acc_phase, const_phase, dec_phase],
+                          [self.max_acc * t, np.full(len(t), self.target_speed),
+                           self.target_speed - self.max_acc * t_dec], .0)
+        return self.physical_to_virtual(self._movement_start_pos + self.direction * trip), self.direction * speed
+
 
 if __name__ == '__main__':
     # for testing purpose
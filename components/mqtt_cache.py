@@ -0,0 +1,73 @@
+"""
+Last-value cache of the MQTT state topics: a state (settings, counters, last measure...) is published retained, and only
+when its payload differs from the last one sent on the topic. A new subscriber gets the current state from the broker
+at once, and the traffic follows the rate of the changes instead of the tick rate. Every state is sent again after
+MQTT_KEYFRAME_INTERVAL seconds even if unchanged (a keyframe), so a broker restarted without its retained messages
+is refilled.
+
+Events (every measured box, errors) are not states: they are published as they come, not retained.
+"""
+from typing import Any
+import os
+import time
+
+MQTT_KEYFRAME_INTERVAL = float(os.getenv("MQTT_KEYFRAME_INTERVAL", "30"))  # [s], 0 to publish the states every time
+
+
+def to_payload(value: Any) -> bytes:
+    """
+    :param value: payload as accepted by paho (bytes, str, int, float or None)
+    :return: the bytes paho would send
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if value is None:
+        return b""
+    return str(value).encode("ascii")
+
+
+class PublishCache:
+    """
+    Publisher of the state topics of a paho client, skipping the payloads already sent
+    """
+
+    def __init__(self, client, keyframe_interval=MQTT_KEYFRAME_INTERVAL):
+        """
+        :param client: connected paho client
+        :param keyframe_interval: time after which an unchanged state is sent again [s]
+        """
+        self.client = client
+        self.keyframe_interval = keyframe_interval
+        self.last: dict[str, tuple[bytes, float]] = {}  # topic -> last payload sent, time it was sent
+        self.sent = 0
+        self.skipped = 0
+
+    def publish_state(self, topic: str, value: Any, qos=0) -> bool:
+        """
+        Publish a state, retained, if it changed or if its keyframe is due
+        :param topic: state topic
+        :param value: payload (bytes, str, int, float or None)
+        :param qos: quality of service
+        :return: True if the payload has been sent
+        """
+        payload = to_payload(value)
+        now = time.monotonic()
+        last = self.last.get(topic)
+        if last is not None and last[0] == payload and now - last[1] < self.keyframe_interval:
+            self.skipped += 1
+            return False
+        self.client.publish(topic, payload, qos, retain=True)
+        self.last[topic] = (payload, now)
+        self.sent += 1
+        return True
+
+    def publish_event(self, topic: str, value: Any, qos=0):
+        """
+        Publish an event, always and not retained
+        :param topic: event topic
+        :param value: payload (bytes, str, int, float or None)
+        :param qos: quality of service
+        """
+        self.client.publish(topic, value, qos)
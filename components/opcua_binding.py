@@ -0,0 +1,216 @@
+"""
+Declarative binding between the simulation models and the OPC-UA address space.
+
+A schema is a list of Object and Variable that declares the nodes and the attributes of the model they show. The same
+schema can be bound to any number of models (e.g. the four axes of a CNC, or N machines). OPCUABinding adds the nodes
+with a NodeBatch, then synchronizes all the bound models once per tick with one write of all the monitored values and
+one read of all the writable settings (a variable declared with a version is written only when its version changes,
+for the values that are expensive to compute). The variables declared with historize=True are listed in historized, for
+enable_history (see components.opcua_history).
+"""
+from typing import Optional, Callable, Any, Union
+from datetime import datetime, timezone
+from operator import attrgetter
+from asyncua import Server, ua
+from asyncua.common.node import Node
+from .opcua_nodes import NodeBatch
+
+# python type of the values of a variant type
+_VARIANT_CASTS = {
+    ua.VariantType.Double: float,
+    ua.VariantType.Int64: int,
+    ua.VariantType.Boolean: bool,
+    ua.VariantType.String: str,
+}
+
+
+class Variable:
+    """
+    Variable node bound to an attribute of the source object, or to a function of it (read only)
+    """
+
+    def __init__(self, name: str, value: Union[str, Callable[[Any], Any]], writable=False,
+                 varianttype=ua.VariantType.Double, historize=False, version: Optional[Callable[[Any], Any]] = None):
+        """
+        :param name: browse name
+        :param value: attribute of the source object (can be a dotted path) or function of the source object
+        :param writable: the clients can change the attribute, the value is read back every sync
+        :param varianttype: type of the node, the values are converted to it (the server refuses a value of another
+        type)
+        :param historize: the clients can read the past values with HistoryRead
+        :param version: cheap function of the source object that changes when the value changes (read only), the
+        value is computed and written only then. None to write the value every sync
+        """
+        if writable and not isinstance(value, str):
+            raise ValueError(f"The writable variable {name} must be bound to an attribute")
+        if writable and version is not None:
+            raise ValueError(f"The writable variable {name} can not have a version")
+        self.name = name
+        self.value = value
+        self.writable = writable
+        self.varianttype = varianttype
+        self.historize = historize
+        self.version = version
+
+
+class Object:
+    """
+    Object node, its children are bound to the same source object or to one of its attributes
+    """
+
+    def __init__(self, name: str, children: list[Union["Object", Variable]], source: Optional[str] = None):
+        """
+        :param name: browse name
+        :param children: variables and objects in the object
+        :param source: attribute (can be a dotted path) of the source object used as source by the children, None to
+        use the same source
+        """
+        self.name = name
+        self.children = children
+        self.source = source
+
+
+def _join(*paths: Optional[str]) -> str:
+    return ".".join(path for path in paths if path)
+
+
+class OPCUABinding:
+    """
+    Nodes bound to the simulation models. The write and read requests are built once, when the nodes are added
+    """
+
+    def __init__(self, server: Server):
+        """
+        :param server: initialized server
+        """
+        self.server = server
+        self._write_params = ua.WriteParameters()
+        self._getters: list[Callable[[], Any]] = []
+        self._casts: list[tuple[ua.VariantType, Callable[[Any], Any]]] = []
+        self._read_params = ua.ReadParameters()
+        self._setters: list[Callable[[Any], None]] = []
+        # variables written when their version changes: write value, getter, cast, version getter
+        self._versioned: list[tuple[ua.WriteValue, Callable[[], Any], tuple[ua.VariantType, Callable[[Any], Any]],
+                                    Callable[[], Any]]] = []
+        self._versions: list[Any] = []  # last written version of the versioned variables
+        self.historized: list[Node] = []  # nodes of the variables declared with historize=True
+
+    @property
+    def n_monitored(self) -> int:
+        """
+        number of values written by write (at most)
+        """
+        return len(self._getters) + len(self._versioned)
+
+    @property
+    def n_settings(self) -> int:
+        """
+        number of values read by read
+        """
+        return len(self._setters)
+
+    def add(self, nodes: NodeBatch, parent: Node, schema: list[Union[Object, Variable]],
+            get_source: Callable[[], Any]) -> dict[str, Node]:
+        """
+        Declare the nodes of a schema in a batch (they exist on the server after the commit of the batch)
+        :param nodes: batch of the new nodes
+        :param parent: node that contains the schema
+        :param schema: objects and variables to add
+        :param get_source: function returning the bound model (called every sync, so the model can be replaced)
+        :return: the nodes by path (e.g. "Axes/X/Current_pos")
+        """
+        added = {}
+        self._add(nodes, parent, schema, get_source, "", "", added)
+        return added
+
+    def _add(self, nodes: NodeBatch, parent: Node, schema: list[Union[Object, Variable]],
+             get_source: Callable[[], Any], source: str, path: str, added: dict[str, Node]):
+        for item in schema:
+            item_path = f"{path}/{item.name}" if path else item.name
+            if isinstance(item, Object):
+                node = nodes.add_object(parent, item.name)
+                added[item_path] = node
+                self._add(nodes, node, item.children, get_source, _join(source, item.source), item_path, added)
+                continue
+
+            get_parent = attrgetter(source) if source else (lambda obj: obj)
+            if isinstance(item.value, str):
+                get_attribute = attrgetter(_join(source, item.value))
+
+                def getter(get_attribute=get_attribute):
+                    return get_attribute(get_source())
+            else:
+                def getter(get_parent=get_parent, function=item.value):
+                    return function(get_parent(get_source()))
+
+            cast = _VARIANT_CASTS.get(item.varianttype, lambda v: v)
+            node = nodes.add_variable(parent, item.name, cast(getter()), writable=item.writable,
+                                      varianttype=item.varianttype)
+            added[item_path] = node
+            if item.historize:
+                self.historized.append(node)
+
+            if item.writable:
+                owner_path, _, attribute = _join(source, item.value).rpartition(".")
+                get_owner = attrgetter(owner_path) if owner_path else (lambda obj: obj)
+
+                def setter(new_value, get_owner=get_owner, attribute=attribute):
+                    setattr(get_owner(get_source()), attribute, new_value)
+
+                self._read_params.NodesToRead.append(
+                    ua.ReadValueId(NodeId=node.nodeid, AttributeId=ua.AttributeIds.Value))
+                self._setters.append(setter)
+            elif item.version is not None:
+                def get_version(get_parent=get_parent, function=item.version):
+                    return function(get_parent(get_source()))
+
+                self._versioned.append((ua.WriteValue(NodeId=node.nodeid, AttributeId=ua.AttributeIds.Value), getter,
+                                        (item.varianttype, cast), get_version))
+                self._versions.append(get_version())  # the node has been added with the current value
+            else:
+                self._write_params.NodesToWrite.append(
+                    ua.WriteValue(NodeId=node.nodeid, AttributeId=ua.AttributeIds.Value))
+                self._getters.append(getter)
+                self._casts.append((item.varianttype, cast))
+
+    async def write(self) -> int:
+        """
+        Write all the monitored values with one request
+        :return: number of values written
+        """
+        now = datetime.now(timezone.utc)
+        # a new DataValue for every write: the server keeps a reference to the written one
+        for write_value, getter, (vtype, cast) in zip(self._write_params.NodesToWrite, self._getters, self._casts):
+            write_value.Value = ua.DataValue(ua.Variant(cast(getter()), vtype), SourceTimestamp=now)
+        params = self._write_params
+        for i, (write_value, getter, (vtype, cast), get_version) in enumerate(self._versioned):
+            version = get_version()
+            if version == self._versions[i]:
+                continue
+            self._versions[i] = version
+            write_value.Value = ua.DataValue(ua.Variant(cast(getter()), vtype), SourceTimestamp=now)
+            if params is self._write_params:
+                params = ua.WriteParameters(NodesToWrite=list(self._write_params.NodesToWrite))
+            params.NodesToWrite.append(write_value)
+        if params.NodesToWrite:
+            await self.server.iserver.isession.write(params)
+        return len(params.NodesToWrite)
+
+    async def read(self):
+        """
+        Read all the writable settings with one request and apply them to the models
+        """
+        if not self._setters:
+            return
+        for setter, data_value in zip(self._setters, await self.server.iserver.isession.read(self._read_params)):
+            if data_value.Value is not None:
+                setter(data_value.Value.Value)
+
+    async def sync(self) -> int:
+        """
+        Write the monitored values, then apply the settings changed by the clients
+        :return: number of values written
+        """
+        written = await self.write()
+        await self.read()
+        return written
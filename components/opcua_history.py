@@ -0,0 +1,370 @@
+"""
+OPC-UA historical access of the simulators.
+
+RingBufferHistory is a history storage for asyncua: every historized node keeps its last samples in two preallocated
+arrays (timestamps and values), so the memory used by a node is fixed when the node is historized and never grows.
+With a database file the samples leaving the ring buffer are spilled to SQLite in chunks (one executemany per chunk,
+in a worker thread) and a HistoryRead reads the disk and the memory together. The samples older than the last stored
+one are dropped, so the timestamps of a node are always sorted. The clients read a time window with one HistoryRead
+instead of polling the variables at high frequency.
+
+Only numeric and boolean variables can be historized (the values are stored as float64). Fill a ring buffer and
+compare the read of a time window with the polling of the same values:
+
+    python -m components.opcua_history
+"""
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import asyncio
+import logging
+import math
+import sqlite3
+import numpy as np
+from asyncua import Server, ua
+from asyncua.common.node import Node
+from asyncua.server.history import HistoryStorageInterface
+
+HISTORY_SIZE = 6000  # default samples kept in memory for every historized node
+HISTORY_SPILL_FRACTION = 0.25  # part of the ring buffer written to the database when the buffer is full
+HISTORY_ITEM_SIZE = 16  # bytes of a sample: float64 timestamp + float64 value
+
+# variant types that can be stored as float64
+_NUMERIC_TYPES = {
+    ua.VariantType.Boolean: bool,
+    ua.VariantType.SByte: int,
+    ua.VariantType.Byte: int,
+    ua.VariantType.Int16: int,
+    ua.VariantType.UInt16: int,
+    ua.VariantType.Int32: int,
+    ua.VariantType.UInt32: int,
+    ua.VariantType.Int64: int,
+    ua.VariantType.UInt64: int,
+    ua.VariantType.Float: float,
+    ua.VariantType.Double: float,
+}
+
+_logger = logging.getLogger(__name__)
+
+
+def _timestamp(date: Optional[datetime]) -> Optional[float]:
+    """
+    :return: the POSIX timestamp of an OPC-UA date (naive dates are UTC), None if the date is not specified
+    """
+    if date is None or date <= ua.get_win_epoch().replace(tzinfo=date.tzinfo):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+class RingBuffer:
+    """
+    Last samples of a historized node, in preallocated arrays
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: maximum number of samples
+        """
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.head = 0  # index of the next sample
+        self.size = 0
+        self.last = -math.inf  # timestamp of the newest sample, also after a spill
+        self.dropped = 0  # samples older than the newest one, not stored
+        self.vtype: Optional[ua.VariantType] = None  # type of the node, known from the first sample
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.values.nbytes
+
+    def append(self, timestamp: float, value: float):
+        """
+        Add a sample, the oldest is overwritten when the buffer is full
+        """
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.last = timestamp
+
+    def pop_oldest(self, n: int) -> list[tuple[float, float]]:
+        """
+        Remove the n oldest samples
+        :return: the removed samples (timestamp, value)
+        """
+        times, values = self.ordered()
+        n = min(n, self.size)
+        self.size -= n
+        return list(zip(times[:n].tolist(), values[:n].tolist()))
+
+    def ordered(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: timestamps and values from the oldest to the newest (views if the samples are contiguous)
+        """
+        first = (self.head - self.size) % self.capacity
+        if first + self.size <= self.capacity:
+            return self.times[first:first + self.size], self.values[first:first + self.size]
+        order = np.r_[first:self.capacity, 0:self.head]
+        return self.times[order], self.values[order]
+
+
+class RingBufferHistory(HistoryStorageInterface):
+    """
+    History storage with a fixed size ring buffer per node and an optional SQLite database for the older samples.
+    The events are not historized
+    """
+
+    def __init__(self, capacity=HISTORY_SIZE, db_path: Optional[Path] = None,
+                 max_history_data_response_size: int = 10000):
+        """
+        :param capacity: samples kept in memory for every node (when the node is historized with count=0)
+        :param db_path: SQLite database of the samples leaving the ring buffers, None to discard them
+        :param max_history_data_response_size: maximum number of values returned by a read, the client gets a
+        continuation point for the others
+        """
+        super().__init__(max_history_data_response_size)
+        self.capacity = capacity
+        self.db_path = db_path
+        self.buffers: dict[ua.NodeId, RingBuffer] = {}
+        self.periods: dict[ua.NodeId, Optional[timedelta]] = {}
+        self.spilled = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = asyncio.Lock()  # the connection is used by one worker thread at a time
+
+    async def init(self):
+        if self.db_path is None:
+            return
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS history (node TEXT NOT NULL, ts REAL NOT NULL, value REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_node_ts ON history (node, ts)")
+        self._db.commit()
+
+    async def new_historized_node(self, node_id: ua.NodeId, period: Optional[timedelta], count: int = 0):
+        """
+        :param node_id: historized node
+        :param period: age of the samples deleted from the database, None to keep them (the ring buffer is bounded
+        by its size only)
+        :param count: size of the ring buffer, 0 for the default capacity
+        """
+        self.buffers[node_id] = RingBuffer(count if count > 0 else self.capacity)
+        self.periods[node_id] = period
+
+    async def save_node_value(self, node_id: ua.NodeId, datavalue: ua.DataValue):
+        buffer = self.buffers.get(node_id)
+        if buffer is None or datavalue.Value is None:
+            return
+        vtype = datavalue.Value.VariantType
+        if buffer.vtype is None:
+            if vtype not in _NUMERIC_TYPES:
+                _logger.warning("Node %s not historized: %s values can not be stored", node_id, vtype.name)
+                del self.buffers[node_id]
+                return
+            buffer.vtype = vtype
+        timestamp = _timestamp(datavalue.SourceTimestamp or datavalue.ServerTimestamp or datetime.now(timezone.utc))
+        if timestamp < buffer.last:  # the reads search sorted timestamps
+            if not buffer.dropped:
+                _logger.warning("Node %s: samples older than the last stored one are dropped", node_id)
+            buffer.dropped += 1
+            return
+        spill = buffer.size == buffer.capacity and self._db is not None
+        samples = buffer.pop_oldest(max(1, int(buffer.capacity * HISTORY_SPILL_FRACTION))) if spill else []
+        buffer.append(timestamp, float(datavalue.Value.Value))
+        if samples:
+            await self._spill(node_id, samples)
+
+    async def _spill(self, node_id: ua.NodeId, samples: list[tuple[float, float]]):
+        """
+        Write samples removed from a ring buffer to the database, in a worker thread
+        """
+        async with self._db_lock:
+            await asyncio.to_thread(self._write_db, node_id, samples)
+        self.spilled += len(samples)
+
+    def _write_db(self, node_id: ua.NodeId, samples: list[tuple[float, float]]):
+        node = node_id.to_string()
+        self._db.executemany("INSERT INTO history (node, ts, value) VALUES (?, ?, ?)",
+                             [(node, timestamp, value) for timestamp, value in samples])
+        period = self.periods.get(node_id)
+        if period is not None and samples:
+            self._db.execute("DELETE FROM history WHERE node = ? AND ts < ?",
+                             (node, samples[-1][0] - period.total_seconds()))
+        self._db.commit()
+
+    def _read_db(self, node_id: ua.NodeId, low: float, high: float, limit: int, reverse: bool) -> np.ndarray:
+        """
+        :return: the samples in the database with low <= timestamp < high, as rows (timestamp, value)
+        """
+        rows = self._db.execute(f"SELECT ts, value FROM history WHERE node = ? AND ts >= ? AND ts < ? "
+                                f"ORDER BY ts {'DESC' if reverse else 'ASC'} LIMIT ?",
+                                (node_id.to_string(), low, high, limit)).fetchall()
+        return np.array(rows, dtype=float).reshape(-1, 2)
+
+    async def read_node_history(self, node_id: ua.NodeId, start: Optional[datetime], end: Optional[datetime],
+                                nb_values: int) -> tuple[list[ua.DataValue], Optional[datetime]]:
+        """
+        Samples of a node between start and end (inclusive). The values are sorted from start to end, or from the
+        newest when the start is not specified
+        :param nb_values: maximum number of values, 0 for all
+        :return: the values and the continuation point (timestamp of the first value not returned), None if all the
+        values have been returned
+        """
+        buffer = self.buffers.get(node_id)
+        if buffer is None:
+            return [], None
+        low, high = _timestamp(start), _timestamp(end)
+        reverse = low is None or (high is not None and low > high)
+        if low is not None and high is not None and low > high:
+            low, high = high, low
+        low = -math.inf if low is None else low
+        high = math.inf if high is None else high
+        # one value more than the response size, for the continuation point
+        needed = min(nb_values, self.max_history_data_response_size + 1) if nb_values \
+            else self.max_history_data_response_size + 1
+
+        # copy the window before reading the database: the buffer may change while waiting for the worker thread
+        times, values = buffer.ordered()
+        first, last = np.searchsorted(times, low, "left"), np.searchsorted(times, high, "right")
+        samples = np.column_stack((times[first:last], values[first:last]))
+        if reverse:
+            samples = samples[::-1]
+        oldest = times[0] if buffer.size else math.inf
+        # the database has only samples older than the ring buffer: read only if the window (or the response) needs them
+        if self._db is not None and low < oldest and not (reverse and len(samples) >= needed):
+            async with self._db_lock:  # after the spills already started, whose samples are no longer in the buffer
+                from_db = await asyncio.to_thread(self._read_db, node_id, low,
+                                                  min(oldest, math.nextafter(high, math.inf)),
+                                                  needed - len(samples) if reverse else needed, reverse)
+            samples = np.concatenate((samples, from_db) if reverse else (from_db, samples))
+        samples = samples[:needed]
+
+        continuation = None
+        if len(samples) > self.max_history_data_response_size:
+            continuation = datetime.fromtimestamp(samples[-1, 0], timezone.utc)
+            samples = samples[:-1]
+        cast = _NUMERIC_TYPES[buffer.vtype] if buffer.vtype is not None else float
+        result = []
+        for timestamp, value in samples.tolist():
+            date = datetime.fromtimestamp(timestamp, timezone.utc)
+            result.append(ua.DataValue(ua.Variant(cast(value), buffer.vtype), SourceTimestamp=date,
+                                       ServerTimestamp=date))
+        return result, continuation
+
+    async def new_historized_event(self, source_id, evtypes, period, count=0):
+        """
+        The events are not historized: nothing to prepare
+        """
+
+    async def save_event(self, event):
+        pass
+
+    async def read_event_history(self, source_id, start, end, nb_values, evfilter):
+        return [], None
+
+    async def stop(self):
+        """
+        Move all the samples in memory to the database, so they are read after a restart
+        """
+        if self._db is None:
+            return
+        for node_id, buffer in self.buffers.items():
+            if buffer.size:
+                await self._spill(node_id, buffer.pop_oldest(buffer.size))
+        async with self._db_lock:
+            self._db.close()
+        self._db = None
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        :return: the bytes allocated for every historized node (fixed when the node is historized)
+        """
+        return {node_id.to_string(): buffer.nbytes for node_id, buffer in self.buffers.items()}
+
+    def report(self) -> str:
+        """
+        :return: the memory used by the history, for the startup log
+        """
+        usage = self.memory_usage()
+        spill = f", older samples in {self.db_path}" if self.db_path is not None else ""
+        return f"History: {len(usage)} nodes x {self.capacity} samples ({self.capacity * HISTORY_ITEM_SIZE / 1024:.0f} " \
+               f"kB per node, {sum(usage.values()) / 1024:.0f} kB){spill}"
+
+
+async def enable_history(server: Server, nodes: list[Node], capacity=HISTORY_SIZE,
+                         db_path: Optional[Path] = None) -> RingBufferHistory:
+    """
+    Replace the history storage of the server with a RingBufferHistory and historize the nodes (the Historizing
+    attribute and the HistoryRead access level are set, the values are stored on every change)
+    :param server: initialized server
+    :param nodes: variables to historize
+    :param capacity: samples kept in memory for every node
+    :param db_path: SQLite database of the older samples, None to keep only the ring buffers
+    :return: the storage
+    """
+    storage = RingBufferHistory(capacity, db_path)
+    await storage.init()
+    server.iserver.history_manager.set_storage(storage)
+    for node in nodes:
+        await server.historize_node_data_change(node, period=None, count=capacity)
+    return storage
+
+
+if __name__ == '__main__':
+    # one hour of a 20 Hz variable, then a client reads a one minute window with one HistoryRead and polls the same
+    # number of values one read at a time
+    import asyncio
+    import tempfile
+    import time
+    from asyncua import Client
+    from components.opcua_nodes import NodeBatch, init_server, get_cache_dir
+
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+    ENDPOINT = "opc.tcp://127.0.0.1:4850/history_bench/"
+    RATE = 20.0  # samples per second
+    WINDOW = 60.0  # [s]
+
+    async def bench(db_path: Optional[Path]):
+        server = Server()
+        await init_server(server, get_cache_dir())
+        server.set_endpoint(ENDPOINT)
+        idx = await server.register_namespace("http://bench_history")
+        nodes = NodeBatch(server, idx)
+        variable = nodes.add_variable(server.nodes.objects, "Variable", .0)
+        await nodes.commit()
+        storage = await enable_history(server, [variable], HISTORY_SIZE, db_path)
+
+        n = int(3600 * RATE)
+        await asyncio.sleep(0.1)  # the initial value of the subscription is stored first, the samples come after it
+        t0 = time.time()
+        t = time.perf_counter()
+        for i in range(n):
+            date = datetime.fromtimestamp(t0 + i / RATE, timezone.utc)
+            await storage.save_node_value(variable.nodeid, ua.DataValue(ua.Variant(float(i), ua.VariantType.Double),
+                                                                        SourceTimestamp=date))
+        print(f"{'SQLite' if db_path else 'memory only'}: {n} samples saved in {time.perf_counter() - t:.2f} s "
+              f"({storage.spilled} spilled). {storage.report()}")
+
+        async with server, Client(ENDPOINT) as client:
+            node = client.get_node(variable.nodeid)
+            for age in (10.0, 3000.0):  # a window in the ring buffer, a window on disk (if any)
+                start = datetime.fromtimestamp(t0 + n / RATE - age - WINDOW, timezone.utc)
+                end = datetime.fromtimestamp(t0 + n / RATE - age, timezone.utc)
+                t = time.perf_counter()
+                values = await node.read_raw_history(start, end)
+                print(f"  HistoryRead of a window {age:.0f} s ago: {len(values)} values in "
+                      f"{(time.perf_counter() - t) * 1000:.1f} ms")
+            t = time.perf_counter()
+            for _ in range(int(WINDOW * RATE)):
+                await node.read_value()
+            print(f"  {int(WINDOW * RATE)} polled reads: {(time.perf_counter() - t) * 1000:.1f} ms")
+
+    async def main():
+        await bench(None)
+        with tempfile.TemporaryDirectory() as tmp:
+            await bench(Path(tmp) / "history.sqlite")
+
+    asyncio.run(main())
@@ -0,0 +1,284 @@
+"""
+Fast startup of the OPC-UA servers.
+
+Most of the startup time of an asyncua server is spent building the standard address space (about 6000 nodes).
+init_server loads it from a shelf saved in OPC_UA_CACHE_DIR by the first start (the nodes are then read lazily), so the
+following starts skip it. NodeBatch collects the nodes of a simulator and adds them with one add_nodes call instead of
+one await (and one or two services calls) per node.
+
+Build the cache in advance (e.g. in a container image) and compare the startup times:
+
+    python -m components.opcua_nodes
+"""
+from typing import Optional, Callable, Any
+from pathlib import Path
+import os
+import shutil
+from asyncua import Server, ua, __version__ as asyncua_version
+from asyncua.common.node import Node
+
+# directory of the standard address space cache, empty string to disable the cache
+OPC_UA_CACHE_DIR = os.getenv("OPC_UA_CACHE_DIR", str(Path.home() / ".cache" / "mqtt_opc_ua_sim"))
+
+
+def get_cache_dir() -> Optional[Path]:
+    """
+    :return: the cache directory, None if the cache is disabled
+    """
+    return Path(OPC_UA_CACHE_DIR) if OPC_UA_CACHE_DIR else None
+
+
+def get_shelf_path(cache_dir: Path) -> Path:
+    """
+    :param cache_dir: cache directory
+    :return: path of the shelf, the name depends on the asyncua version (no dots, asyncua changes the suffix)
+    """
+    return cache_dir / f"opcua_aspace_{asyncua_version.replace('.', '_')}"
+
+
+def _publish_shelf(build_path: Path, path: Path):
+    """
+    Move a shelf built in a private directory to its final path. The file named as the shelf is moved last (it is the
+    one asyncua checks), so a starting server never finds a half published shelf.
+    With the dumb dbm (no file named as the shelf) an empty file is created to mark the shelf as complete.
+    """
+    files = sorted(build_path.parent.glob(f"{build_path.name}*"), key=lambda f: f.name in (build_path.name,
+                                                                                          f"{build_path.name}.db"))
+    for file in files:
+        file.replace(path.with_name(path.name + file.name[len(build_path.name):]))
+    if not path.is_file() and not path.with_suffix(".db").is_file():
+        marker = build_path.with_suffix(".marker")
+        marker.touch()
+        marker.replace(path)
+
+
+async def init_server(server: Server, cache_dir: Optional[Path] = None) -> bool:
+    """
+    Initialize the server loading the standard address space from the cache. If the cache is missing, the address
+    space is built as usual and saved in the cache for the next start
+    :param server: server to initialize
+    :param cache_dir: cache directory (see get_cache_dir), None to disable the cache
+    :return: True if the address space has been loaded from the cache
+    """
+    if cache_dir is None:
+        await server.init()
+        return False
+
+    path = get_shelf_path(cache_dir)
+    if path.is_file() or path.with_suffix(".db").is_file():
+        await server.init(path)
+        return True
+
+    # built in a private directory: simulators started together do not write the same files
+    build_dir = cache_dir / f".build_{os.getpid()}"
+    try:
+        build_dir.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        print(f"OPC-UA cache disabled ({e})", end="\t")
+        await server.init()
+        return False
+    try:
+        build_path = build_dir / path.name
+        await server.init(build_path)
+        _publish_shelf(build_path, path)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return False
+
+
+def _argument(vtype: ua.VariantType) -> ua.Argument:
+    argument = ua.Argument()
+    argument.DataType = ua.NodeId(vtype.value)
+    return argument
+
+
+class NodeBatch:
+    """
+    Nodes to add to a server with a single add_nodes call. The add_* methods return the node immediately (the node
+    id is assigned by the batch), the node exists on the server after commit.
+    The node ids are numeric in the namespace of the batch, as the ids generated by add_object(idx, name)
+    """
+
+    def __init__(self, server: Server, idx: int, browse_idx=0):
+        """
+        :param server: initialized server
+        :param idx: namespace index of the node ids
+        :param browse_idx: namespace index of the browse names (add_object(idx, name) uses idx, the CNC passes
+        ua.NodeId(0, idx) that gives browse names in namespace 0)
+        """
+        self.server = server
+        self.idx = idx
+        self.browse_idx = browse_idx
+        self._items: list[ua.AddNodesItem] = []
+        self._references: list[ua.AddReferencesItem] = []
+        self._callbacks: list[tuple[ua.NodeId, Callable]] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _add_item(self, parent: Node, name: str, node_class: ua.NodeClass, reference_type: int,
+                  attributes, type_definition: Optional[int] = None) -> Node:
+        nodeid = self.server.iserver.aspace.generate_nodeid(self.idx)
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = nodeid
+        item.BrowseName = ua.QualifiedName(name, self.browse_idx)
+        item.NodeClass = node_class
+        item.ParentNodeId = parent.nodeid
+        item.ReferenceTypeId = ua.NodeId(reference_type)
+        if type_definition is not None:
+            item.TypeDefinition = ua.NodeId(type_definition)
+        attributes.Description = ua.LocalizedText(name)
+        attributes.DisplayName = ua.LocalizedText(name)
+        attributes.WriteMask = 0
+        attributes.UserWriteMask = 0
+        item.NodeAttributes = attributes
+        self._items.append(item)
+        return self.server.get_node(nodeid)
+
+    def add_object(self, parent: Node, name: str) -> Node:
+        """
+        :param parent: parent node (the objects folder or an object of the batch)
+        :param name: browse name
+        """
+        attributes = ua.ObjectAttributes()
+        attributes.EventNotifier = 0
+        reference_type = ua.ObjectIds.Organizes if parent.nodeid == ua.NodeId(ua.ObjectIds.ObjectsFolder) \
+            else ua.ObjectIds.HasComponent
+        return self._add_item(parent, name, ua.NodeClass.Object, reference_type, attributes,
+                              ua.ObjectIds.BaseObjectType)
+
+    def add_variable(self, parent: Node, name: str, value: Any, writable=False,
+                     varianttype: Optional[ua.VariantType] = None, datatype: Optional[int] = None,
+                     is_property=False) -> Node:
+        """
+        :param parent: parent node
+        :param name: browse name
+        :param value: starting value
+        :param writable: the clients can write the value
+        :param varianttype: variant type (guessed from the value if None)
+        :param datatype: data type (guessed from the variant if None)
+        :param is_property: add a property instead of a variable
+        """
+        variant = ua.Variant(value, varianttype)
+        attributes = ua.VariableAttributes()
+        attributes.DataType = ua.NodeId(datatype if datatype is not None
+                                        else getattr(ua.ObjectIds, variant.VariantType.name))
+        attributes.Value = variant
+        if not isinstance(value, (list, tuple)):
+            attributes.ValueRank = ua.ValueRank.Scalar
+            attributes.ArrayDimensions = None
+        elif variant.Dimensions:
+            attributes.ValueRank = len(variant.Dimensions)
+            attributes.ArrayDimensions = variant.Dimensions
+        attributes.Historizing = False
+        access_level = ua.AccessLevel.CurrentRead.mask
+        if writable:
+            access_level |= ua.AccessLevel.CurrentWrite.mask
+        attributes.AccessLevel = access_level
+        attributes.UserAccessLevel = access_level
+        if is_property:
+            return self._add_item(parent, name, ua.NodeClass.Variable, ua.ObjectIds.HasProperty, attributes,
+                                  ua.ObjectIds.PropertyType)
+        return self._add_item(parent, name, ua.NodeClass.Variable, ua.ObjectIds.HasComponent, attributes,
+                              ua.ObjectIds.BaseDataVariableType)
+
+    def add_method(self, parent: Node, name: str, callback: Callable,
+                   inputs: Optional[list[ua.VariantType]] = None,
+                   outputs: Optional[list[ua.VariantType]] = None) -> Node:
+        """
+        :param parent: parent node
+        :param name: browse name
+        :param callback: method called by the clients (decorated with uamethod)
+        :param inputs: types of the input arguments
+        :param outputs: types of the output arguments
+        """
+        attributes = ua.MethodAttributes()
+        attributes.Executable = True
+        attributes.UserExecutable = True
+        method = self._add_item(parent, name, ua.NodeClass.Method, ua.ObjectIds.HasComponent, attributes)
+        for arguments_name, vtypes in (("InputArguments", inputs), ("OutputArguments", outputs)):
+            if vtypes:
+                arguments = self.add_variable(method, arguments_name, [_argument(vtype) for vtype in vtypes],
+                                              varianttype=ua.VariantType.ExtensionObject,
+                                              datatype=ua.ObjectIds.Argument, is_property=True)
+                self._items[-1].BrowseName = ua.QualifiedName(arguments_name, 0)  # standard name, always in ns 0
+                reference = ua.AddReferencesItem()
+                reference.SourceNodeId = arguments.nodeid
+                reference.TargetNodeId = ua.NodeId(ua.ObjectIds.ModellingRule_Mandatory)
+                reference.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasModellingRule)
+                reference.IsForward = True
+                reference.TargetNodeClass = ua.NodeClass.Object
+                self._references.append(reference)
+        self._callbacks.append((method.nodeid, callback))
+        return method
+
+    async def commit(self):
+        """
+        Add the collected nodes to the server
+        """
+        session = self.server.iserver.isession
+        for result in await session.add_nodes(self._items):
+            result.StatusCode.check()
+        if self._references:
+            for status in await session.add_references(self._references):
+                status.check()
+        for nodeid, callback in self._callbacks:
+            session.add_method_callback(nodeid, callback)
+        self._items = []
+        self._references = []
+        self._callbacks = []
+
+
+if __name__ == '__main__':
+    # build the cache, then compare the startup with and without it and the node creation one by one and batched
+    import asyncio
+    import time
+    import logging
+
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+    N_OBJECTS = 10
+    N_VARIABLES = 10
+
+    async def start(cache_dir: Optional[Path]) -> float:
+        t0 = time.perf_counter()
+        await init_server(Server(), cache_dir)
+        return time.perf_counter() - t0
+
+    async def add_nodes(batched: bool) -> float:
+        server = Server()
+        await init_server(server, get_cache_dir())
+        idx = ua.NodeId(0, await server.register_namespace("http://bench"))
+        t0 = time.perf_counter()
+        if batched:
+            batch = NodeBatch(server, idx.NamespaceIndex)
+            for i in range(N_OBJECTS):
+                obj = batch.add_object(server.nodes.objects, f"Object {i}")
+                for j in range(N_VARIABLES):
+                    batch.add_variable(obj, f"Variable {j}", .0, writable=True)
+            await batch.commit()
+        else:
+            for i in range(N_OBJECTS):
+                obj = await server.nodes.objects.add_object(idx, f"Object {i}")
+                for j in range(N_VARIABLES):
+                    var = await obj.add_variable(idx, f"Variable {j}", .0)
+                    await var.set_writable()
+        return time.perf_counter() - t0
+
+    async def bench():
+        cache_dir = get_cache_dir()
+        if cache_dir is None:
+            print("OPC_UA_CACHE_DIR is empty, the cache is disabled")
+            return
+        built = get_shelf_path(cache_dir).is_file()
+        first = await start(cache_dir)
+        print(f"cache: {get_shelf_path(cache_dir)} ({'found' if built else f'built in {first:.3f} s'})")
+        print(f"init without cache: {await start(None):.3f} s")
+        print(f"init with cache:    {await start(cache_dir):.3f} s")
+        n_nodes = N_OBJECTS * (N_VARIABLES + 1)
+        # best of 3, the first servers of the process also pay the lazy loading of the standard nodes
+        one_by_one = min([await add_nodes(False) for _ in range(3)])
+        batched = min([await add_nodes(True) for _ in range(3)])
+        print(f"{n_nodes} nodes one by one: {one_by_one * 1000:.1f} ms")
+        print(f"{n_nodes} nodes batched:    {batched * 1000:.1f} ms")
+
+    asyncio.run(bench())
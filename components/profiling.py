@@ -0,0 +1,253 @@
+"""
+Runtime profiling of the simulators, started and stopped while they run (OPC-UA method, REST endpoint or SIGUSR1):
+- timing spans of the subsystems of a tick (physics step, OPC-UA and MQTT updates, drawing...), recorded only while a
+  profiling session runs: with the profiler stopped a span is a shared no-op context manager
+- a sampling profiler of the event loop thread, writing the stacks in the collapsed format of the flamegraph tools
+  (one "root;...;leaf count" line per stack, the innermost running span as root frame):
+
+    flamegraph.pl profiles/cnc_20240101_120000.collapsed > cnc.svg
+
+Overhead of the spans with the profiler stopped and running:
+
+    python -m components.profiling
+"""
+from typing import Optional
+from collections import Counter
+from pathlib import Path
+import os
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.getenv("SIM_PROFILE_DIR", "profiles")  # directory of the collapsed stack files
+PROFILE_INTERVAL = 0.005  # sampling period of the stacks [s]
+PROFILE_DURATION = 10.0  # default duration of a profiling session [s]
+PROFILE_MAX_DURATION = 600.0  # a forgotten session is stopped anyway [s]
+
+
+class _NullSpan:
+    """
+    Span of a stopped profiler, nothing is recorded
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class SpanStats:
+    """
+    Wall time of the calls of a span
+    """
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = .0
+        self.max = .0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else .0,
+            "max_ms": self.max * 1000,
+        }
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = .0
+
+    def __enter__(self):
+        self.profiler.active.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        profiler = self.profiler
+        stats = profiler.spans.get(self.name)
+        if stats is None:
+            stats = profiler.spans[self.name] = SpanStats()
+        stats.add(duration)
+        active = profiler.active
+        for i in range(len(active) - 1, -1, -1):  # the spans of concurrent tasks may end out of order
+            if active[i] == self.name:
+                del active[i]
+                break
+        return False
+
+
+class Profiler:
+    """
+    Timing spans and sampling profiler of the thread running the event loop of a simulator, the thread that creates
+    the profiler (the sessions can be started from any thread, e.g. by the OPC-UA methods run in an executor).
+    Use it as:
+
+        with profiler.span("physics"):
+            machine.run(t)
+    """
+
+    def __init__(self, name: str, output_dir=PROFILE_DIR, interval=PROFILE_INTERVAL):
+        """
+        :param name: prefix of the collapsed stack files
+        :param output_dir: directory of the collapsed stack files (created at the first session)
+        :param interval: sampling period of the stacks [s]
+        """
+        self.name = name
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.enabled = False
+        self.active: list[str] = []  # spans running now, the last one is the root frame of the samples
+        self.spans: dict[str, SpanStats] = {}
+        self.path: Optional[Path] = None  # collapsed stacks of the running or of the last session
+        self.started: Optional[float] = None
+        self.duration = .0
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def span(self, name: str):
+        """
+        :param name: name of the subsystem
+        :return: context manager timing its block while a session runs
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=PROFILE_DURATION) -> Path:
+        """
+        Start a profiling session, the stacks are written when it ends
+        :param duration: length of the session [s], at most PROFILE_MAX_DURATION
+        :return: the collapsed stack file
+        """
+        if self.is_running():
+            raise RuntimeError(f"Profiling already running ({self.path})")
+        if not duration > 0:
+            raise ValueError(f"Invalid profiling duration: {duration}")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.output_dir / f"{self.name}_{time.strftime('%Y%m%d_%H%M%S')}.collapsed"
+        self.duration = min(duration, PROFILE_MAX_DURATION)
+        self.started = time.time()
+        self.samples = 0
+        self.spans = {}
+        self.active.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(self.thread_id, self.duration),
+                                        name=f"{self.name}-profiler", daemon=True)
+        self.enabled = True
+        self._thread.start()
+        return self.path
+
+    def stop(self) -> bool:
+        """
+        Stop the running session and wait for its stacks to be written
+        :return: False if no session was running
+        """
+        if not self.is_running():
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def toggle(self, duration=PROFILE_DURATION):
+        """
+        Start a session, or stop the running one (for a signal handler)
+        :param duration: length of the session [s]
+        """
+        if self.stop():
+            print(f"\nProfiling stopped: {self.path}")
+        else:
+            print(f"\nProfiling started for {duration:.0f} s: {self.start(duration)}")
+
+    def _sample(self, thread_id: int, duration: float):
+        stacks = Counter()
+        labels = {}
+        deadline = time.monotonic() + duration
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is None:  # the profiled thread has ended
+                    break
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                        label = labels[code] = label.replace(";", ":")  # the count follows the last space
+                    stack.append(label)
+                    frame = frame.f_back
+                active = self.active[-1:]  # copied at once, the loop thread keeps running
+                if active:
+                    stack.append(f"[{active[0]}]")
+                stacks[";".join(reversed(stack))] += 1
+        finally:
+            self.enabled = False
+            self.samples = sum(stacks.values())
+            with self.path.open("w") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+
+    def report(self) -> dict:
+        """
+        :return: state of the profiler and timings of the spans of the running or of the last session
+        """
+        return {
+            "running": self.is_running(),
+            "path": str(self.path) if self.path is not None else None,
+            "started": self.started,
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.samples,
+            "spans": {name: stats.to_dict() for name, stats in sorted(self.spans.items())},
+        }
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    N = 1_000_000
+
+    def bench(profiler: Optional[Profiler]) -> float:
+        start = time.perf_counter()
+        if profiler is None:
+            for _ in range(N):
+                pass
+        else:
+            for _ in range(N):
+                with profiler.span("physics"):
+                    pass
+        return (time.perf_counter() - start) / N
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prof = Profiler("bench", tmp)
+        empty = bench(None)
+        print(f"span, profiler stopped: {(bench(prof) - empty) * 1e9:6.0f} ns")
+        prof.start(60)
+        print(f"span, profiler running: {(bench(prof) - empty) * 1e9:6.0f} ns")
+        prof.stop()
+        print(f"{prof.samples} samples, {prof.path.stat().st_size} bytes of collapsed stacks")
+        print(prof.report()["spans"])
@@ -0,0 +1,165 @@
+from typing import Optional
+import numpy as np
+from .general import PIRegulator
+
+
+def _as_array(value, n: int, default: float) -> np.ndarray:
+    """
+    :param value: scalar, sequence of n values or None
+    :param n: number of regulators
+    :param default: value used for None (and for the None items of a sequence)
+    :return: float array of n values
+    """
+    if value is None:
+        return np.full(n, default)
+    if np.isscalar(value):
+        return np.full(n, float(value))
+    return np.array([default if v is None else v for v in value], dtype=float)
+
+
+class PIRegulatorBank:
+    """
+    N PIRegulator evaluated together on NumPy arrays (same equations of PIRegulator, for fleet-scale thermal
+    simulations). Every parameter can be a scalar shared by all the regulators or a sequence of N values, None
+    disables a limit.
+    """
+
+    def __init__(self, n: int, kd, ki, set_point, max_out=None, min_out=None, wind_up=None, k_back=None, k_der=.0):
+        """
+        :param n: number of regulators
+        :param kd: proportional gains
+        :param ki: integral gains
+        :param set_point: starting set points
+        :param max_out: max output values
+        :param min_out: min output values
+        :param wind_up: anti wind up values (limit of the absolute value of the integral error)
+        :param k_back: back-calculation anti wind up gains
+        :param k_der: derivative gains (derivative on the measurement)
+        """
+        self.n = n
+        self.kd = _as_array(kd, n, .0)
+        self.ki = _as_array(ki, n, .0)
+        self.set_point = _as_array(set_point, n, .0)
+        self.max_out = _as_array(max_out, n, np.inf)
+        self.min_out = _as_array(min_out, n, -np.inf)
+        self.wind_up = _as_array(wind_up, n, np.inf)
+        self.k_back = _as_array(k_back, n, .0)
+        self.k_der = _as_array(k_der, n, .0)
+        self._ie = np.zeros(n)
+        self._old_e = np.zeros(n)
+        self._old_input = np.zeros(n)
+        self._old_t: Optional[float] = None
+        self._saturation = np.zeros(n)
+        self._back_gain = np.zeros(n)
+        self._update_back_gain()
+
+    @classmethod
+    def from_regulators(cls, regulators: list[PIRegulator]) -> "PIRegulatorBank":
+        """
+        :param regulators: regulators to evaluate together (their parameters are copied, not their state)
+        """
+        return cls(len(regulators),
+                   [r.kd for r in regulators],
+                   [r.ki for r in regulators],
+                   [r.set_point for r in regulators],
+                   [r.max_out for r in regulators],
+                   [r.min_out for r in regulators],
+                   [r.wind_up for r in regulators],
+                   [r.k_back for r in regulators],
+                   [r.k_der for r in regulators])
+
+    def _update_back_gain(self):
+        """
+        Precompute k_back / ki (0 where ki is 0), it must be called after changing ki or k_back
+        """
+        self._back_gain = np.divide(self.k_back, self.ki, out=np.zeros(self.n), where=self.ki != 0)
+
+    def set_gains(self, kd=None, ki=None, k_back=None):
+        """
+        :param kd: new proportional gains (unchanged if None)
+        :param ki: new integral gains (unchanged if None)
+        :param k_back: new back-calculation anti wind up gains (unchanged if None)
+        """
+        if kd is not None:
+            self.kd = _as_array(kd, self.n, .0)
+        if ki is not None:
+            self.ki = _as_array(ki, self.n, .0)
+        if k_back is not None:
+            self.k_back = _as_array(k_back, self.n, .0)
+        self._update_back_gain()
+
+    def run(self, time: float, input_val: np.ndarray) -> np.ndarray:
+        """
+        Main function that compute the new parameters for the simulation, all the regulators share the same time
+        :param time: current time [s]
+        :param input_val: current input values (N)
+        :return: the outputs (N)
+        """
+        e = self.set_point - input_val
+
+        if self._old_t is None:
+            dt = .0
+            d_input = np.zeros(self.n)
+        else:
+            dt = time - self._old_t
+            d_input = (input_val - self._old_input) / dt if dt > 0 else np.zeros(self.n)
+
+        ie = self._ie
+        ie += (self._old_e + e) * (dt / 2)
+        ie += self._back_gain * self._saturation * dt
+        np.clip(ie, -self.wind_up, self.wind_up, out=ie)
+
+        self._old_e = e
+        self._old_input = np.array(input_val, dtype=float)
+        self._old_t = time
+
+        out = self.kd * e + self.ki * ie - self.k_der * d_input
+        saturated = np.minimum(np.maximum(out, self.min_out), self.max_out)
+        self._saturation = saturated - out
+        return saturated
+
+    def reset(self):
+        self._ie[:] = .0
+        self._old_e[:] = .0
+        self._old_input[:] = .0
+        self._old_t = None
+        self._saturation[:] = .0
+
+
+if __name__ == '__main__':
+    # benchmark: regulator updates per second, scalar PIRegulator against the bank
+    import time
+
+    def bench_scalar(n: int, steps: int) -> float:
+        regulators = [PIRegulator(20, 2, 60, 240, 0, 30, k_back=1.0) for _ in range(n)]
+        temps = [25.0] * n
+        t0 = time.perf_counter()
+        for step in range(1, steps + 1):
+            t = step * 0.05
+            for i, regulator in enumerate(regulators):
+                regulator.run(t, temps[i])
+        return n * steps / (time.perf_counter() - t0)
+
+    def bench_bank(n: int, steps: int) -> float:
+        bank = PIRegulatorBank(n, 20, 2, 60, 240, 0, 30, k_back=1.0)
+        temps = np.full(n, 25.0)
+        t0 = time.perf_counter()
+        for step in range(1, steps + 1):
+            bank.run(step * 0.05, temps)
+        return n * steps / (time.perf_counter() - t0)
+
+    # the bank must give the same outputs of the scalar regulators
+    check_regulators = [PIRegulator(kd, 2, 60, 240, 0, 30, k_back=1.0, k_der=0.5) for kd in (5, 20, 80)]
+    check_bank = PIRegulatorBank.from_regulators(check_regulators)
+    check_temps = np.array([25.0, 40.0, 59.0])
+    for check_step in range(1, 200):
+        check_temps += 0.1
+        scalar_out = [r.run(check_step * 0.05, v) for r, v in zip(check_regulators, check_temps)]
+        bank_out = check_bank.run(check_step * 0.05, check_temps)
+        assert np.allclose(scalar_out, bank_out), (scalar_out, bank_out)
+
+    print("regulators, scalar [updates/s], bank [updates/s]")
+    for n_regulators in (1, 10, 100, 1000, 10000, 100000):
+        n_steps = max(10, 200000 // n_regulators)
+        scalar = bench_scalar(n_regulators, max(1, n_steps // 10)) if n_regulators <= 10000 else float("nan")
+        print(f"{n_regulators}, {scalar:.3g}, {bench_bank(n_regulators, n_steps):.3g}")
@@ -0,0 +1,136 @@
+from enum import IntEnum
+from typing import Optional
+import asyncio
+
+
+class OverrunPolicy(IntEnum):
+    CATCH_UP = 0  # late ticks are run back to back until the schedule is recovered
+    SKIP = 1  # late ticks are dropped, the simulated time jumps forward to follow the wall clock
+
+
+class FixedRateScheduler:
+    """
+    Drift-free fixed rate scheduler for the simulation loops.
+
+    Every tick has an absolute deadline computed from the event loop clock, so the time spent in physics and I/O is
+    not added to the period. The simulated time is always ticks * time_step (plus the time accumulated before the last
+    change of time step).
+    """
+
+    def __init__(self, time_step: float, time_mult=1.0, policy=OverrunPolicy.SKIP, max_catch_up=10):
+        """
+        :param time_step: simulated time advanced by each tick [s]
+        :param time_mult: simulation speed multiplier, the wall clock period is time_step / time_mult
+        :param policy: behaviour when a deadline is missed
+        :param max_catch_up: CATCH_UP policy only, if more ticks than this are late the schedule is moved forward
+        """
+        self.time_step = time_step
+        self.time_mult = time_mult
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+
+        self.ticks = 0
+        self.overruns = 0  # number of missed deadlines
+        self.skipped_ticks = 0  # ticks dropped by the SKIP policy
+        self.resyncs = 0  # schedule moved forward by the CATCH_UP policy
+        self.last_lateness = .0  # [s]
+        self.max_lateness = .0  # [s]
+
+        self._base_time = .0
+        self._base_ticks = 0
+        self._base_deadline: Optional[float] = None
+
+    @property
+    def period(self) -> float:
+        """
+        :return: wall clock period of a tick [s]
+        """
+        return self.time_step / self.time_mult
+
+    @property
+    def time(self) -> float:
+        """
+        :return: current simulated time [s]
+        """
+        return self._base_time + (self.ticks - self._base_ticks) * self.time_step
+
+    def deadline(self, tick: int) -> float:
+        """
+        :param tick: tick number
+        :return: the loop time at which the tick should start
+        """
+        return self._base_deadline + (tick - self._base_ticks) * self.period
+
+    def start(self):
+        """
+        Set the current loop time as the deadline of the current tick
+        """
+        self._base_time = self.time
+        self._base_ticks = self.ticks
+        self._base_deadline = asyncio.get_running_loop().time()
+
+    def set_time_step(self, time_step: float, time_mult: Optional[float] = None):
+        """
+        Change the time step (and optionally the multiplier) without altering the simulated time already elapsed
+        :param time_step: new simulated time step [s]
+        :param time_mult: new simulation speed multiplier (unchanged if None)
+        """
+        if self._base_deadline is not None:
+            self._base_deadline = self.deadline(self.ticks)
+        self._base_time = self.time
+        self._base_ticks = self.ticks
+        self.time_step = time_step
+        if time_mult is not None:
+            self.time_mult = time_mult
+
+    def set_time(self, time: float):
+        """
+        Set the simulated time (e.g. restoring a checkpoint), the schedule is not changed
+        :param time: new simulated time [s]
+        """
+        self._base_time = time
+        self._base_ticks = self.ticks
+
+    async def wait_next(self):
+        """
+        Wait for the deadline of the next tick. If the deadline has already passed, the overrun policy is applied
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._base_deadline is None:
+            self.start()
+
+        self.ticks += 1
+        now = loop.time()
+        lateness = now - self.deadline(self.ticks)
+
+        if lateness <= 0:
+            self.last_lateness = .0
+            await asyncio.sleep(-lateness)
+            return
+
+        self.overruns += 1
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        missed = int(lateness / self.period)
+
+        if self.policy == OverrunPolicy.SKIP:
+            self.ticks += missed
+            self.skipped_ticks += missed
+        elif missed > self.max_catch_up:
+            self._base_time = self.time
+            self._base_ticks = self.ticks
+            self._base_deadline = now
+            self.resyncs += 1
+
+        await asyncio.sleep(0)  # let the other tasks run anyway
+
+    def get_stats_dict(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped_ticks,
+            "resyncs": self.resyncs,
+            "last_lateness": self.last_lateness,
+            "max_lateness": self.max_lateness
+        }
@@ -0,0 +1,48 @@
+"""
+Startup time instrumentation of the simulators, enabled by the environment variable SIM_STARTUP_TIMING=1
+"""
+import os
+import time
+
+STARTUP_TIMING = os.getenv("SIM_STARTUP_TIMING", "0") not in ("", "0")
+
+
+class StartupTimer:
+    """
+    Record the duration of the startup phases. Create it before the heavy imports, then call mark at the end of
+    every phase
+    """
+
+    def __init__(self, enabled=STARTUP_TIMING):
+        """
+        :param enabled: print the phases in report
+        """
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str) -> float:
+        """
+        :param phase: name of the phase that ends now
+        :return: duration of the phase [s]
+        """
+        now = time.perf_counter()
+        duration = now - self.last
+        self.phases.append((phase, duration))
+        self.last = now
+        return duration
+
+    def total(self) -> float:
+        """
+        :return: time from the creation of the timer to the last mark [s]
+        """
+        return self.last - self.start
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("\nStartup times:")
+        for phase, duration in self.phases:
+            print(f"  {phase:<20} {duration * 1000:8.1f} ms")
+        print(f"  {'total':<20} {self.total() * 1000:8.1f} ms")
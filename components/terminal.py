@@ -0,0 +1,65 @@
+"""
+Status line of the simulators on the terminal, redrawn at most SIM_TERMINAL_FPS times per second whatever the tick rate
+"""
+from typing import Optional, TextIO
+import os
+import sys
+import time
+
+TERMINAL_FPS = float(os.getenv("SIM_TERMINAL_FPS", "10"))  # frames per second of the status line, 0 to disable it
+
+
+class LineRenderer:
+    """
+    Single line redrawn in place (carriage return). The line is written only when a frame is due and its text has
+    changed; when the output is not a terminal (redirected to a file or a pipe) nothing is written. Use it as:
+
+        if renderer.due():
+            renderer.render(build_status_line())
+    """
+
+    def __init__(self, max_fps=TERMINAL_FPS, stream: Optional[TextIO] = None):
+        """
+        :param max_fps: maximum number of frames per second, 0 to disable the rendering
+        :param stream: output stream (default sys.stdout)
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.enabled = max_fps > 0 and self.stream.isatty()
+        self.frame_period = 1 / max_fps if max_fps > 0 else .0
+        self.next_frame = .0
+        self.last_line = ""
+        self.frames = 0
+
+    def due(self) -> bool:
+        """
+        :return: True if a frame has to be rendered now (the caller can skip building the line otherwise)
+        """
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if now < self.next_frame:
+            return False
+        self.next_frame = now + self.frame_period
+        return True
+
+    def render(self, line: str):
+        """
+        Replace the line on the terminal
+        :param line: the new text, without line breaks
+        """
+        if not self.enabled or line == self.last_line:
+            return
+        padding = " " * (len(self.last_line) - len(line))  # leftover of a longer line
+        self.stream.write(f"\r{line}{padding}")
+        self.stream.flush()
+        self.last_line = line
+        self.frames += 1
+
+    def close(self):
+        """
+        Move to a new line, so the following output does not overwrite the status line
+        """
+        if self.enabled and self.last_line:
+            self.stream.write("\n")
+            self.stream.flush()
+            self.last_line = ""
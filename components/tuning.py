@@ -0,0 +1,228 @@
+from typing import Optional
+import copy
+import math
+from .thermal import HeatingBody
+
+TUNING_TIME_STEP = 0.05  # [s]
+TUNING_MAX_TIME = 1800.  # [s], a step response that does not settle in this time is considered unstable
+
+
+class RelayRegulator:
+    """
+    On-off controller with hysteresis, it has the same interface of PIRegulator so it can replace the control of a
+    HeatingBody during the relay feedback test
+    """
+
+    def __init__(self, set_point: float, high: float, low=.0, hysteresis=0.5):
+        """
+        :param set_point: starting set point
+        :param high: output when the input is below the set point
+        :param low: output when the input is above the set point
+        :param hysteresis: half width of the dead band around the set point
+        """
+        self.set_point = set_point
+        self.high = high
+        self.low = low
+        self.hysteresis = hysteresis
+        self.out = high
+
+    def run(self, time: float, input_val: float) -> float:
+        if input_val < self.set_point - self.hysteresis:
+            self.out = self.high
+        elif input_val > self.set_point + self.hysteresis:
+            self.out = self.low
+        return self.out
+
+    def reset(self):
+        self.out = self.high
+
+
+class StepResponse:
+    """
+    Result of a set point step simulation
+    """
+
+    def __init__(self, settle_time: float, overshoot: float):
+        """
+        :param settle_time: time waited by the blocking command until the temp_reached flag is set, inf if never [s]
+        :param overshoot: max temperature above the set point [°C]
+        """
+        self.settle_time = settle_time
+        self.overshoot = overshoot
+
+    def settled(self) -> bool:
+        return math.isfinite(self.settle_time)
+
+
+class PITuner:
+    """
+    Offline tuning of the PI gains of a HeatingBody. The thermal model is simulated headless, the starting point is
+    computed with a relay feedback test (Ziegler-Nichols rules), then a pattern search minimizes the settle time of the
+    set point steps keeping the overshoot below the limit.
+
+    A step is a set point change from the environment temperature at a given simulation time (the heater has been idle
+    until then) followed, after a delay, by a command that waits for the temperature (M104 then M109 after homing, or
+    M190 alone with no delay).
+    """
+
+    def __init__(self, body: HeatingBody, steps: list[tuple[float, float, float]], max_overshoot=1.0,
+                 time_step=TUNING_TIME_STEP, max_time=TUNING_MAX_TIME):
+        """
+        :param body: the heater to tune (used as a template, never modified)
+        :param steps: (set point [°C], time of the set point change [s], delay of the blocking command [s]) of the
+        steps to optimize
+        :param max_overshoot: max temperature above the set point [°C]
+        :param time_step: simulation time step [s]
+        :param max_time: max simulated time of a step [s]
+        """
+        self.body = body
+        self.steps = steps
+        self.max_overshoot = max_overshoot
+        self.time_step = time_step
+        self.max_time = max_time
+        self.evaluations = 0
+
+    def _new_body(self) -> HeatingBody:
+        return copy.deepcopy(self.body)
+
+    def step_response(self, kp: float, ki: float, wind_up: Optional[float], set_point: float, start_time=.0,
+                      delay=.0) -> StepResponse:
+        """
+        Simulate a step of the set point from the environment temperature
+        :param kp: proportional gain
+        :param ki: integral gain
+        :param wind_up: anti wind up value
+        :param set_point: set point [°C]
+        :param start_time: simulation time of the set point change [s]
+        :param delay: time between the set point change and the blocking command [s]
+        """
+        self.evaluations += 1
+        body = self._new_body()
+        body.control.kd = kp
+        body.control.ki = ki
+        body.control.wind_up = wind_up
+        body.control.reset()
+        body.run(start_time)  # idle until the set point change
+        body.set_set_point_temp(set_point)
+
+        settle_time = math.inf
+        max_temp = body.current_temp
+        t = start_time
+        delay += start_time
+        end_time = start_time + self.max_time
+        while t < end_time:
+            t += self.time_step
+            body.run(t)
+            max_temp = max(max_temp, body.current_temp)
+            if delay and t - self.time_step < delay <= t:
+                body.set_set_point_temp(set_point)  # the blocking command sets the set point again
+            if t >= delay and body.temp_reached and not math.isfinite(settle_time):
+                settle_time = t - delay
+                end_time = min(t + (t - start_time) + 10 * self.time_step, end_time)  # keep going to see the overshoot
+
+        return StepResponse(settle_time, max_temp - set_point)
+
+    def cost(self, kp: float, ki: float, wind_up: Optional[float]) -> tuple[float, float]:
+        """
+        :return: (overshoot beyond the limit, total settle time), compared as tuples so the feasible gains always win
+        """
+        violation = .0
+        total_time = .0
+        for set_point, start_time, delay in self.steps:
+            response = self.step_response(kp, ki, wind_up, set_point, start_time, delay)
+            violation += max(response.overshoot - self.max_overshoot, .0)
+            total_time += response.settle_time
+        return violation, total_time
+
+    def relay_feedback(self, set_point: float, cycles=4) -> Optional[tuple[float, float]]:
+        """
+        Relay feedback test (Astrom-Hagglund): the heater is driven on-off around the set point and the ultimate gain
+        and period are measured from the resulting oscillation
+        :param set_point: set point of the test [°C]
+        :param cycles: number of oscillations measured (after the first one)
+        :return: (ultimate gain, ultimate period [s]), None if the system does not oscillate
+        """
+        body = self._new_body()
+        body.control = RelayRegulator(set_point, body.h_power)
+        body.set_set_point_temp(set_point)
+
+        switch_off_times = []
+        peaks = []  # max temperature of every off half cycle
+        troughs = []  # min temperature of every on half cycle (the heat up from the environment excluded)
+        out = body.control.out
+        extreme = body.current_temp
+        t = .0
+        while t < self.max_time and (len(peaks) < cycles + 1 or len(troughs) < cycles):
+            t += self.time_step
+            body.run(t)
+            if body.control.out != out:
+                out = body.control.out
+                if out == body.control.low:  # switched off, the on half cycle is over
+                    if switch_off_times:
+                        troughs.append(extreme)
+                    switch_off_times.append(t)
+                else:  # switched on, the off half cycle is over
+                    peaks.append(extreme)
+                extreme = body.current_temp
+            elif out == body.control.low:
+                extreme = max(extreme, body.current_temp)
+            else:
+                extreme = min(extreme, body.current_temp)
+
+        if len(peaks) < cycles + 1 or len(troughs) < cycles:
+            return None
+
+        amplitude = (sum(peaks[1:cycles + 1]) - sum(troughs[:cycles])) / cycles / 2  # the first peak is the overshoot
+        period = (switch_off_times[cycles] - switch_off_times[0]) / cycles
+        if amplitude <= 0:
+            return None
+        relay_amplitude = (body.control.high - body.control.low) / 2
+        return 4 * relay_amplitude / (math.pi * amplitude), period
+
+    def initial_gains(self) -> tuple[float, float, Optional[float]]:
+        """
+        :return: (kp, ki, wind_up) from the relay feedback test (Ziegler-Nichols PI rules), the current gains of the
+        heater if the test fails
+        """
+        control = self.body.control
+        result = self.relay_feedback(max(step[0] for step in self.steps))
+        if result is None:
+            return control.kd, control.ki, control.wind_up
+        ku, tu = result
+        kp = 0.45 * ku
+        ki = kp / (tu / 1.2)
+        wind_up = self.body.h_power / ki
+        return kp, ki, wind_up
+
+    def tune(self, max_evaluations=300, min_step=1.05) -> tuple[float, float, float]:
+        """
+        Pattern search on the logarithm of kp, ki and wind_up, starting from the best between the current gains and
+        the relay feedback estimation
+        :param max_evaluations: max number of cost evaluations
+        :param min_step: the search stops when the step factor is below this value
+        :return: the best (kp, ki, wind_up)
+        """
+        self.evaluations = 0
+        control = self.body.control
+        current = (control.kd, control.ki, control.wind_up if control.wind_up is not None else self.body.h_power)
+        candidates = [current, self.initial_gains()]
+        candidates = [tuple(v if v is not None else self.body.h_power for v in c) for c in candidates]
+        scored = [(self.cost(*c), c) for c in candidates]
+        best_cost, best = min(scored)
+
+        step = 2.0
+        while step >= min_step and self.evaluations < max_evaluations:
+            improved = False
+            for i in range(len(best)):
+                for factor in (step, 1 / step):
+                    trial = list(best)
+                    trial[i] *= factor
+                    trial = tuple(trial)
+                    trial_cost = self.cost(*trial)
+                    if trial_cost < best_cost:
+                        best_cost, best = trial_cost, trial
+                        improved = True
+            if not improved:
+                step = math.sqrt(step)
+
+        return best
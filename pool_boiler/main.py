@@ -1,9 +1,25 @@
+from components.startup import StartupTimer
+timer = StartupTimer()  # created before the other imports, so they are timed too
+
 import asyncio
-from .pool_boiler_engine import Engine, PotUI
+import os
+import signal
+from .pool_boiler_engine import Engine
+
+DRAW_ON_TERMINAL = os.getenv("POOL_BOILER_UI", "1") != "0"  # rich is not imported when disabled
 
 
 async def main():
-    engine = Engine(PotUI())
+    timer.mark("imports")
+    ui_table = None
+    if DRAW_ON_TERMINAL:
+        from .pot_ui import PotUI
+        ui_table = PotUI()
+        timer.mark("terminal ui")
+    engine = Engine(ui_table)
+    timer.mark("engine")
+    timer.report()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, engine.profiler.toggle)
     await engine.run()
 
 
@@ -1,8 +1,10 @@
 import math
 import time
+from components.thermal import HeatLoss
+from components.checkpoint import Checkpointable
 
 
-class BoilingPot:
+class BoilingPot(Checkpointable):
     RHO_STEEL = 7850  # kg/m^3
     RHO_WAT = 1000  # kg/m^3
     BOILING_T = 100
@@ -13,36 +15,99 @@ class BoilingPot:
     T_LIMIT = 120
 
     def __init__(self, d=0.300, s=0.005, h=0.5, T_env=25.0, k_heat=20):
-        self.A = d ** 2 * math.pi / 4
-        self.steal_v = math.pi / 4 * ((d + 2 * s) ** 2 * (s + h) - d ** 2 * h)
-        self.steel_m = self.steal_v * self.RHO_STEEL
         self.wat_v = 0.
         self.wat_h = 0.
         self.wat_m = 0.
-        self.T_env = T_env
+        self.heat_loss = HeatLoss(T_env, k_heat)
         self.T = T_env
-        self._max_surf = math.pi * ((d + 2 * s) * (s + h) + (d + 2 * s) ** 2 / 4 + d * h)
-        self.D_in = d
-        self.h_max = h
+        self.set_geometry(d, s, h)
         self._old_t = .0
         self._old_power = .0
         self._old_flow = .0
-        self.k_heat = k_heat
         self.boiling = False
         self.level_alert = False
         self.temperature_alert = False
 
+    def __setstate__(self, state: dict):
+        super().__setstate__(state)
+        if "D_in" in state:  # checkpoint without the wall thickness, solved from the outer surface
+            d, h = self.__dict__.pop("D_in"), self.__dict__.pop("h_max")
+            # max_surf / pi - d * h = 3/4 * u^2 + (h - d / 2) * u, with u = d + 2 * s the outer diameter
+            b = h - d / 2
+            u = (-b + math.sqrt(b ** 2 + 3 * (self._max_surf / math.pi - d * h))) / 1.5
+            self.set_geometry(d, (u - d) / 2, h)
+
+    def set_geometry(self, d: float, s: float, h: float):
+        """
+        Set the size of the pot, the derived values (section, steel mass, surfaces) are computed again
+        :param d: inner diameter [m]
+        :param s: wall thickness [m]
+        :param h: inner height [m]
+        """
+        self._d = d
+        self._s = s
+        self._h = h
+        self.A = d ** 2 * math.pi / 4
+        self.steal_v = math.pi / 4 * ((d + 2 * s) ** 2 * (s + h) - d ** 2 * h)
+        self.steel_m = self.steal_v * self.RHO_STEEL
+        self._max_surf = math.pi * ((d + 2 * s) * (s + h) + (d + 2 * s) ** 2 / 4 + d * h)
+        self._surface = self._max_surf - math.pi * d * self.wat_h
+        self._surface_h = self.wat_h  # water level of the cached surface
+
+    @property
+    def D_in(self) -> float:
+        return self._d
+
+    @D_in.setter
+    def D_in(self, value: float):
+        self.set_geometry(value, self._s, self._h)
+
+    @property
+    def wall(self) -> float:
+        return self._s
+
+    @wall.setter
+    def wall(self, value: float):
+        self.set_geometry(self._d, value, self._h)
+
+    @property
+    def h_max(self) -> float:
+        return self._h
+
+    @h_max.setter
+    def h_max(self, value: float):
+        self.set_geometry(self._d, self._s, value)
+
+    @property
+    def T_env(self) -> float:
+        return self.heat_loss.env_temp
+
+    @T_env.setter
+    def T_env(self, value: float):
+        self.heat_loss.env_temp = value
+
+    @property
+    def k_heat(self) -> float:
+        return self.heat_loss.k_heat
+
+    @k_heat.setter
+    def k_heat(self, value: float):
+        self.heat_loss.k_heat = value
+
     def get_surface(self):
-        return self._max_surf - math.pi * self.D_in * self.wat_h
+        """
+        :return: surface exposed to the environment (the wet surface excluded), recomputed only when the level changes
+        (set_geometry and the geometry setters update it)
+        """
+        if self.wat_h != self._surface_h:
+            self._surface = self._max_surf - math.pi * self._d * self.wat_h
+            self._surface_h = self.wat_h
+        return self._surface
 
     def run(self, current_time: float, power_in=0.0, in_flow=0.0, out_flow=0.0):
         dt = current_time - self._old_t
 
-        surface = self.get_surface()
-
-        power_out = surface * (
-                (self.T - self.T_env) * self.k_heat +  # conduction-convection
-                ((self.T + 273.15) ** 4 - (self.T_env + 273.15) ** 4) * self.SIGMA)  # radiation
+        power_out = self.heat_loss.get_power(self.T, self.get_surface())
 
         power = power_in - power_out
 
@@ -85,12 +150,12 @@ class BoilingPot:
         elif self.T <= self.T_LIMIT - 10.0:
             self.temperature_alert = False
 
-        if self.wat_h > self.h_max:
+        if self.wat_h > self._h:
             self.level_alert = True
-            self.wat_h = self.h_max
+            self.wat_h = self._h
             self.wat_v = self.wat_h * self.A
             self.wat_m = self.wat_v * self.RHO_WAT
-        elif self.wat_h <= self.h_max - 0.001:
+        elif self.wat_h <= self._h - 0.001:
             self.level_alert = False
 
 
@@ -1,21 +1,24 @@
 from .pool_boiler import BoilingPot
+from components.scheduler import FixedRateScheduler
+from components.checkpoint import CheckpointWriter, CHECKPOINT_INTERVAL
+from components.profiling import Profiler
+from pathlib import Path
 import asyncio
 from pymodbus.device import ModbusDeviceIdentification
 from pymodbus.server import ModbusTcpServer, StartAsyncTcpServer
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext, ModbusSequentialDataBlock
 from pymodbus import __version__ as pymodbus_version
 import logging
-from rich.table import Table, Row
-from rich.live import Live
-from rich.text import Text
-from rich import box
-from rich.console import Console
-from rich.style import Style
 
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pot_ui import PotUI
 
 _logger = logging.getLogger(__name__)
 
+MODBUS_PORT = 5020
+
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -27,7 +30,8 @@ class Engine:
 
     server_task: Optional[asyncio.Task]
 
-    def __init__(self, ui_table: "PotUI", time_mult=1.0, time_step=0.05, max_heater_power=20000, pump_flow_rate=0.0005):
+    def __init__(self, ui_table: Optional["PotUI"], time_mult=1.0, time_step=0.05, max_heater_power=20000, pump_flow_rate=0.0005,
+                 checkpoint_path: Optional[Path] = None, checkpoint_interval=CHECKPOINT_INTERVAL):
         self.max_heater_power = max_heater_power
         self.pump_flow_rate = pump_flow_rate
         self.boiling_pot = BoilingPot()
@@ -54,8 +58,18 @@ class Engine:
         self.server_task = None
 
         self.ui_table = ui_table
+        self.profiler = Profiler("pool_boiler")
 
         self.time = 0
+        self.scheduler = FixedRateScheduler(time_step, time_mult)
+        self.checkpoint_writer = None
+        if checkpoint_path is not None:  # periodic checkpoints of the pot, restored at startup
+            self.checkpoint_writer = CheckpointWriter(checkpoint_path, checkpoint_interval)
+            state = self.checkpoint_writer.load()
+            if state is not None:
+                self.boiling_pot = state["pot"]
+                self.time = state["time"]
+                self.scheduler.set_time(self.time)
 
         self.modbus_identification = ModbusDeviceIdentification(
             info_name={
@@ -93,12 +107,15 @@ class Engine:
 
         self.modbus_context = ModbusServerContext(slave_context, True)
 
-    def server_init(self):
+    def server_init(self, port=MODBUS_PORT):
+        """
+        :param port: Modbus TCP port
+        """
         self.server_task = asyncio.create_task(
             StartAsyncTcpServer(
                 context=self.modbus_context,  # Data storage
                 identity=self.modbus_identification,  # server identify
-                address=(None, 5020)
+                address=(None, port)
             )
         )
 
@@ -122,6 +139,8 @@ class Engine:
         self._heater_reg = min(self.holding_register_memory.values[0], 100)
 
     def update_ui(self):
+        if self.ui_table is None:
+            return
         self.ui_table.set_in_pump(self._in_pump)
         self.ui_table.set_out_pump(self._out_pump)
         self.ui_table.set_power_reg(self._heater_reg)
@@ -145,6 +164,7 @@ class Engine:
         self._pot_temperature = self.boiling_pot.T
         self._water_level = self.boiling_pot.wat_h / self.boiling_pot.h_max * 100  # %
         self._boiling_alert = self.boiling_pot.boiling
+
         self._full_alert = self.boiling_pot.level_alert
         self._burnout_alert = self.boiling_pot.temperature_alert
 
@@ -163,106 +183,36 @@ class Engine:
 
         self.server_init()
 
-        with Live(self.ui_table, console=Console()):
-            while not self.closing:
-                await self.check_memory()
-                self.run_physical_model()
-                self.update_ui()
-                await asyncio.sleep(self.time_step / self.time_mult)
-                self.time += self.time_step / self.time_mult
-
-        self.server_task.cancel()
-        await self.server_task
-
-
-class PotUI(Table):
-    def __init__(self):
-        super().__init__(title="Boiling pot master pro™", box=box.HEAVY_EDGE, expand=True, show_lines=True)
-        self.add_column("Parameter", justify="center")
-        self.add_column("Value", justify="center")
-
-        self._in_pump_value = Text("OFF")
-        self._out_pump_value = Text("OFF")
-        self._power_reg_value = Text("0%")
-
-        self._boiling_value = Text("OFF")
-        self._full_value = Text("OFF")
-        self._burn_value = Text("OFF")
-
-        self._temp_value = Text("0 °C")
-        self._water_value = Text("0%")
-
-        self._in_pump_header = Text("Inlet pump")
-        self._out_pump_header = Text("Drain pump")
-        self._power_reg_header = Text("Heater regulation")
-
-        self._boiling_header = Text("Boiling alert")
-        self._full_header = Text("Full alert")
-        self._burn_header = Text("Burnout alert")
-
-        self._temp_header = Text("Temperature")
-        self._water_header = Text("Water level")
-
-        self.add_row(self._in_pump_header, self._in_pump_value)
-        self.add_row(self._out_pump_header, self._out_pump_value)
-        self.add_row(self._power_reg_header, self._power_reg_value)
-
-        self.add_row(self._temp_header, self._temp_value)
-        self.add_row(self._water_header, self._water_value)
-
-        self.add_row(self._boiling_header, self._boiling_value)
-        self.add_row(self._full_header, self._full_value)
-        self.add_row(self._burn_header, self._burn_value)
-
-    def set_in_pump(self, pump_state: bool):
-        if pump_state:
-            self._in_pump_value.plain = "ON"
-        else:
-            self._in_pump_value.plain = "OFF"
-
-    def set_out_pump(self, pump_state: bool):
-        if pump_state:
-            self._out_pump_value.plain = "ON"
-        else:
-            self._out_pump_value.plain = "OFF"
-
-    def set_power_reg(self, reg: float):
-        self._power_reg_value.plain = f"{int(reg):d}%"
-
-    def set_temperature(self, value: float):
-        self._temp_value.plain = f"{value:.2f}°C"
-
-    def set_water_level(self, reg: float):
-        self._water_value.plain = f"{reg:.3f}%"
-
-    def set_boiling_alert(self, status: bool):
-        if status:
-            self._boiling_value.plain = "ON"
-            self.rows[5].style = Style(bgcolor="red", bold=True)
+        if self.ui_table is None:
+            await self.run_loop()
         else:
-            self._boiling_value.plain = "OFF"
-            self.rows[5].style = ""
+            from rich.live import Live
+            from rich.console import Console
 
-    def set_full_alert(self, status: bool):
-        if status:
-            self._full_value.plain = "ON"
-            self.rows[6].style = Style(bgcolor="red", bold=True)
+            with Live(self.ui_table, console=Console()):
+                await self.run_loop()
 
-        else:
-            self._full_value.plain = "OFF"
-            self.rows[6].style = ""
+        self.server_task.cancel()
+        await self.server_task
+        self.profiler.stop()
 
-    def set_burn_alert(self, status: bool):
-        if status:
-            self._burn_value.plain = "ON"
-            self.rows[7].style = Style(bgcolor="red", bold=True)
-        else:
-            self._burn_value.plain = "OFF"
-            self._burn_value.style = ""
-            self.rows[7].style = ""
+    async def run_loop(self):
+        self.scheduler.start()
+        while not self.closing:
+            with self.profiler.span("check_memory"):
+                await self.check_memory()
+            with self.profiler.span("physics"):
+                self.run_physical_model()
+            with self.profiler.span("draw"):
+                self.update_ui()
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.maybe_save(self.time, lambda: {"time": self.time, "pot": self.boiling_pot})
+            await self.scheduler.wait_next()
+            self.time = self.scheduler.time
 
 
 async def main():
+    from .pot_ui import PotUI
     engine = Engine(PotUI())
     await engine.run()
 
@@ -0,0 +1,91 @@
+from rich.table import Table
+from rich.text import Text
+from rich import box
+from rich.style import Style
+
+
+class PotUI(Table):
+    def __init__(self):
+        super().__init__(title="Boiling pot master pro™", box=box.HEAVY_EDGE, expand=True, show_lines=True)
+        self.add_column("Parameter", justify="center")
+        self.add_column("Value", justify="center")
+
+        self._in_pump_value = Text("OFF")
+        self._out_pump_value = Text("OFF")
+        self._power_reg_value = Text("0%")
+
+        self._boiling_value = Text("OFF")
+        self._full_value = Text("OFF")
+        self._burn_value = Text("OFF")
+
+        self._temp_value = Text("0 °C")
+        self._water_value = Text("0%")
+
+        self._in_pump_header = Text("Inlet pump")
+        self._out_pump_header = Text("Drain pump")
+        self._power_reg_header = Text("Heater regulation")
+
+        self._boiling_header = Text("Boiling alert")
+        self._full_header = Text("Full alert")
+        self._burn_header = Text("Burnout alert")
+
+        self._temp_header = Text("Temperature")
+        self._water_header = Text("Water level")
+
+        self.add_row(self._in_pump_header, self._in_pump_value)
+        self.add_row(self._out_pump_header, self._out_pump_value)
+        self.add_row(self._power_reg_header, self._power_reg_value)
+
+        self.add_row(self._temp_header, self._temp_value)
+        self.add_row(self._water_header, self._water_value)
+
+        self.add_row(self._boiling_header, self._boiling_value)
+        self.add_row(self._full_header, self._full_value)
+        self.add_row(self._burn_header, self._burn_value)
+
+    def set_in_pump(self, pump_state: bool):
+        if pump_state:
+            self._in_pump_value.plain = "ON"
+        else:
+            self._in_pump_value.plain = "OFF"
+
+    def set_out_pump(self, pump_state: bool):
+        if pump_state:
+            self._out_pump_value.plain = "ON"
+        else:
+            self._out_pump_value.plain = "OFF"
+
+    def set_power_reg(self, reg: float):
+        self._power_reg_value.plain = f"{int(reg):d}%"
+
+    def set_temperature(self, value: float):
+        self._temp_value.plain = f"{value:.2f}°C"
+
+    def set_water_level(self, reg: float):
+        self._water_value.plain = f"{reg:.3f}%"
+
+    def set_boiling_alert(self, status: bool):
+        if status:
+            self._boiling_value.plain = "ON"
+            self.rows[5].style = Style(bgcolor="red", bold=True)
+        else:
+            self._boiling_value.plain = "OFF"
+            self.rows[5].style = ""
+
+    def set_full_alert(self, status: bool):
+        if status:
+            self._full_value.plain = "ON"
+            self.rows[6].style = Style(bgcolor="red", bold=True)
+
+        else:
+            self._full_value.plain = "OFF"
+            self.rows[6].style = ""
+
+    def set_burn_alert(self, status: bool):
+        if status:
+            self._burn_value.plain = "ON"
+            self.rows[7].style = Style(bgcolor="red", bold=True)
+        else:
+            self._burn_value.plain = "OFF"
+            self._burn_value.style = ""
+            self.rows[7].style = ""
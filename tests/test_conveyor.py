@@ -0,0 +1,105 @@
+from typing import Optional
+from pathlib import Path
+import random
+import numpy as np
+from box_conveyor.box_conveyor import Conveyor
+from box_conveyor.line import Gauge, Rejector
+from components.checkpoint import CheckpointWriter, save
+
+LINE = {
+    "cells": 200,
+    "speed": 1000,
+    "stations": [{"type": "gauge", "position": 60}, {"type": "gauge", "position": 120},
+                 {"type": "rejector", "position": 150}],
+    "arrivals": {"type": "poisson", "rate": 2000},
+}
+
+
+def step(conveyor: Conveyor, dt: Optional[float] = None) -> int:
+    """
+    Advance the conveyor and check the belt and the counters
+    :return: number of boxes that left the end of the belt in the step
+    """
+    previous = list(conveyor.boxes)
+    count = conveyor.boxes_count
+    rejectors = [station for station in conveyor.stations if isinstance(station, Rejector)]
+    removed = sum(rejector.removed for rejector in rejectors)
+    conveyor.advance(dt)
+    conveyor.check_invariants(previous)
+
+    assert conveyor.boxes_count == conveyor.boxes_accepted + conveyor.boxes_rejected
+    assert conveyor.boxes_count - count == len(conveyor.measured)
+    gauges = [station for station in conveyor.stations if isinstance(station, Gauge)]
+    assert gauges[-1].measured == conveyor.boxes_count
+    current = set(map(id, conveyor.boxes))
+    dropped = [box for box in previous if id(box) not in current]
+    exited = [box for box in dropped if box.position >= conveyor.cells]
+    assert sum(rejector.removed for rejector in rejectors) - removed == len(dropped) - len(exited)
+    return len(exited)
+
+
+def test_invariants():
+    random.seed(1)
+    conveyor = Conveyor()
+    for _ in range(5 * conveyor.cells):
+        assert step(conveyor) <= 1
+    assert conveyor.boxes_count > 0
+
+    # shorter belt: the three oldest boxes leave in the same step
+    conveyor.cells = int(conveyor.boxes[2].position) + 1
+    assert step(conveyor) == 3
+    for _ in range(5 * conveyor.cells):
+        step(conveyor)
+
+
+def test_invariants_rejector_line():
+    random.seed(2)
+    conveyor = Conveyor.from_config(LINE)  # 10 cells per step: several boxes cross a station or leave in one step
+    exited = 0
+    for _ in range(200):
+        exited += step(conveyor, 0.01)
+    rejector = conveyor.stations[-1]
+    assert exited > 0 and rejector.removed > 0 and conveyor.boxes_accepted > 0
+
+    conveyor.cells = 160
+    assert step(conveyor, 0.01) > 10
+    for _ in range(200):
+        step(conveyor, 0.01)
+    assert conveyor.boxes_count == conveyor.stations[1].measured
+
+
+def test_fork():
+    conveyor = Conveyor.from_config(LINE)
+    for _ in range(300):
+        conveyor.advance(0.01)
+    conveyor.spc.report(conveyor.ref_mes, conveyor.thresholds)  # merged statistics and pending measures
+    for _ in range(10):
+        conveyor.advance(0.01)
+
+    copy = conveyor.fork()
+    assert copy is not conveyor
+    assert [box.serial for box in copy.boxes] == [box.serial for box in conveyor.boxes]
+    assert (copy.boxes_count, copy.boxes_accepted, copy.boxes_rejected) == \
+           (conveyor.boxes_count, conveyor.boxes_accepted, conveyor.boxes_rejected)
+    assert copy.spc.pending == conveyor.spc.pending
+    for name in ("mean", "m2", "ewma", "window"):
+        assert isinstance(getattr(copy.spc, name), np.ndarray)
+        assert np.array_equal(getattr(copy.spc, name), getattr(conveyor.spc, name))
+    assert copy.spc.report(copy.ref_mes, copy.thresholds) == conveyor.spc.report(conveyor.ref_mes, conveyor.thresholds)
+
+    copy.advance(0.01)  # the copy runs on its own
+    assert copy.belt_time > conveyor.belt_time
+
+
+def test_restore(tmp_path: Path):
+    conveyor = Conveyor()
+    for _ in range(100):
+        conveyor.advance()
+    path = tmp_path / "conveyor.ckpt"
+    save(path, {"time": 12.5, "conveyor": conveyor})
+
+    state = CheckpointWriter(path).load()
+    assert state is not None
+    assert state["time"] == 12.5
+    assert state["conveyor"].boxes_count == conveyor.boxes_count
+    assert state["conveyor"].spc.count + len(state["conveyor"].spc.pending) == conveyor.boxes_count